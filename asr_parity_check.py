@@ -0,0 +1,88 @@
+"""
+Compares an alternative ASR backend against the PyTorch reference on the bundled example clips.
+
+Usage:
+    python asr_parity_check.py --backend torch_int8
+    python asr_parity_check.py --backend onnx --max-cer 0.05 models/SenseVoiceSmall/example/zh.mp3
+
+For every clip both backends transcribe the audio (with VAD, as the server
+does); the script prints both transcripts, the character error rate of the
+candidate against the reference and the per-clip latency of each backend. It
+exits with status 1 if any clip exceeds --max-cer.
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+
+import transcribe_audio as asr
+
+DEFAULT_CLIPS = os.path.join(asr.MODEL_IDENTIFIER, "example", "*.mp3")
+
+def character_error_rate(reference, hypothesis):
+    """Levenshtein distance over characters (whitespace ignored) divided by the reference length."""
+    ref = [c for c in reference if not c.isspace()]
+    hyp = [c for c in hypothesis if not c.isspace()]
+    if not ref:
+        return 0.0 if not hyp else 1.0
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i]
+        for j, h in enumerate(hyp, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h)))
+        previous = current
+    return previous[-1] / len(ref)
+
+def transcribe_clip(model, path, runs):
+    """Returns (post-processed text, best latency in seconds over `runs` runs)."""
+    best, raw_text = None, ""
+    for _ in range(runs):
+        started = time.perf_counter()
+        raw_text = asr.run_transcription_batch(model, [path], asr.MODEL_SAMPLERATE, use_vad=True)[0]
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return asr.rich_transcription_postprocess(raw_text) if raw_text else "", best
+
+def main():
+    parser = argparse.ArgumentParser(description="Check an ASR backend's transcripts against the PyTorch reference.")
+    parser.add_argument("clips", nargs="*", help=f"Audio files to compare (default: {DEFAULT_CLIPS})")
+    parser.add_argument("--backend", default="torch_int8", choices=[b for b in asr.ASR_BACKENDS if b != "torch"])
+    parser.add_argument("--max-cer", type=float, default=0.05, help="Fail if any clip's CER exceeds this (default 0.05)")
+    parser.add_argument("--runs", type=int, default=3, help="Timed runs per clip and backend; the best is reported")
+    args = parser.parse_args()
+
+    clips = args.clips or sorted(glob.glob(DEFAULT_CLIPS))
+    if not clips:
+        print(f"ERROR: No clips found (looked for {DEFAULT_CLIPS}).", file=sys.stderr)
+        return 2
+
+    reference = asr.load_funasr_sensevoice_model("torch")
+    candidate = asr.load_funasr_sensevoice_model(args.backend)
+    if reference is None or candidate is None:
+        print("ERROR: Failed to load one of the backends.", file=sys.stderr)
+        return 2
+    # One untimed pass each so lazy initialization does not count against the first clip.
+    transcribe_clip(reference, clips[0], 1)
+    transcribe_clip(candidate, clips[0], 1)
+
+    failures, total_ref_s, total_cand_s = 0, 0.0, 0.0
+    for path in clips:
+        ref_text, ref_s = transcribe_clip(reference, path, args.runs)
+        cand_text, cand_s = transcribe_clip(candidate, path, args.runs)
+        cer = character_error_rate(ref_text, cand_text)
+        total_ref_s += ref_s
+        total_cand_s += cand_s
+        status = "OK" if cer <= args.max_cer else "FAIL"
+        failures += status == "FAIL"
+        print(f"[{status}] {os.path.basename(path)}: CER {cer:.3f}, torch {ref_s * 1000:.0f} ms, {args.backend} {cand_s * 1000:.0f} ms")
+        print(f"    torch:           {ref_text}")
+        print(f"    {args.backend + ':':<16} {cand_text}")
+
+    print(f"\nTotal latency: torch {total_ref_s * 1000:.0f} ms, {args.backend} {total_cand_s * 1000:.0f} ms "
+          f"(speed-up x{total_ref_s / total_cand_s:.2f})" if total_cand_s > 0 else "")
+    print(f"{len(clips) - failures}/{len(clips)} clips within CER {args.max_cer}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,286 @@
+"""
+Load generator for the transcription server's /transcribe endpoint.
+
+Usage:
+    python benchmark_asr.py --concurrency 1,4,8 --output bench/HEAD.json
+    python benchmark_asr.py --concurrency 1,4,8 --compare bench/baseline.json
+
+The workload is the bundled example clips (models/SenseVoiceSmall/example/*.mp3)
+plus synthetic concatenations of them (--concat-seconds), written as 16 kHz
+WAV files under the server's audio directory and replayed at each concurrency
+level. Per level it reports throughput, real-time factor and latency
+percentiles, plus the server's own span timings. Everything runs against a
+local server, so no network access is needed; run the server with
+CUDA_VISIBLE_DEVICES= to benchmark the CPU path.
+
+Every request gets a copy of its clip with one sample changed by one LSB, so
+the server's transcription cache (ASR_CACHE) cannot answer it; pass
+--allow-cache to measure cache hits instead.
+
+With --compare, exits with status 1 if any level's p95 latency rose, or its
+throughput fell, by more than --max-regression against the baseline file.
+"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import shutil
+import platform
+import argparse
+import itertools
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+import soundfile as sf
+
+import transcribe_audio as asr
+from latency_report import percentile
+
+DEFAULT_URL = os.getenv("SENSEVOICE_API_URL", "http://localhost:8001/transcribe")
+DEFAULT_CLIPS = os.path.join(asr.MODEL_IDENTIFIER, "example", "*.mp3")
+BENCH_SUBDIR = "bench" # Under the server's audio directory
+CONCAT_GAP_S = 0.3 # Silence between concatenated clips
+
+def load_clips(pattern):
+    """Decodes the example clips to 16 kHz float32 mono, as the server would."""
+    clips = []
+    for path in sorted(glob.glob(pattern)):
+        waveform = asr.load_audio_text_image_video(path, fs=asr.MODEL_SAMPLERATE)
+        samples = waveform.numpy() if hasattr(waveform, "numpy") else np.asarray(waveform, dtype=np.float32)
+        clips.append((os.path.splitext(os.path.basename(path))[0], samples.astype(np.float32)))
+    return clips
+
+def build_workload(clips, concat_seconds):
+    """The clips themselves plus, per target length, the clips repeated in order until that length is reached."""
+    workload = list(clips)
+    gap = np.zeros(int(CONCAT_GAP_S * asr.MODEL_SAMPLERATE), dtype=np.float32)
+    for seconds in concat_seconds:
+        parts, total = [], 0
+        for _, samples in itertools.cycle(clips):
+            parts.extend((samples, gap))
+            total += len(samples) + len(gap)
+            if total >= seconds * asr.MODEL_SAMPLERATE:
+                break
+        workload.append((f"concat_{seconds:g}s", np.concatenate(parts[:-1])))
+    return workload
+
+def to_pcm16(samples):
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16)
+
+class Benchmark:
+    """Replays a workload against /transcribe with a fixed number of concurrent clients."""
+
+    def __init__(self, url, audio_dir, workload, allow_cache=False, timeout=300):
+        self.url = url
+        self.bench_dir = os.path.join(audio_dir, BENCH_SUBDIR)
+        self.workload = [(name, to_pcm16(samples)) for name, samples in workload]
+        self.allow_cache = allow_cache
+        self.timeout = timeout
+        self.request_ids = itertools.count()
+        self.local = threading.local()
+        os.makedirs(self.bench_dir, exist_ok=True)
+        if allow_cache:
+            for name, pcm in self.workload:
+                sf.write(os.path.join(self.bench_dir, f"{name}.wav"), pcm, asr.MODEL_SAMPLERATE, subtype='PCM_16')
+
+    def _session(self):
+        if not hasattr(self.local, "session"):
+            self.local.session = requests.Session()
+        return self.local.session
+
+    def _request(self, index):
+        """Sends one request; returns a result dict. File preparation is not timed."""
+        name, pcm = self.workload[index % len(self.workload)]
+        request_id = next(self.request_ids)
+        if self.allow_cache:
+            filename = f"{name}.wav"
+        else:
+            filename = f"{name}_{request_id}.wav"
+            pcm = pcm.copy()
+            pcm[request_id % len(pcm)] ^= 1 # Unique content, inaudible
+            sf.write(os.path.join(self.bench_dir, filename), pcm, asr.MODEL_SAMPLERATE, subtype='PCM_16')
+        payload = {"audio_path": f"{BENCH_SUBDIR}/{filename}", "sample_rate": asr.MODEL_SAMPLERATE}
+        result = {"clip": name, "audio_s": len(pcm) / asr.MODEL_SAMPLERATE, "ok": False}
+        started = time.perf_counter()
+        try:
+            response = self._session().post(self.url, json=payload, headers={"X-Request-ID": f"bench-{request_id}"}, timeout=self.timeout)
+            body = response.json()
+            result["ok"] = response.ok and "transcription" in body
+            result["timings"] = body.get("timings") or {}
+            if not result["ok"]:
+                result["error"] = body.get("error", f"HTTP {response.status_code}")
+        except (requests.exceptions.RequestException, ValueError) as e:
+            result["error"] = f"{type(e).__name__}: {e}"
+        result["latency_s"] = time.perf_counter() - started
+        if not self.allow_cache:
+            try:
+                os.remove(os.path.join(self.bench_dir, filename))
+            except OSError:
+                pass
+        return result
+
+    def run(self, concurrency, num_requests, order):
+        """Runs num_requests requests (workload indices taken from `order`) with `concurrency` clients."""
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(self._request, order[:num_requests]))
+        return summarize(results, time.perf_counter() - started, concurrency)
+
+    def close(self):
+        shutil.rmtree(self.bench_dir, ignore_errors=True)
+
+def summarize(results, wall_s, concurrency):
+    ok = [r for r in results if r["ok"]]
+    summary = {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": len(results) - len(ok),
+        "wall_s": round(wall_s, 3),
+    }
+    if not ok:
+        return summary
+    latencies_ms = [r["latency_s"] * 1000.0 for r in ok]
+    audio_s = sum(r["audio_s"] for r in ok)
+    summary.update({
+        "throughput_rps": round(len(ok) / wall_s, 3),
+        "audio_s_per_s": round(audio_s / wall_s, 3), # Seconds of audio transcribed per wall-clock second
+        "rtf": round(sum(r["latency_s"] for r in ok) / audio_s, 4), # Request latency / audio duration, averaged by duration
+        "latency_ms": {
+            "mean": round(sum(latencies_ms) / len(latencies_ms), 1),
+            **{f"p{q}": round(percentile(latencies_ms, q), 1) for q in (50, 90, 95, 99)},
+            "max": round(max(latencies_ms), 1),
+        },
+        "server_ms": {},
+    })
+    spans = {}
+    for r in ok:
+        for name, value in r["timings"].items():
+            if name.endswith("_ms") and isinstance(value, (int, float)):
+                spans.setdefault(name, []).append(value)
+    for name, values in sorted(spans.items()):
+        summary["server_ms"][name] = {"p50": round(percentile(values, 50), 1), "p95": round(percentile(values, 95), 1)}
+    errors = [r.get("error") for r in results if not r["ok"]]
+    if errors:
+        summary["first_error"] = errors[0]
+    return summary
+
+def print_summary(summary):
+    if "latency_ms" not in summary:
+        print(f"  concurrency {summary['concurrency']:>3}: all {summary['requests']} requests failed")
+        return
+    lat = summary["latency_ms"]
+    print(f"  concurrency {summary['concurrency']:>3}: {summary['throughput_rps']:.2f} req/s, "
+          f"{summary['audio_s_per_s']:.1f} audio s/s, RTF {summary['rtf']:.3f}, "
+          f"latency p50 {lat['p50']:.0f} / p95 {lat['p95']:.0f} / p99 {lat['p99']:.0f} ms, "
+          f"errors {summary['errors']}/{summary['requests']}")
+    if summary.get("server_ms"):
+        print("      server p50: " + ", ".join(f"{name} {stats['p50']:.0f}" for name, stats in summary["server_ms"].items()))
+
+def compare(current, baseline, max_regression):
+    """Prints per-level deltas against a baseline result file; returns the number of regressions."""
+    baseline_levels = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    regressions = 0
+    print(f"\nComparison with {baseline.get('meta', {}).get('git_commit') or 'baseline'}:")
+    for level in current["levels"]:
+        base = baseline_levels.get(level["concurrency"])
+        if base is None or "latency_ms" not in base or "latency_ms" not in level:
+            print(f"  concurrency {level['concurrency']:>3}: no comparable baseline")
+            continue
+        p95_change = level["latency_ms"]["p95"] / base["latency_ms"]["p95"] - 1.0
+        rps_change = level["throughput_rps"] / base["throughput_rps"] - 1.0
+        regressed = p95_change > max_regression or rps_change < -max_regression
+        regressions += regressed
+        print(f"  concurrency {level['concurrency']:>3}: p95 {base['latency_ms']['p95']:.0f} -> {level['latency_ms']['p95']:.0f} ms ({p95_change:+.1%}), "
+              f"throughput {base['throughput_rps']:.2f} -> {level['throughput_rps']:.2f} req/s ({rps_change:+.1%})"
+              f"{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def fetch_server_stats(url):
+    try:
+        return requests.get(url.rsplit("/", 1)[0] + "/stats", timeout=10).json()
+    except (requests.exceptions.RequestException, ValueError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the transcription server's /transcribe endpoint.")
+    parser.add_argument("--url", default=DEFAULT_URL, help=f"/transcribe endpoint (default: {DEFAULT_URL})")
+    parser.add_argument("--clips", default=DEFAULT_CLIPS, help=f"Glob of source clips (default: {DEFAULT_CLIPS})")
+    parser.add_argument("--concat-seconds", default="15,30,60", help="Lengths of synthetic concatenations, comma-separated ('' for none)")
+    parser.add_argument("--concurrency", default="1,4,8", help="Concurrency levels to run, comma-separated")
+    parser.add_argument("--requests", type=int, default=40, help="Requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=2, help="Untimed requests before the first level")
+    parser.add_argument("--audio-dir", default="audio", help="The server's audio directory (its CWD/audio)")
+    parser.add_argument("--allow-cache", action="store_true", help="Replay identical files so the server cache can answer")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the request order")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON file from an earlier run")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="Allowed relative p95/throughput change with --compare")
+    args = parser.parse_args()
+
+    concat_seconds = [float(x) for x in args.concat_seconds.split(",") if x.strip()]
+    levels = [int(x) for x in args.concurrency.split(",") if x.strip()]
+    clips = load_clips(args.clips)
+    if not clips:
+        print(f"ERROR: No clips found (looked for {args.clips}).", file=sys.stderr)
+        return 2
+    workload = build_workload(clips, concat_seconds)
+    print(f"Workload: {len(workload)} clips, " + ", ".join(f"{name} {len(s) / asr.MODEL_SAMPLERATE:.1f}s" for name, s in workload))
+
+    order = list(range(args.requests))
+    random.Random(args.seed).shuffle(order)
+    bench = Benchmark(args.url, args.audio_dir, workload, args.allow_cache)
+    try:
+        warmup = bench.run(1, args.warmup, list(range(args.warmup)))
+        if args.warmup and warmup["errors"] == warmup["requests"]:
+            print(f"ERROR: Warm-up requests failed ({warmup.get('first_error')}). Is the server running at {args.url}?", file=sys.stderr)
+            return 2
+        results = []
+        print(f"Running {args.requests} requests per level against {args.url}:")
+        for concurrency in levels:
+            summary = bench.run(concurrency, args.requests, order)
+            print_summary(summary)
+            results.append(summary)
+    finally:
+        bench.close()
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_commit": git_commit(),
+            "url": args.url,
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "workload": {name: round(len(s) / asr.MODEL_SAMPLERATE, 2) for name, s in workload},
+            "requests_per_level": args.requests,
+            "allow_cache": args.allow_cache,
+        },
+        "levels": results,
+        "server_stats": fetch_server_stats(args.url),
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.max_regression):
+            return 1
+    return 1 if any(level["errors"] for level in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,329 @@
+"""
+Headless end-to-end benchmark of main.py's turn pipeline.
+
+Usage:
+    python benchmark_pipeline.py audio/sample1.wav audio/sample2.wav --turns 20
+    python benchmark_pipeline.py audio/*.wav --mock-asr --ttft-ms 300 --token-ms 30 --output bench/pipeline.json
+
+Each turn feeds a WAV file into an AudioRingBuffer as if it had been captured
+(in real time, so streaming uploads behave as with a microphone), then submits
+it to the same TurnPipeline the space bar uses: ASR (transcribe_audio_by_path
+or the streaming upload), get_llm_response_langchain and sentence-by-sentence
+TTS playback. No microphone, keyboard hook, speakers or display is needed
+(sounddevice and keyboard are replaced by stubs before main.py is imported):
+
+- The LLM is a local stand-in OpenAI-compatible server (/v1/chat/completions,
+  streaming and not) with configurable time to first token and per-token delay.
+- Speech is synthesized by a null backend that produces silence proportional
+  to the text length, and played on a null output stream that only waits for
+  the audio's duration (--fast-playback skips that wait).
+- ASR goes to the real transcription server configured in .env, or with
+  --mock-asr to the stand-in server, which answers after --asr-ms.
+
+The per-turn traces from main.py are summarized as p50/p95 per milestone
+(ms since the simulated key release) and per stage.
+"""
+import os
+import sys
+import json
+import time
+import types
+import argparse
+import threading
+import itertools
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import soundfile as sf
+import soxr
+
+from latency_report import summarize_records, format_summary
+
+DEFAULT_REPLY = "今天天气晴朗，气温二十五度左右。适合出门散步或者运动。记得多喝水，注意防晒。"
+DEFAULT_TRANSCRIPT = "今天天气怎么样？"
+CAPTURE_BLOCK_S = 0.02 # Size of the simulated input callback blocks
+
+# Stages derived from the trace milestones: name -> (from mark, to mark)
+STAGES = {
+    "stage.asr": ("key_release", "asr_response"),
+    "stage.llm_first_token": ("asr_response", "first_token"),
+    "stage.llm_stream": ("first_token", "last_token"),
+    "stage.tts_first_audio": ("first_token", "first_audio"),
+    "stage.playback": ("first_audio", "playback_end"),
+    "total": ("key_release", "playback_end"),
+}
+
+# --- Stand-in OpenAI-compatible / transcription server ---
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, args):
+        super().__init__(("127.0.0.1", 0), MockRequestHandler)
+        self.args = args
+        self.request_ids = itertools.count(1)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def tokens(self):
+        text, size = self.args.reply, max(1, self.args.chars_per_token)
+        return [text[i:i + size] for i in range(0, len(text), size)]
+
+class MockRequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.0: the connection closes after each response, so streamed bodies need no framing.
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_body(self):
+        if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return bytes(body)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send_json(self, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self._read_body()
+        args = self.server.args
+        if self.path.endswith("/chat/completions"):
+            self._chat_completion(json.loads(body or b"{}"))
+        elif self.path.endswith("/transcribe") or self.path.endswith("/transcribe_stream"):
+            time.sleep(args.asr_ms / 1000.0)
+            self._send_json({"transcription": args.transcript, "timings": {"mock_asr_ms": args.asr_ms, "request_id": self.headers.get("X-Request-ID")}})
+        else:
+            self.send_error(404)
+
+    def _chat_completion(self, request):
+        args = self.server.args
+        completion_id = f"chatcmpl-mock-{next(self.server.request_ids)}"
+        model = request.get("model", "mock-model")
+        tokens = self.server.tokens()
+        time.sleep(args.ttft_ms / 1000.0)
+        if not request.get("stream"):
+            time.sleep(args.token_ms * (len(tokens) - 1) / 1000.0)
+            self._send_json({
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": args.reply}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def send(delta, finish_reason=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(args.token_ms / 1000.0)
+            send({"role": "assistant", "content": token} if i == 0 else {"content": token})
+        send({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+
+# --- Null audio devices ---
+class NullTtsBackend:
+    """Synthesizes silence: len(text) / chars_per_s seconds of audio after ms_per_char of 'synthesis' time."""
+    name = "null"
+    SAMPLERATE = 22050
+
+    def __init__(self, chars_per_s, ms_per_char):
+        self.chars_per_s = chars_per_s
+        self.ms_per_char = ms_per_char
+
+    def voice_key(self):
+        return (self.name, self.chars_per_s)
+
+    def synthesize(self, text):
+        time.sleep(len(text) * self.ms_per_char / 1000.0)
+        yield np.zeros(int(len(text) / self.chars_per_s * self.SAMPLERATE), dtype=np.float32), self.SAMPLERATE
+
+class NullOutputStream:
+    """Stands in for sd.OutputStream: write() takes as long as the audio would play (unless realtime is off)."""
+    realtime = True
+
+    def __init__(self, samplerate, channels=1, dtype='float32', **kwargs):
+        self.samplerate = samplerate
+        self.active = False
+        self.closed = False
+
+    def start(self):
+        self.active = True
+
+    def write(self, data):
+        if self.realtime:
+            time.sleep(len(data) / self.samplerate)
+
+    def stop(self):
+        self.active = False
+
+    abort = stop
+
+    def close(self):
+        self.active, self.closed = False, True
+
+def install_device_stubs():
+    """
+    Puts stand-ins for sounddevice and keyboard into sys.modules, so importing
+    main.py neither loads PortAudio (which fails without an audio device) nor
+    the keyboard hook library (which needs root on Linux).
+    """
+    class PortAudioError(Exception):
+        pass
+
+    def no_input_device(*args, **kwargs):
+        raise PortAudioError("No input device in the headless benchmark")
+
+    sounddevice = types.ModuleType("sounddevice")
+    sounddevice.PortAudioError = PortAudioError
+    sounddevice.OutputStream = NullOutputStream
+    sounddevice.InputStream = sounddevice.check_input_settings = sounddevice.query_devices = no_input_device
+    sounddevice.stop = lambda *args, **kwargs: None
+    keyboard = types.ModuleType("keyboard")
+    keyboard.unhook_all = keyboard.on_press_key = keyboard.on_release_key = lambda *args, **kwargs: None
+    sys.modules["sounddevice"] = sounddevice
+    sys.modules["keyboard"] = keyboard
+
+# --- Driver ---
+def load_wav(path, samplerate):
+    """Reads a WAV file as mono int16 at `samplerate` (the capture format the driver simulates)."""
+    samples, file_rate = sf.read(path, dtype='float32', always_2d=True)
+    samples = samples.mean(axis=1)
+    if file_rate != samplerate:
+        samples = soxr.resample(samples, file_rate, samplerate)
+    return (np.clip(samples, -1.0, 1.0) * 32767).astype(np.int16).reshape(-1, 1)
+
+def configure_environment(args, server):
+    """Settings for main.py, applied before it is imported (load_dotenv does not override them)."""
+    os.environ.update({
+        "OPENAI_BASE_URL": server.base_url + "/v1",
+        "OPENAI_API_KEY": "mock",
+        "OPENAI_MODEL_NAME": "mock-model",
+        "SHOW_LLM_RESPONSE_POPUP": "False",
+        "LLM_WARMUP": "False",
+        "LLM_CACHE": str(args.llm_cache),
+        "STREAMING_UPLOAD": str(args.streaming_upload),
+        "STREAM_LLM_RESPONSE": str(not args.no_stream_llm),
+        "PERSISTENT_INPUT_STREAM": "False",
+        "ENABLE_TTS": "False", # Skips the real engine; the null backend is installed after import
+        "LATENCY_TRACE_FILE": args.trace_file or "",
+    })
+    if args.mock_asr:
+        os.environ["SENSEVOICE_API_URL"] = server.base_url + "/transcribe"
+        os.environ["SENSEVOICE_STREAM_API_URL"] = server.base_url + "/transcribe_stream"
+    install_device_stubs()
+
+def run_turn(main, pcm, realtime_capture):
+    """Captures `pcm` into a fresh ring buffer, submits the turn and waits for the pipeline to finish it."""
+    samplerate = main.ASR_SAMPLERATE
+    trace = main.TurnTrace()
+    trace.mark("record_start")
+    ring = main.AudioRingBuffer(len(pcm) + 1, 1, 'int16')
+    upload = None
+    if main.STREAMING_UPLOAD:
+        upload = main.StreamingUploadSession(ring, main.AsrPcmConverter(samplerate, 'int16'), 0, trace)
+        upload.start()
+    block = int(samplerate * CAPTURE_BLOCK_S)
+    started = time.perf_counter()
+    for offset in range(0, len(pcm), block):
+        if realtime_capture:
+            time.sleep(max(0.0, started + offset / samplerate - time.perf_counter()))
+        ring.write(pcm[offset:offset + block])
+    trace.mark("key_release")
+    main.turn_pipeline.submit(main.Turn(ring, 0, ring.frames_written, upload, trace=trace))
+    while main.turn_pipeline.busy():
+        time.sleep(0.005)
+
+def stage_records(records):
+    """Turns trace records into records of stage durations, for summarize_records()."""
+    staged = []
+    for record in records:
+        marks = record["marks_ms"]
+        durations = {}
+        for name, (start, end) in STAGES.items():
+            if start in marks and end in marks: # LLM stages are absent for cache hits
+                durations[name] = marks[end] - marks[start]
+        staged.append({"marks_ms": durations})
+    return staged
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Drive main.py's turn pipeline headlessly with WAV input and a mock LLM.")
+    parser.add_argument("wav_files", nargs="+", help="WAV files used as utterances, in rotation")
+    parser.add_argument("--turns", type=int, default=10, help="Number of turns to run")
+    parser.add_argument("--gap-s", type=float, default=0.5, help="Idle time between turns")
+    parser.add_argument("--fast-capture", action="store_true", help="Write each utterance at once instead of in real time")
+    parser.add_argument("--fast-playback", action="store_true", help="Do not wait for the null sink to 'play' the audio")
+    parser.add_argument("--streaming-upload", action="store_true", help="Stream audio to the ASR server while 'recording'")
+    parser.add_argument("--no-stream-llm", action="store_true", help="Wait for the whole reply instead of streaming it")
+    parser.add_argument("--llm-cache", action="store_true", help="Keep main.py's LLM response cache enabled")
+    parser.add_argument("--mock-asr", action="store_true", help="Answer transcription requests from the stand-in server")
+    parser.add_argument("--asr-ms", type=float, default=200, help="Mock ASR response delay")
+    parser.add_argument("--transcript", default=DEFAULT_TRANSCRIPT, help="Mock ASR transcript")
+    parser.add_argument("--reply", default=DEFAULT_REPLY, help="Mock LLM reply text")
+    parser.add_argument("--ttft-ms", type=float, default=300, help="Mock LLM time to first token")
+    parser.add_argument("--token-ms", type=float, default=30, help="Mock LLM delay between tokens")
+    parser.add_argument("--chars-per-token", type=int, default=2, help="Reply characters per streamed token")
+    parser.add_argument("--tts-chars-per-s", type=float, default=5.0, help="Null TTS speaking rate")
+    parser.add_argument("--tts-ms-per-char", type=float, default=5.0, help="Null TTS synthesis time per character")
+    parser.add_argument("--trace-file", help="Also append the raw per-turn traces to this JSONL file")
+    parser.add_argument("--output", help="Write the summary as JSON to this file")
+    args = parser.parse_args()
+
+    server = MockServer(args)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    configure_environment(args, server)
+
+    import main # After configure_environment(), so the stand-in settings take effect
+    NullOutputStream.realtime = not args.fast_playback
+    main.tts_backend = NullTtsBackend(args.tts_chars_per_s, args.tts_ms_per_char)
+    main.ENABLE_TTS = True
+    main.capture_format = (main.ASR_SAMPLERATE, 'int16')
+    main.turn_pipeline = main.TurnPipeline()
+
+    utterances = [load_wav(path, main.ASR_SAMPLERATE) for path in args.wav_files]
+    print(f"Running {args.turns} turns (ASR: {'mock' if args.mock_asr else main.SENSEVOICE_API_URL}, "
+          f"LLM: mock at {server.base_url}, ttft {args.ttft_ms:g} ms, {args.token_ms:g} ms/token)")
+    for i in range(args.turns):
+        run_turn(main, utterances[i % len(utterances)], not args.fast_capture)
+        time.sleep(args.gap_s)
+    server.shutdown()
+
+    records = [record for record in main.latency_log.records if record["outcome"] == "ok"]
+    failed = len(main.latency_log.records) - len(records)
+    if not records:
+        print(f"ERROR: No turn completed ({failed} failed).", file=sys.stderr)
+        return 1
+    milestones = summarize_records(records)
+    stages = summarize_records(stage_records(records))
+    cache_hits = sum("llm_cache_hit" in record["marks_ms"] for record in records)
+    print(f"\n{len(records)} turns completed, {failed} failed, {cache_hits} answered from the LLM response cache.")
+    print("Milestones (ms since key release):")
+    print(format_summary(milestones))
+    print("\nStages (ms):")
+    print(format_summary(stages))
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "completed": len(records), "failed": failed, "llm_cache_hits": cache_hits, "milestones": milestones, "stages": stages}, f, indent=2, ensure_ascii=False)
+        print(f"Summary written to {args.output}")
+    return 0 if not failed else 1
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
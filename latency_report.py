@@ -0,0 +1,101 @@
+"""
+Summarizes the per-turn latency traces written by main.py (LATENCY_TRACE_FILE).
+
+Usage:
+    python latency_report.py
+    python latency_report.py traces/latency.jsonl --all
+
+Every line of the file is one turn. Client marks are milliseconds since the
+space bar was released (key_release = 0); server spans are the timings the
+transcription server returned for that turn's request ID. The report prints
+count, p50, p95 and max per mark and per server span. By default only turns
+that completed normally are included; --all also counts cancelled and failed
+turns.
+"""
+import os
+import sys
+import json
+import argparse
+
+DEFAULT_TRACE_FILE = os.path.join(".", "traces", "latency.jsonl")
+
+# Client marks in pipeline order; anything else is reported after these.
+MARK_ORDER = (
+    "record_start", "key_release", "wav_written", "asr_response", "llm_cache_hit",
+    "first_token", "last_token", "first_audio", "playback_end",
+)
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list (q in 0..100)."""
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100)) # ceil(n * q / 100)
+    return ordered[int(rank) - 1]
+
+def summarize_records(records):
+    """Returns {name: {count, p50, p95, max}} over the client marks ('marks_ms') and server spans ('server')."""
+    samples = {}
+    for record in records:
+        for name, value in (record.get("marks_ms") or {}).items():
+            samples.setdefault(name, []).append(value)
+        for name, value in (record.get("server") or {}).items():
+            if name.endswith("_ms") and isinstance(value, (int, float)):
+                samples.setdefault("server." + name, []).append(value)
+    rank = {name: i for i, name in enumerate(MARK_ORDER)}
+    ordered = sorted(samples, key=lambda name: (name.startswith("server."), rank.get(name, len(rank)), name))
+    return {
+        name: {
+            "count": len(samples[name]),
+            "p50": percentile(samples[name], 50),
+            "p95": percentile(samples[name], 95),
+            "max": max(samples[name]),
+        }
+        for name in ordered
+    }
+
+def format_summary(summary):
+    """Renders summarize_records() output as an aligned text table."""
+    lines = [f"{'stage':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"]
+    for name, stats in summary.items():
+        lines.append(f"{name:<28}{stats['count']:>7}{stats['p50']:>10.0f}{stats['p95']:>10.0f}{stats['max']:>10.0f}")
+    return "\n".join(lines)
+
+def load_records(path):
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                print(f"WARNING: Skipping malformed line {line_number} in {path}.", file=sys.stderr)
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="Print p50/p95 latency per pipeline stage from a trace file.")
+    parser.add_argument("trace_file", nargs="?", default=DEFAULT_TRACE_FILE, help=f"JSONL trace file (default: {DEFAULT_TRACE_FILE})")
+    parser.add_argument("--all", action="store_true", help="Include cancelled and failed turns")
+    parser.add_argument("--json", action="store_true", help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.trace_file):
+        print(f"ERROR: Trace file not found: {args.trace_file}", file=sys.stderr)
+        return 2
+    records = load_records(args.trace_file)
+    if not args.all:
+        records = [record for record in records if record.get("outcome") == "ok"]
+    if not records:
+        print("No turns to summarize.")
+        return 1
+
+    summary = summarize_records(records)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{len(records)} turns from {args.trace_file} (client marks: ms since key release)")
+        print(format_summary(summary))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,27 +1,59 @@
 # -*- coding: utf-8 -*-
+import time
+STARTUP_STARTED = time.perf_counter() # Reference for the "hotkey live after ... ms" startup report
 import sounddevice as sd
 import numpy as np
 import keyboard
 import soundfile as sf
 import threading
-import time
 import sys
 import traceback
 import requests
 import os
 from dotenv import load_dotenv
 import json
-import pyttsx3
 import tempfile
-import tkinter as tk
-from tkinter import scrolledtext, Label
+import argparse
+import subprocess
 import queue
-
-# --- LangChain Imports ---
-from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.exceptions import OutputParserException
-from openai import AuthenticationError, APIError
+import re
+import soxr
+import hashlib
+import unicodedata
+import itertools
+import uuid
+from collections import OrderedDict
+
+from latency_report import summarize_records, format_summary
+
+# --- Lazily Imported Modules ---
+# LangChain/OpenAI (with httpx) and Tk account for most of the import time, so
+# they are loaded on first use or by the background preload in __main__, once
+# the space-bar hook is already live. pyttsx3 is imported by Pyttsx3Backend.
+ChatOpenAI = HumanMessage = SystemMessage = AIMessage = None
+OutputParserException = AuthenticationError = APIError = None
+httpx = None
+tk = scrolledtext = Label = None
+lazy_import_lock = threading.Lock()
+
+def load_llm_modules():
+    """Imports LangChain, the OpenAI SDK and httpx on first call."""
+    global ChatOpenAI, HumanMessage, SystemMessage, AIMessage, OutputParserException, AuthenticationError, APIError, httpx
+    with lazy_import_lock:
+        if ChatOpenAI is None:
+            import httpx
+            from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+            from langchain_core.exceptions import OutputParserException
+            from openai import AuthenticationError, APIError
+            from langchain_openai import ChatOpenAI # Bound last: marks the whole set as loaded
+
+def load_tk_modules():
+    """Imports tkinter on first call (from the UI thread)."""
+    global tk, scrolledtext, Label
+    with lazy_import_lock:
+        if tk is None:
+            from tkinter import scrolledtext, Label
+            import tkinter as tk
 
 # --- Load Environment Variables ---
 load_dotenv() # Load variables from .env file into environment
@@ -31,14 +63,41 @@ load_dotenv() # Load variables from .env file into environment
 # Audio Settings
 DEFAULT_SAMPLERATE = 44100
 DEFAULT_CHANNELS = 1
+DEFAULT_ASR_SAMPLERATE = 16000 # SenseVoiceSmall's WavFrontend runs at 16 kHz
 DEFAULT_DEVICE = None
 DEFAULT_AUDIO_SAVE_DIR = "./audio/"
 DEFAULT_FILENAME_BASE = "recorded_audio"
+DEFAULT_LATENCY_TRACE_FILE = "./traces/latency.jsonl"
 DEFAULT_RECORD_START_DELAY = 0.3
+DEFAULT_RING_BUFFER_SECONDS = 30
+DEFAULT_PERSISTENT_INPUT_STREAM = "False"
+DEFAULT_PREROLL_MS = 500
 DEFAULT_SHOW_LLM_RESPONSE_POPUP = "True"
 DEFAULT_POPUP_AUTO_CLOSE = "True"
 DEFAULT_ENABLE_TTS = "True"
+DEFAULT_STREAM_LLM_RESPONSE = "True"
+DEFAULT_TTS_BACKEND = "pyttsx3"
+DEFAULT_TTS_CACHE = "True"
+DEFAULT_BARGE_IN = "True"
+DEFAULT_TTS_CACHE_MAX_MB = 32
+DEFAULT_LLM_WARMUP = "True"
+DEFAULT_CONVERSATION_MEMORY = "True"
+DEFAULT_CONVERSATION_TOKEN_BUDGET = 2000
+DEFAULT_CONVERSATION_SUMMARIZE = "False"
+DEFAULT_LLM_CACHE = "True"
+DEFAULT_LLM_CACHE_TTL_S = 3600
+DEFAULT_LLM_CACHE_MAX_ENTRIES = 256
+DEFAULT_LLM_CACHE_SEMANTIC = "False"
+DEFAULT_LLM_CACHE_EMBEDDING_MODEL = "text-embedding-3-small"
+DEFAULT_LLM_CACHE_SIMILARITY = 0.95
+DEFAULT_LLM_KEEPALIVE_EXPIRY = 120
 DEFAULT_SENSEVOICE_API_URL = "http://localhost:8001/transcribe"
+DEFAULT_SENSEVOICE_STREAM_API_URL = "http://localhost:8001/transcribe_stream"
+DEFAULT_STREAMING_UPLOAD = "True"
+DEFAULT_CLIENT_VAD = "True"
+DEFAULT_CLIENT_VAD_ENERGY_DB = -45.0
+DEFAULT_CLIENT_VAD_MIN_SPEECH_MS = 200
+DEFAULT_CLIENT_VAD_PAD_MS = 200
 DEFAULT_OPENAI_MODEL_NAME = "gpt-3.5-turbo"
 DEFAULT_SYSTEM_PROMPT = "You are a helpful and friendly conversational assistant. Respond concisely and naturally to the user's transcribed speech."
 
@@ -53,6 +112,11 @@ try:
 except (ValueError, TypeError):
     print(f"警告: .env 中的 CHANNELS 无效，使用默认值 {DEFAULT_CHANNELS}", file=sys.stderr)
     CHANNELS = DEFAULT_CHANNELS
+try:
+    ASR_SAMPLERATE = int(os.getenv("ASR_SAMPLERATE", DEFAULT_ASR_SAMPLERATE))
+except (ValueError, TypeError):
+    print(f"警告: .env 中的 ASR_SAMPLERATE 无效，使用默认值 {DEFAULT_ASR_SAMPLERATE}", file=sys.stderr)
+    ASR_SAMPLERATE = DEFAULT_ASR_SAMPLERATE
 
 # Handle Audio Device setting (None, int index, or string name)
 device_setting = os.getenv("AUDIO_INPUT_DEVICE") # Returns None if not set
@@ -71,6 +135,7 @@ else:
 
 AUDIO_SAVE_DIR = os.getenv("AUDIO_SAVE_DIR", DEFAULT_AUDIO_SAVE_DIR)
 FILENAME_BASE = os.getenv("FILENAME_BASE", DEFAULT_FILENAME_BASE)
+LATENCY_TRACE_FILE = os.getenv("LATENCY_TRACE_FILE", DEFAULT_LATENCY_TRACE_FILE).strip() # Empty: summary only, no file
 try:
     RECORD_START_DELAY = float(os.getenv("RECORD_START_DELAY", DEFAULT_RECORD_START_DELAY))
     if RECORD_START_DELAY < 0:
@@ -79,69 +144,622 @@ try:
 except (ValueError, TypeError):
     print(f"警告: .env 中的 RECORD_START_DELAY 无效，使用默认值 {DEFAULT_RECORD_START_DELAY}", file=sys.stderr)
     RECORD_START_DELAY = DEFAULT_RECORD_START_DELAY
+try:
+    RING_BUFFER_SECONDS = float(os.getenv("RING_BUFFER_SECONDS", DEFAULT_RING_BUFFER_SECONDS))
+    if RING_BUFFER_SECONDS <= 0:
+        print(f"警告: RING_BUFFER_SECONDS 必须为正数，使用默认值 {DEFAULT_RING_BUFFER_SECONDS}", file=sys.stderr)
+        RING_BUFFER_SECONDS = DEFAULT_RING_BUFFER_SECONDS
+except (ValueError, TypeError):
+    print(f"警告: .env 中的 RING_BUFFER_SECONDS 无效，使用默认值 {DEFAULT_RING_BUFFER_SECONDS}", file=sys.stderr)
+    RING_BUFFER_SECONDS = DEFAULT_RING_BUFFER_SECONDS
+PERSISTENT_INPUT_STREAM = os.getenv("PERSISTENT_INPUT_STREAM", DEFAULT_PERSISTENT_INPUT_STREAM).lower() == "true"
+try:
+    PREROLL_MS = int(os.getenv("PREROLL_MS", DEFAULT_PREROLL_MS))
+    if PREROLL_MS < 0:
+        print(f"警告: PREROLL_MS 不能为负数，使用默认值 {DEFAULT_PREROLL_MS}", file=sys.stderr)
+        PREROLL_MS = DEFAULT_PREROLL_MS
+except (ValueError, TypeError):
+    print(f"警告: .env 中的 PREROLL_MS 无效，使用默认值 {DEFAULT_PREROLL_MS}", file=sys.stderr)
+    PREROLL_MS = DEFAULT_PREROLL_MS
+
+# Client-side speech detection (silence trimming before upload)
+CLIENT_VAD = os.getenv("CLIENT_VAD", DEFAULT_CLIENT_VAD).lower() == "true"
+try:
+    CLIENT_VAD_ENERGY_DB = float(os.getenv("CLIENT_VAD_ENERGY_DB", DEFAULT_CLIENT_VAD_ENERGY_DB))
+    CLIENT_VAD_MIN_SPEECH_MS = float(os.getenv("CLIENT_VAD_MIN_SPEECH_MS", DEFAULT_CLIENT_VAD_MIN_SPEECH_MS))
+    CLIENT_VAD_PAD_MS = float(os.getenv("CLIENT_VAD_PAD_MS", DEFAULT_CLIENT_VAD_PAD_MS))
+    if CLIENT_VAD_ENERGY_DB >= 0 or CLIENT_VAD_MIN_SPEECH_MS < 0 or CLIENT_VAD_PAD_MS < 0:
+        raise ValueError("out of range")
+except (ValueError, TypeError):
+    print("警告: .env 中的 CLIENT_VAD_* 数值无效 (能量阈值须为负的 dBFS，时长不能为负数)，使用默认值", file=sys.stderr)
+    CLIENT_VAD_ENERGY_DB = DEFAULT_CLIENT_VAD_ENERGY_DB
+    CLIENT_VAD_MIN_SPEECH_MS = DEFAULT_CLIENT_VAD_MIN_SPEECH_MS
+    CLIENT_VAD_PAD_MS = DEFAULT_CLIENT_VAD_PAD_MS
 
 # Feature Flags (Boolean)
 
 SHOW_LLM_RESPONSE_POPUP = os.getenv("SHOW_LLM_RESPONSE_POPUP", DEFAULT_SHOW_LLM_RESPONSE_POPUP).lower() == "true"
 POPUP_AUTO_CLOSE = os.getenv("POPUP_AUTO_CLOSE", DEFAULT_POPUP_AUTO_CLOSE).lower() == "true"
 ENABLE_TTS = os.getenv("ENABLE_TTS", DEFAULT_ENABLE_TTS).lower() == "true"
+STREAMING_UPLOAD = os.getenv("STREAMING_UPLOAD", DEFAULT_STREAMING_UPLOAD).lower() == "true"
+STREAM_LLM_RESPONSE = os.getenv("STREAM_LLM_RESPONSE", DEFAULT_STREAM_LLM_RESPONSE).lower() == "true"
+BARGE_IN = os.getenv("BARGE_IN", DEFAULT_BARGE_IN).lower() == "true"
+TTS_BACKEND = os.getenv("TTS_BACKEND", DEFAULT_TTS_BACKEND).strip().lower()
+PIPER_MODEL_PATH = os.getenv("PIPER_MODEL_PATH") # .onnx voice for TTS_BACKEND=piper
+TTS_CACHE = os.getenv("TTS_CACHE", DEFAULT_TTS_CACHE).lower() == "true"
+try:
+    TTS_CACHE_MAX_MB = float(os.getenv("TTS_CACHE_MAX_MB", DEFAULT_TTS_CACHE_MAX_MB))
+except (ValueError, TypeError):
+    print(f"警告: .env 中的 TTS_CACHE_MAX_MB 无效，使用默认值 {DEFAULT_TTS_CACHE_MAX_MB}", file=sys.stderr)
+    TTS_CACHE_MAX_MB = DEFAULT_TTS_CACHE_MAX_MB
+
+# Fixed spoken messages, pre-synthesized at startup when TTS_CACHE is enabled
+MSG_NO_AUDIO = "I didn't capture any audio."
+MSG_NO_SPEECH = "I didn't hear anything."
+MSG_NO_TRANSCRIPTION = "Sorry, couldn't transcribe."
+MSG_NO_LLM_RESPONSE = "Sorry, no LLM response."
+MSG_AUDIO_ERROR = "Audio processing error."
+MSG_UNEXPECTED_ERROR = "Unexpected error."
+TTS_FIXED_PHRASES = (MSG_NO_AUDIO, MSG_NO_SPEECH, MSG_NO_TRANSCRIPTION, MSG_NO_LLM_RESPONSE, MSG_AUDIO_ERROR, MSG_UNEXPECTED_ERROR)
+LLM_WARMUP = os.getenv("LLM_WARMUP", DEFAULT_LLM_WARMUP).lower() == "true"
+try:
+    LLM_KEEPALIVE_EXPIRY = float(os.getenv("LLM_KEEPALIVE_EXPIRY", DEFAULT_LLM_KEEPALIVE_EXPIRY))
+except (ValueError, TypeError):
+    print(f"警告: .env 中的 LLM_KEEPALIVE_EXPIRY 无效，使用默认值 {DEFAULT_LLM_KEEPALIVE_EXPIRY}", file=sys.stderr)
+    LLM_KEEPALIVE_EXPIRY = DEFAULT_LLM_KEEPALIVE_EXPIRY
 
 # API Configuration (Strings)
 
 SENSEVOICE_API_URL = os.getenv("SENSEVOICE_API_URL", DEFAULT_SENSEVOICE_API_URL)
+SENSEVOICE_STREAM_API_URL = os.getenv("SENSEVOICE_STREAM_API_URL", DEFAULT_SENSEVOICE_STREAM_API_URL)
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY") # No default, should be explicitly set
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") # Optional, None if not set
 OPENAI_MODEL_NAME = os.getenv("OPENAI_MODEL_NAME", DEFAULT_OPENAI_MODEL_NAME)
 SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT_CHAT", DEFAULT_SYSTEM_PROMPT)
 
+# Conversation Memory
+CONVERSATION_MEMORY = os.getenv("CONVERSATION_MEMORY", DEFAULT_CONVERSATION_MEMORY).lower() == "true"
+try:
+    CONVERSATION_TOKEN_BUDGET = int(os.getenv("CONVERSATION_TOKEN_BUDGET", DEFAULT_CONVERSATION_TOKEN_BUDGET))
+    if CONVERSATION_TOKEN_BUDGET <= 0:
+        print(f"警告: CONVERSATION_TOKEN_BUDGET 必须为正数，使用默认值 {DEFAULT_CONVERSATION_TOKEN_BUDGET}", file=sys.stderr)
+        CONVERSATION_TOKEN_BUDGET = DEFAULT_CONVERSATION_TOKEN_BUDGET
+except (ValueError, TypeError):
+    print(f"警告: .env 中的 CONVERSATION_TOKEN_BUDGET 无效，使用默认值 {DEFAULT_CONVERSATION_TOKEN_BUDGET}", file=sys.stderr)
+    CONVERSATION_TOKEN_BUDGET = DEFAULT_CONVERSATION_TOKEN_BUDGET
+CONVERSATION_SUMMARIZE = os.getenv("CONVERSATION_SUMMARIZE", DEFAULT_CONVERSATION_SUMMARIZE).lower() == "true"
+
+# LLM Response Cache
+LLM_CACHE = os.getenv("LLM_CACHE", DEFAULT_LLM_CACHE).lower() == "true"
+try:
+    LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", DEFAULT_LLM_CACHE_TTL_S))
+    LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", DEFAULT_LLM_CACHE_MAX_ENTRIES))
+    LLM_CACHE_SIMILARITY = float(os.getenv("LLM_CACHE_SIMILARITY", DEFAULT_LLM_CACHE_SIMILARITY))
+except (ValueError, TypeError):
+    print("警告: .env 中的 LLM_CACHE_* 数值无效，使用默认值", file=sys.stderr)
+    LLM_CACHE_TTL_S = DEFAULT_LLM_CACHE_TTL_S
+    LLM_CACHE_MAX_ENTRIES = DEFAULT_LLM_CACHE_MAX_ENTRIES
+    LLM_CACHE_SIMILARITY = DEFAULT_LLM_CACHE_SIMILARITY
+LLM_CACHE_SEMANTIC = os.getenv("LLM_CACHE_SEMANTIC", DEFAULT_LLM_CACHE_SEMANTIC).lower() == "true"
+LLM_CACHE_EMBEDDING_MODEL = os.getenv("LLM_CACHE_EMBEDDING_MODEL", DEFAULT_LLM_CACHE_EMBEDDING_MODEL)
+
 
 # --- Global Variables and State ---
 is_recording = False
-audio_data = None
+recording_ring = None # AudioRingBuffer the input callback writes into while recording
 stream = None
+persistent_stream = None # Input stream kept open for the process lifetime when PERSISTENT_INPUT_STREAM is on
+recording_start_frame = 0 # Index in recording_ring where the current recording begins
+pending_start_frame = None # Start index marked at key press in persistent mode, used once the delay elapses
 recording_lock = threading.Lock()
 recording_start_timer = None
+upload_session = None # StreamingUploadSession while STREAMING_UPLOAD is active
+current_trace = None # TurnTrace of the recording in progress
+UPLOAD_POLL_INTERVAL = 0.02 # Seconds between checks of the ring buffer by the upload thread
+capture_format = None # (samplerate, dtype) negotiated with the input device, see get_capture_format()
 
 # --- TTS State Management ---
-tts_engine = None
+tts_backend = None # See create_tts_backend()
 tts_finished_event = threading.Event()
 tts_finished_event.set()
+tts_lock = threading.Lock() # Held by one SentenceSpeaker at a time, from construction until its playback ends
+
+# --- Long-lived HTTP Clients ---
+llm_client = None # ChatOpenAI built once by get_llm_client()
+asr_session = None # requests.Session to the SenseVoice server, see get_asr_session()
+http_client_lock = threading.Lock()
+
+# --- UI State ---
+tk_ui = None # TkUi that owns every Tk window, see get_tk_ui()
+tk_ui_lock = threading.Lock()
+
+# --- TTS Backends ---
+# A backend turns text into PCM in memory: synthesize(text) yields (float32 mono samples, samplerate)
+# chunks as soon as they are available, so playback can start before synthesis has finished.
+class Pyttsx3Backend:
+    """
+    The system voice through pyttsx3.
+
+    With the SAPI5 driver (Windows) speech is rendered into a SAPI memory
+    stream, so nothing touches the disk. Other drivers (espeak, nsss) can only
+    render to a file, so they fall back to a temporary WAV.
+    """
+    name = "pyttsx3"
+    SAPI_FORMAT_22KHZ_16BIT_MONO = 22 # SpeechAudioFormatType.SAFT22kHz16BitMono
+    SAPI_SAMPLERATE = 22050
+
+    def __init__(self):
+        import pyttsx3 # Only needed by this backend, and slow to import
+        self.engine = pyttsx3.init()
+        driver = getattr(getattr(self.engine, 'proxy', None), '_driver', None)
+        self.sapi_voice = getattr(driver, '_tts', None) # SAPI.SpVoice when the sapi5 driver is active
+
+    def voice_key(self):
+        """Settings that change the rendered audio, for TtsPhraseCache keys."""
+        try:
+            return (self.name, self.engine.getProperty('voice'), self.engine.getProperty('rate'), self.engine.getProperty('volume'))
+        except Exception:
+            return (self.name,)
 
-# --- Status Pop-up State ---
-status_popup_ref = {'window': None, 'root': None}
-status_popup_lock = threading.Lock()
+    def synthesize(self, text):
+        if self.sapi_voice is not None:
+            try:
+                yield self._synthesize_sapi(text), self.SAPI_SAMPLERATE
+                return
+            except Exception as e:
+                print(f"警告: SAPI 内存合成失败，改用临时文件: {e}", file=sys.stderr)
+                self.sapi_voice = None
+        synthesized = self._synthesize_via_file(text)
+        if synthesized is not None:
+            yield synthesized
+
+    def _synthesize_sapi(self, text):
+        import comtypes.client
+        memory_stream = comtypes.client.CreateObject("SAPI.SpMemoryStream")
+        audio_format = comtypes.client.CreateObject("SAPI.SpAudioFormat")
+        audio_format.Type = self.SAPI_FORMAT_22KHZ_16BIT_MONO
+        memory_stream.Format = audio_format
+        previous_output = self.sapi_voice.AudioOutputStream
+        self.sapi_voice.AudioOutputStream = memory_stream
+        try:
+            self.sapi_voice.Speak(text, 0) # SVSFDefault: synchronous
+        finally:
+            self.sapi_voice.AudioOutputStream = previous_output
+        pcm = np.frombuffer(bytes(memory_stream.GetData()), dtype=np.int16)
+        return pcm.astype(np.float32) / 32768.0
+
+    def _synthesize_via_file(self, text):
+        temp_audio_file = None
+        try:
+            with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmpfile:
+                temp_audio_file = tmpfile.name
+            self.engine.save_to_file(text, temp_audio_file)
+            self.engine.runAndWait()
+            if not os.path.exists(temp_audio_file) or os.path.getsize(temp_audio_file) == 0:
+                raise IOError(f"TTS engine failed to save audio to {temp_audio_file}")
+            audio, samplerate = sf.read(temp_audio_file, dtype='float32', always_2d=True)
+            return audio.mean(axis=1), samplerate
+        except Exception as e:
+            print(f"Error during TTS generation/setup: {e}", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            return None
+        finally:
+            if temp_audio_file and os.path.exists(temp_audio_file):
+                try:
+                    os.remove(temp_audio_file)
+                except Exception as e_del:
+                    print(f"Warning: Failed delete temp TTS {temp_audio_file}: {e_del}", file=sys.stderr)
+
+class PiperBackend:
+    """Offline neural TTS with a Piper voice (optional `piper-tts` package), streamed chunk by chunk."""
+    name = "piper"
+
+    def __init__(self, model_path):
+        from piper.voice import PiperVoice
+        if not model_path or not os.path.isfile(model_path):
+            raise FileNotFoundError(f"PIPER_MODEL_PATH 未设置或文件不存在: {model_path}")
+        self.voice = PiperVoice.load(model_path)
+        self.samplerate = self.voice.config.sample_rate
+        self.model_path = os.path.abspath(model_path)
+
+    def voice_key(self):
+        return (self.name, self.model_path)
+
+    def synthesize(self, text):
+        if hasattr(self.voice, "synthesize_stream_raw"): # piper-tts < 1.3
+            for raw in self.voice.synthesize_stream_raw(text):
+                yield np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0, self.samplerate
+        else:
+            for chunk in self.voice.synthesize(text):
+                yield chunk.audio_float_array, chunk.sample_rate
+
+TTS_BACKENDS = {"pyttsx3": lambda: Pyttsx3Backend(), "piper": lambda: PiperBackend(PIPER_MODEL_PATH)}
+
+def create_tts_backend(name):
+    if name not in TTS_BACKENDS:
+        raise ValueError(f"未知的 TTS_BACKEND '{name}'，可选: {', '.join(TTS_BACKENDS)}")
+    return TTS_BACKENDS[name]()
+
+class TtsPhraseCache:
+    """
+    Wraps a TTS backend and keeps the PCM of synthesized utterances for reuse.
+
+    Entries are keyed by the backend's voice_key() plus the text, so changing
+    the voice, rate or Piper model never plays stale audio. A miss is streamed
+    through unchanged while its chunks are collected. Once complete, they are
+    stored in an LRU that is bounded by total PCM bytes (max_bytes). A hit
+    yields the stored chunks at once, without a synthesis pass.
+    """
+
+    def __init__(self, backend, max_bytes):
+        self.backend = backend
+        self.name = backend.name
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict() # key -> [(samples, samplerate), ...]
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.synth_lock = threading.Lock() # The backend's engine is not safe for concurrent use (pre-warm vs. speech)
+
+    def _key(self, text):
+        return self.backend.voice_key() + (text.strip(),)
+
+    def synthesize(self, text):
+        key = self._key(text)
+        with self.lock:
+            chunks = self.entries.get(key)
+            if chunks is not None:
+                self.entries.move_to_end(key)
+        if chunks is not None:
+            yield from chunks
+            return
+        chunks = []
+        with self.synth_lock:
+            for chunk in self.backend.synthesize(text):
+                chunks.append(chunk)
+                yield chunk
+        self._store(key, chunks)
+
+    def _store(self, key, chunks):
+        size = sum(samples.nbytes for samples, _ in chunks)
+        if not chunks or size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = chunks
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.total_bytes -= sum(samples.nbytes for samples, _ in evicted)
+
+    def prewarm(self, phrases):
+        """Synthesizes `phrases` into the cache (run in a background thread at startup)."""
+        start = time.perf_counter()
+        for phrase in phrases:
+            try:
+                for _ in self.synthesize(phrase):
+                    pass
+            except Exception as e:
+                print(f"警告: 预合成 '{phrase}' 失败: {e}", file=sys.stderr)
+        print(f"信息: 已预合成 {len(phrases)} 条固定提示语 ({(time.perf_counter() - start) * 1000:.0f} ms, 缓存 {self.total_bytes / 1048576:.1f} MB)。")
 
 # --- TTS Engine Initialization ---
-if ENABLE_TTS:
-    try:
-        tts_engine = pyttsx3.init()
-        print("信息: TTS 引擎已初始化。")
-    except Exception as e:
-        print(f"错误: 初始化 TTS 引擎失败: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        tts_engine = None
-        ENABLE_TTS = False # Disable TTS if init fails
-        print("警告: TTS 功能因初始化失败已被禁用。")
-else:
+# The engine is created on first use or by the background preload in __main__,
+# so starting pyttsx3 (or loading a Piper voice) never delays the hotkey.
+tts_init_lock = threading.Lock()
+tts_init_attempted = False
+
+def get_tts_backend():
+    """Returns the TTS backend, creating it on first use; None if TTS is disabled or failed to initialize."""
+    global tts_backend, ENABLE_TTS, tts_init_attempted
+    with tts_init_lock:
+        if tts_backend is None and ENABLE_TTS and not tts_init_attempted:
+            tts_init_attempted = True
+            try:
+                backend = create_tts_backend(TTS_BACKEND)
+                if TTS_CACHE:
+                    backend = TtsPhraseCache(backend, int(TTS_CACHE_MAX_MB * 1024 * 1024))
+                tts_backend = backend
+                print(f"信息: TTS 引擎已初始化 ({tts_backend.name})。")
+            except Exception as e:
+                print(f"错误: 初始化 TTS 引擎失败: {e}", file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+                ENABLE_TTS = False # Disable TTS if init fails
+                print("警告: TTS 功能因初始化失败已被禁用。")
+        return tts_backend
+
+if not ENABLE_TTS:
     print("信息: TTS 功能已通过配置禁用，跳过引擎初始化。")
-    tts_engine = None
+
+# --- Capture Format Negotiation and Conversion ---
+def get_capture_format():
+    """
+    Returns the (samplerate, dtype) used to open the input stream.
+
+    Devices that can capture ASR_SAMPLERATE int16 directly are opened that way,
+    so no conversion is needed at all. Otherwise the stream falls back to
+    SAMPLERATE float32 and AsrPcmConverter resamples on the client.
+    """
+    global capture_format
+    if capture_format is None:
+        try:
+            sd.check_input_settings(device=DEVICE, channels=CHANNELS, dtype='int16', samplerate=ASR_SAMPLERATE)
+            capture_format = (ASR_SAMPLERATE, 'int16')
+            print(f"信息: 输入设备支持 {ASR_SAMPLERATE} Hz int16，直接以模型采样率录音。")
+        except Exception as e:
+            capture_format = (SAMPLERATE, 'float32')
+            print(f"信息: 输入设备不支持 {ASR_SAMPLERATE} Hz int16 ({e})，以 {SAMPLERATE} Hz 录音并在本地重采样。")
+    return capture_format
+
+class AsrPcmConverter:
+    """
+    Converts captured blocks to the mono ASR_SAMPLERATE int16 PCM the server expects.
+
+    Resampling uses a stateful soxr stream (polyphase filtering), so blocks can be
+    converted one at a time during a streaming upload without edge artefacts.
+    """
+
+    def __init__(self, capture_rate, capture_dtype):
+        self.capture_rate = capture_rate
+        self.capture_dtype = capture_dtype
+        self.resampler = None
+        if capture_rate != ASR_SAMPLERATE:
+            self.resampler = soxr.ResampleStream(capture_rate, ASR_SAMPLERATE, 1, dtype='float32')
+
+    def convert(self, block, last=False):
+        if block.ndim > 1:
+            block = block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+        if self.resampler is None and block.dtype == np.int16:
+            return np.ascontiguousarray(block)
+        if block.dtype == np.int16:
+            block = block.astype(np.float32) / 32768.0
+        if self.resampler is not None:
+            block = self.resampler.resample_chunk(np.ascontiguousarray(block, dtype=np.float32), last=last)
+        return np.clip(block * 32768.0, -32768, 32767).astype(np.int16)
+
+# --- Client-side Speech Detection ---
+class EnergyVad:
+    """
+    Frame-level speech detector on mono ASR_SAMPLERATE int16 PCM.
+
+    Each 20 ms frame's RMS energy (dBFS) and zero-crossing rate are computed in
+    one vectorized pass. A frame is speech if its energy is above the threshold,
+    or, for unvoiced consonants such as "s" and "f", within FRICATIVE_MARGIN_DB
+    of it with a high zero-crossing rate. The threshold is CLIENT_VAD_ENERGY_DB,
+    raised to NOISE_MARGIN_DB above the noise floor (a low percentile of the
+    frame energies) in noisy rooms.
+    """
+    FRAME_MS = 20
+    FRICATIVE_MARGIN_DB = 10.0
+    FRICATIVE_ZCR = 0.3 # Sign changes per sample; voiced speech and hum stay well below
+    NOISE_MARGIN_DB = 12.0
+    NOISE_PERCENTILE = 10
+    MIN_NOISE_FRAMES = 10 # Frames needed before the noise floor is trusted
+
+    def __init__(self, samplerate, threshold_db, min_speech_ms, pad_ms):
+        self.frame_samples = samplerate * self.FRAME_MS // 1000
+        self.threshold_db = threshold_db
+        self.min_speech_frames = max(1, int(round(min_speech_ms / self.FRAME_MS)))
+        self.pad_frames = int(round(pad_ms / self.FRAME_MS))
+
+    def frame_features(self, pcm):
+        """Returns (energy_db, zcr) per whole frame of `pcm`; a trailing partial frame is ignored."""
+        count = len(pcm) // self.frame_samples
+        frames = pcm[:count * self.frame_samples].reshape(count, self.frame_samples).astype(np.float32) / 32768.0
+        energy_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + 1e-10)
+        zcr = np.count_nonzero(np.diff(np.signbit(frames), axis=1), axis=1) / self.frame_samples
+        return energy_db, zcr
+
+    def threshold(self, energy_db):
+        """The speech threshold for a recording whose frame energies (so far) are `energy_db`."""
+        if len(energy_db) < self.MIN_NOISE_FRAMES:
+            return self.threshold_db
+        return max(self.threshold_db, float(np.percentile(energy_db, self.NOISE_PERCENTILE)) + self.NOISE_MARGIN_DB)
+
+    def classify(self, energy_db, zcr, threshold):
+        """Boolean speech mask over frames."""
+        return (energy_db > threshold) | ((energy_db > threshold - self.FRICATIVE_MARGIN_DB) & (zcr > self.FRICATIVE_ZCR))
+
+    def trim(self, pcm):
+        """
+        Returns (start, end) sample indices of the speech in `pcm`, widened by
+        CLIENT_VAD_PAD_MS on each side, or None if it holds less than
+        CLIENT_VAD_MIN_SPEECH_MS of speech (a tap or a silent press).
+        """
+        energy_db, zcr = self.frame_features(pcm)
+        speech = np.flatnonzero(self.classify(energy_db, zcr, self.threshold(energy_db)))
+        if len(speech) < self.min_speech_frames:
+            return None
+        start = max(0, speech[0] - self.pad_frames) * self.frame_samples
+        end_frame = speech[-1] + 1 + self.pad_frames
+        end = len(pcm) if end_frame >= len(energy_db) else end_frame * self.frame_samples # Padding reaching the end keeps the partial frame
+        return int(start), int(end)
+
+class SpeechGate:
+    """
+    Streaming counterpart of EnergyVad.trim() for StreamingUploadSession.
+
+    feed() takes converted PCM as it is recorded and returns what should be
+    uploaded. Nothing is released until the recording holds min_speech_ms of
+    speech; then the audio from pad_ms before the first speech frame on is
+    released. Silence after that is held back until speech resumes or HOLD_MS
+    have accumulated (the server needs long pauses to close its segments). At
+    the end of the recording only pad_ms of the held trailing silence is sent.
+    """
+    HOLD_MS = 1000
+
+    def __init__(self, vad):
+        self.vad = vad
+        self.hold_frames = self.HOLD_MS // vad.FRAME_MS
+        self.remainder = np.zeros(0, dtype=np.int16)
+        self.energies = [] # Energy of every frame so far, for the noise floor
+        self.held = [] # Frames not sent yet
+        self.first_speech = None # Index in self.held of the first speech frame before onset
+        self.speech_frames = 0
+        self.started = False
+
+    def feed(self, pcm, last=False):
+        if self.remainder.size:
+            pcm = np.concatenate([self.remainder, pcm])
+        whole = len(pcm) // self.vad.frame_samples * self.vad.frame_samples
+        self.remainder = pcm[whole:]
+        out = []
+        if whole:
+            frames = pcm[:whole].reshape(-1, self.vad.frame_samples)
+            energy_db, zcr = self.vad.frame_features(pcm[:whole])
+            self.energies.extend(energy_db.tolist())
+            speech = self.vad.classify(energy_db, zcr, self.vad.threshold(np.asarray(self.energies)))
+            for frame, is_speech in zip(frames, speech):
+                self._add_frame(frame, is_speech, out)
+        if last:
+            if self.started:
+                out.extend(self.held[:self.vad.pad_frames])
+            self.held = []
+        return np.concatenate(out) if out else np.zeros(0, dtype=np.int16)
+
+    def _add_frame(self, frame, is_speech, out):
+        self.held.append(frame)
+        if not self.started:
+            if is_speech:
+                self.speech_frames += 1
+                if self.first_speech is None:
+                    self.first_speech = len(self.held) - 1
+            elif self.first_speech is None and len(self.held) > self.vad.pad_frames:
+                del self.held[0] # Keep only the padding before speech starts
+            if self.speech_frames >= self.vad.min_speech_frames:
+                self.started = True
+                out.extend(self.held[max(0, self.first_speech - self.vad.pad_frames):])
+                self.held = []
+        elif is_speech or len(self.held) >= self.hold_frames:
+            out.extend(self.held)
+            self.held = []
+
+client_vad = EnergyVad(ASR_SAMPLERATE, CLIENT_VAD_ENERGY_DB, CLIENT_VAD_MIN_SPEECH_MS, CLIENT_VAD_PAD_MS) if CLIENT_VAD else None
+
+# --- Recording Buffer ---
+class AudioRingBuffer:
+    """
+    Preallocated, growable ring buffer shared by the audio callback and one reader.
+
+    Frames are addressed by absolute index (frames written since creation). The
+    callback is the only writer and the only thread that ever replaces the
+    backing array; the reader only reads and publishes its read position. Both
+    positions are plain ints, whose assignment is atomic under the GIL, so no
+    lock is taken in the audio thread and no per-block arrays are allocated.
+
+    Frames at or after the read position are never overwritten: if a write
+    would do so, the buffer doubles in size instead (rare, and amortized). With
+    the read position set to None the buffer just rolls, keeping the most
+    recent `capacity` frames (used for the pre-roll of the persistent stream).
+    """
+
+    def __init__(self, capacity_frames, channels, dtype):
+        self._buf = np.zeros((max(1, int(capacity_frames)), channels), dtype=dtype)
+        self._write_pos = 0 # Published by the writer after each block
+        self._read_pos = 0 # Published by the reader; older frames may be overwritten
+        self.grow_count = 0
+
+    @property
+    def frames_written(self):
+        return self._write_pos
+
+    @property
+    def read_position(self):
+        return self._read_pos
+
+    def set_read_position(self, position):
+        """Reader side: frames before `position` are no longer needed (None: nothing is needed)."""
+        self._read_pos = position
+
+    def write(self, frames):
+        """Writer side: appends a (frames, channels) block. Called from the audio callback."""
+        n = len(frames)
+        if n == 0:
+            return
+        buf = self._buf
+        write_pos = self._write_pos
+        read_pos = self._read_pos
+        if read_pos is not None and write_pos + n - read_pos > len(buf):
+            buf = self._grow(write_pos + n - read_pos)
+        capacity = len(buf)
+        start = write_pos % capacity
+        first = min(n, capacity - start)
+        buf[start:start + first] = frames[:first]
+        if first < n:
+            buf[:n - first] = frames[first:]
+        self._write_pos = write_pos + n
+
+    def _grow(self, needed_frames):
+        old = self._buf
+        capacity = len(old)
+        while capacity < needed_frames:
+            capacity *= 2
+        read_pos = self._read_pos
+        if read_pos is None:
+            read_pos = max(0, self._write_pos - len(old))
+        live = self._copy_range(old, read_pos, self._write_pos)
+        new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+        start = read_pos % capacity
+        first = min(len(live), capacity - start)
+        new[start:start + first] = live[:first]
+        new[:len(live) - first] = live[first:]
+        self._buf = new # Old array stays valid for a reader that already holds it
+        self.grow_count += 1
+        return new
+
+    @staticmethod
+    def _copy_range(buf, start, end):
+        capacity = len(buf)
+        s, e = start % capacity, start % capacity + (end - start)
+        if e <= capacity:
+            return buf[s:e].copy()
+        return np.concatenate((buf[s:], buf[:e - capacity]))
+
+    def read(self, start, end, copy=True):
+        """
+        Reader side: returns frames [start, end).
+
+        With copy=False a view into the backing array is returned when the range
+        is contiguous; it is only safe once the writer has stopped (e.g. after
+        the input stream is closed) or if those frames are protected by the
+        read position.
+        """
+        buf = self._buf
+        capacity = len(buf)
+        lost = (self._write_pos - capacity) - start
+        if lost > 0:
+            print(f"警告: 录音缓冲区溢出，丢失 {lost} 帧。", file=sys.stderr)
+            start += lost
+        if end <= start:
+            return buf[:0].copy()
+        s = start % capacity
+        if s + (end - start) <= capacity:
+            view = buf[s:s + (end - start)]
+            return view.copy() if copy else view
+        return self._copy_range(buf, start, end)
 
 # --- Audio Callback ---
 def audio_callback(indata, frames, time, status):
-    global audio_data
     if status:
         print(f"Audio Stream Status Error: {status}", file=sys.stderr)
     try:
-        with recording_lock:
-            if is_recording and isinstance(audio_data, list):
-                 audio_data.append(indata.copy())
+        ring = recording_ring
+        if ring is not None:
+            ring.write(indata)
     except Exception as e:
         print(f"Error in audio_callback: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
 
 # --- Start Recording Functions ---
+def _cancel_upload_session_locked():
+    """Abandons the in-flight streaming upload. Caller must hold recording_lock."""
+    global upload_session
+    if upload_session is not None:
+        upload_session.cancel()
+        upload_session = None
+
 def start_recording():
-    global stream, is_recording, audio_data
+    global stream, is_recording, recording_ring
     try:
         if stream is not None and not stream.closed:
             print("DEBUG: Closing leftover audio stream before starting new one.")
@@ -154,12 +772,13 @@ def start_recording():
             finally:
                 stream = None
 
+        capture_rate, capture_dtype = get_capture_format()
         stream = sd.InputStream(
-            samplerate=SAMPLERATE,
+            samplerate=capture_rate,
             channels=CHANNELS,
             callback=audio_callback,
             device=DEVICE,
-            dtype='float32'
+            dtype=capture_dtype
         )
         stream.start()
         print("音频流已启动。")
@@ -169,19 +788,75 @@ def start_recording():
         print(f"错误详情: {pae}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
         with recording_lock:
-             is_recording, audio_data, stream = False, None, None
+             is_recording, recording_ring, stream = False, None, None
+             _cancel_upload_session_locked()
         print("错误: 录音启动失败。")
         close_status_popup() # Close "Listening" popup if start fails
     except Exception as e:
         print(f"启动音频流时发生未知错误: {e}", file=sys.stderr)
         traceback.print_exc(file=sys.stderr)
         with recording_lock:
-             is_recording, audio_data, stream = False, None, None
+             is_recording, recording_ring, stream = False, None, None
+             _cancel_upload_session_locked()
         print("错误: 录音启动失败。")
         close_status_popup() # Close "Listening" popup if start fails
 
+# --- Persistent Input Stream (Pre-roll) ---
+def open_persistent_input_stream():
+    """
+    Opens the input stream once for the whole process lifetime.
+
+    The callback keeps writing into a rolling AudioRingBuffer, so a key press
+    only has to mark a start index (PREROLL_MS before the press) instead of
+    opening a PortAudio device, and the first syllable is never lost.
+    """
+    global persistent_stream, recording_ring
+    capture_rate, capture_dtype = get_capture_format()
+    capacity = capture_rate * max(RING_BUFFER_SECONDS, RECORD_START_DELAY + PREROLL_MS / 1000.0 + 1)
+    ring = AudioRingBuffer(capacity, CHANNELS, capture_dtype)
+    ring.set_read_position(None) # Roll freely until a key press pins the pre-roll
+    with recording_lock:
+        recording_ring = ring
+    persistent_stream = sd.InputStream(
+        samplerate=capture_rate,
+        channels=CHANNELS,
+        callback=audio_callback,
+        device=DEVICE,
+        dtype=capture_dtype
+    )
+    persistent_stream.start()
+    print(f"常开音频流已启动 (预录 {PREROLL_MS} 毫秒)。")
+
+def close_persistent_input_stream():
+    global persistent_stream, recording_ring
+    if persistent_stream is None:
+        return
+    try:
+        if persistent_stream.active:
+            persistent_stream.stop()
+        if not persistent_stream.closed:
+            persistent_stream.close()
+        print("DEBUG: 常开音频流已关闭。")
+    except Exception as e:
+        print(f"关闭常开音频流出错: {e}", file=sys.stderr)
+    finally:
+        persistent_stream = None
+        with recording_lock:
+            recording_ring = None
+
+def _release_persistent_frames(ring, pinned_frame):
+    """
+    Lets the persistent ring roll again once a recording's frames have been consumed.
+
+    Only releases the ring if its read position is still `pinned_frame`, the
+    one this recording set; a newer key press may already have pinned its own
+    pre-roll. The caller holds recording_lock.
+    """
+    if persistent_stream is not None and ring is not None and ring.read_position == pinned_frame:
+        ring.set_read_position(None)
+
 def _initiate_recording_after_delay():
-    global recording_start_timer, is_recording, audio_data
+    global recording_start_timer, is_recording, recording_ring, upload_session, recording_start_frame, pending_start_frame, current_trace
     should_start = False
     with recording_lock:
         if recording_start_timer is None:
@@ -193,7 +868,18 @@ def _initiate_recording_after_delay():
 
         if not is_recording:
              is_recording = True
-             audio_data = [] # Reset audio data list
+             current_trace = TurnTrace()
+             current_trace.mark("record_start")
+             capture_rate, capture_dtype = get_capture_format()
+             if persistent_stream is not None:
+                 # Audio since the press (plus pre-roll) is already in the ring.
+                 recording_start_frame, pending_start_frame = pending_start_frame, None
+             else:
+                 recording_ring = AudioRingBuffer(capture_rate * RING_BUFFER_SECONDS, CHANNELS, capture_dtype)
+                 recording_start_frame = 0
+             if STREAMING_UPLOAD:
+                 upload_session = StreamingUploadSession(recording_ring, AsrPcmConverter(capture_rate, capture_dtype), recording_start_frame, current_trace)
+                 upload_session.start()
              should_start = True
         else:
              print("DEBUG: Timer fired, but recording flag was already true.", file=sys.stderr)
@@ -201,185 +887,473 @@ def _initiate_recording_after_delay():
     if should_start:
         print(f"开始录音 (已等待 {RECORD_START_DELAY} 秒)...")
         display_status_popup("正在聆听中...")
-        start_recording() # Now actually start the audio stream
-
-
-# --- Status Pop-up Functions ---
-def _run_status_popup_thread(text, q):
-    """Target function for the status popup thread."""
-    popup = None
-    root = None
-    try:
-        root = tk.Tk()
-        root.withdraw() # Hide the root window
-
-        popup = tk.Toplevel(root)
-        popup.title("状态")
-        popup.geometry("200x80")
-        popup.resizable(False, False)
-        popup.attributes('-topmost', True)
-
-        # Attempt to center the popup window
-        root.update_idletasks() # Ensure screen size is available
-        screen_width = root.winfo_screenwidth()
-        screen_height = root.winfo_screenheight()
-        x = (screen_width // 2) - (200 // 2)
-        y = (screen_height // 2) - (80 // 2)
-        popup.geometry(f'+{x}+{y}')
-
-        # Display the status message in a Label
-        label = Label(popup, text=text, padx=20, pady=20)
-        label.pack(expand=True)
-
-        # Put references into the queue for the calling thread
-        q.put({'window': popup, 'root': root})
-
-        # Disable the close button's default action
-        popup.protocol("WM_DELETE_WINDOW", lambda: None) # Ignore close button click
-
-        # Start the event loop for this popup - runs until root is destroyed
-        root.mainloop()
-
-    except Exception as e:
-        print(f"Error in status popup thread: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        q.put(None) # Signal error
-    # <<<--- REMOVED finally block that caused the error ---<<<
+        if persistent_stream is None:
+            start_recording() # Now actually start the audio stream
+
+
+# --- Tk UI Thread ---
+class TkUi:
+    """
+    One long-lived UI thread that owns the only Tk root and both popup windows.
+
+    Other threads never touch Tk directly. They post commands to a queue that
+    the UI thread drains every UI_TICK_MS, so showing or updating a popup
+    returns immediately and the processing pipeline never waits on the UI. The
+    status and response windows are created once and then shown, hidden and
+    updated in place rather than rebuilt.
+
+    Streamed reply text is posted as _append_response commands. Consecutive
+    appends in one tick are merged into a single insert, so a fast token
+    stream costs one redraw per tick and not one per token.
+    """
+    UI_TICK_MS = 30
+    STATUS_SIZE = (200, 80)
+
+    def __init__(self):
+        self.commands = queue.Queue()
+        self.ready = threading.Event() # Set once the windows exist (or creating them failed)
+        self.failed = False
+        self.root = None
+        self.response_open = False # Written by the UI thread only
+        self.thread = threading.Thread(target=self._run, name="tk-ui", daemon=True)
+
+    def start(self):
+        """Starts the UI thread without waiting for it; commands posted meanwhile run once it is up."""
+        self.thread.start()
+        return self
+
+    def post(self, func, *args):
+        """Runs func(*args) on the UI thread (dropped if the UI could not be created)."""
+        if not self.failed:
+            self.commands.put((func, args))
+
+    def _run(self):
+        try:
+            load_tk_modules()
+            self.root = tk.Tk()
+            self.root.withdraw() # Hide the root window
+            self._build_status_window()
+            self._build_response_window()
+        except Exception as e:
+            print(f"Error creating UI thread windows: {e}", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            self.root = None
+            self.failed = True
+            self.ready.set()
+            return
+        self.ready.set()
+        self.root.after(self.UI_TICK_MS, self._tick)
+        self.root.mainloop()
+        print("DEBUG: UI thread mainloop finished.")
 
-    # Optional: Print message *after* mainloop finishes, indicating thread exit
-    print("DEBUG: Status popup thread mainloop finished.")
+    def _tick(self):
+        batch = []
+        while True:
+            try:
+                batch.append(self.commands.get_nowait())
+            except queue.Empty:
+                break
+        pending_text = []
+        for func, args in batch + [(None, ())]:
+            if func == self._append_response:
+                pending_text.append(args[0])
+                continue
+            if pending_text:
+                self._execute(self._append_response, ("".join(pending_text),))
+                pending_text = []
+            if func is not None:
+                self._execute(func, args)
+        if self.root is not None:
+            self.root.after(self.UI_TICK_MS, self._tick)
+
+    def _execute(self, func, args):
+        try:
+            func(*args)
+        except tk.TclError as e:
+            print(f"DEBUG: TclError in UI command {getattr(func, '__name__', func)}: {e}", file=sys.stderr)
+        except Exception as e:
+            print(f"Error in UI command {getattr(func, '__name__', func)}: {e}", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
 
+    # Status window (runs on the UI thread)
+    def _build_status_window(self):
+        width, height = self.STATUS_SIZE
+        self.status_window = tk.Toplevel(self.root)
+        self.status_window.title("状态")
+        self.status_window.geometry(f"{width}x{height}")
+        self.status_window.resizable(False, False)
+        self.status_window.attributes('-topmost', True)
+        # Center the popup window
+        self.root.update_idletasks()
+        x = (self.root.winfo_screenwidth() // 2) - (width // 2)
+        y = (self.root.winfo_screenheight() // 2) - (height // 2)
+        self.status_window.geometry(f'+{x}+{y}')
+        self.status_label = Label(self.status_window, text="", padx=20, pady=20)
+        self.status_label.pack(expand=True)
+        self.status_window.protocol("WM_DELETE_WINDOW", lambda: None) # Ignore close button click
+        self.status_window.withdraw()
+
+    def _show_status(self, text):
+        self.status_label.config(text=text)
+        self.status_window.deiconify()
+        self.status_window.lift()
+
+    def _hide_status(self):
+        self.status_window.withdraw()
+
+    # Response window (runs on the UI thread)
+    def _build_response_window(self):
+        self.response_window = tk.Toplevel(self.root)
+        self.response_window.geometry("500x300")
+        self.response_window.attributes('-topmost', True)
+        self.response_text = scrolledtext.ScrolledText(self.response_window, wrap=tk.WORD, height=15, width=60)
+        self.response_text.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
+        self.response_text.tag_configure("speaking", background="#fff3a0")
+        self.response_text.config(state=tk.DISABLED)
+        self.highlight_from = "1.0" # Spoken sentences are searched for from here on
+        self.response_window.protocol("WM_DELETE_WINDOW", self._close_response) # Hide, keep for reuse
+        self.response_window.withdraw()
+
+    def _show_response(self, text, title):
+        self.response_window.title(title)
+        self.response_text.config(state=tk.NORMAL)
+        self.response_text.delete("1.0", tk.END)
+        self.response_text.insert(tk.END, text)
+        self.response_text.config(state=tk.DISABLED)
+        self.highlight_from = "1.0"
+        self.response_window.deiconify()
+        self.response_window.lift()
+        self.response_open = True
+
+    def _append_response(self, text):
+        self.response_text.config(state=tk.NORMAL)
+        self.response_text.insert(tk.END, text)
+        self.response_text.config(state=tk.DISABLED)
+        self.response_text.see(tk.END)
+
+    def _highlight_sentence(self, sentence):
+        self.response_text.tag_remove("speaking", "1.0", tk.END)
+        if not sentence:
+            return
+        start = self.response_text.search(sentence, self.highlight_from, stopindex=tk.END)
+        if start:
+            end = f"{start}+{len(sentence)}c"
+            self.response_text.tag_add("speaking", start, end)
+            self.response_text.see(start)
+            self.highlight_from = end
+
+    def _close_response(self):
+        self.response_window.withdraw()
+        self.response_open = False
+
+    def _quit(self):
+        root, self.root = self.root, None
+        root.quit()
+        root.destroy()
+
+def get_tk_ui():
+    """
+    Returns the process-wide TkUi, starting its thread on first use (None if Tk is unavailable).
+
+    Never waits for the UI thread, so it is safe on the keyboard hook and timer
+    threads; preload_subsystems() starts the UI at launch.
+    """
+    global tk_ui
+    with tk_ui_lock:
+        if tk_ui is None:
+            tk_ui = TkUi().start()
+        return tk_ui if not tk_ui.failed else None
+
+def _running_tk_ui():
+    """The TkUi if it has been started and has not failed, without starting it."""
+    ui = tk_ui
+    return ui if ui is not None and not ui.failed else None
 
+# --- Status Pop-up Functions ---
 def display_status_popup(text):
-    """Creates and displays a short-lived status popup."""
-    global status_popup_ref, status_popup_lock
+    """Shows the status popup with `text`, reusing the window if it is already open."""
     print(f"DEBUG: Displaying status popup: '{text}'")
-
-    # Close any existing status popup first
-    close_status_popup()
-
-    q = queue.Queue()
-    thread = threading.Thread(target=_run_status_popup_thread, args=(text, q), daemon=True)
-    thread.start()
-
-    try:
-        # Wait for the thread to create the window and return references
-        ref = q.get(timeout=3.0)
-        if ref and ref.get('window') and ref.get('root'):
-            # Store references safely
-            with status_popup_lock:
-                status_popup_ref = ref
-            print(f"DEBUG: Status popup '{text}' displayed.")
-        else:
-            print("Error: Status popup thread failed to return valid window/root.", file=sys.stderr)
-    except queue.Empty:
-        print("Error: Timed out waiting for status popup thread.", file=sys.stderr)
-    except Exception as e:
-        print(f"Error displaying status popup: {e}", file=sys.stderr)
+    ui = get_tk_ui()
+    if ui is not None:
+        ui.post(ui._show_status, text)
 
 def close_status_popup():
-    """Safely closes the current status popup using root.after."""
-    global status_popup_ref, status_popup_lock
-    print("DEBUG: Attempting to close status popup...")
-
-    # Safely get the current references and clear the global ones
-    with status_popup_lock:
-        ref_to_close = status_popup_ref.copy()
-        status_popup_ref = {'window': None, 'root': None} # Clear immediately
-
-    root_to_close = ref_to_close.get('root')
-    if root_to_close:
-        try:
-            # Schedule the destroy call on the Tkinter thread of the popup's root
-            if root_to_close.winfo_exists(): # Check existence first
-                 root_to_close.after(0, root_to_close.destroy)
-                 print("DEBUG: Scheduled status popup closure.")
-            else:
-                 print("DEBUG: Status popup root already destroyed.")
-        except tk.TclError as e:
-            print(f"DEBUG: TclError closing status popup (likely race): {e}", file=sys.stderr)
-        except Exception as e:
-            print(f"Error scheduling status popup closure: {e}", file=sys.stderr)
-            traceback.print_exc(file=sys.stderr)
-    else:
-        print("DEBUG: No active status popup root to close.")
+    """Hides the status popup (no-op if it is not shown)."""
+    ui = _running_tk_ui()
+    if ui is not None:
+        ui.post(ui._hide_status)
 
 # --- LLM Response Pop-up Functions ---
-def _create_and_run_tk_window(text_to_display, q, title="LLM Response"):
-    """Creates and manages the LLM Response tkinter Toplevel window."""
-    popup_window = None
-    root = None
-    try:
-        root = tk.Tk()
-        root.withdraw()
-        popup_window = tk.Toplevel(root)
-        popup_window.title(title)
-        popup_window.geometry("500x300")
-        popup_window.attributes('-topmost', True)
-
-        st = scrolledtext.ScrolledText(popup_window, wrap=tk.WORD, height=15, width=60)
-        st.pack(padx=10, pady=10, fill=tk.BOTH, expand=True)
-        st.insert(tk.END, text_to_display)
-        st.config(state=tk.DISABLED)
-
-        q.put(popup_window)
-        print("DEBUG: LLM Response Tkinter window object placed in queue.")
-
-        def on_close():
-            print("DEBUG: LLM Response Tkinter window closed by user (X button).")
+def show_response_popup_tk(text_to_display, title="LLM Response"):
+    """Shows the LLM response window with `text_to_display`. Returns False if the UI is unavailable."""
+    ui = get_tk_ui()
+    if ui is None:
+        return False
+    ui.post(ui._show_response, text_to_display, title)
+    return True
+
+def append_response_popup(text):
+    """Appends streamed text to the response window (opened with show_response_popup_tk(''))."""
+    ui = _running_tk_ui()
+    if ui is not None:
+        ui.post(ui._append_response, text)
+
+def highlight_spoken_sentence(sentence):
+    """Marks `sentence` in the response window as the one being spoken; None clears the mark."""
+    ui = _running_tk_ui()
+    if ui is not None:
+        ui.post(ui._highlight_sentence, sentence)
+
+def close_response_popup():
+    ui = _running_tk_ui()
+    if ui is not None:
+        ui.post(ui._close_response)
+
+def response_popup_is_open():
+    ui = _running_tk_ui()
+    return ui is not None and ui.response_open
+
+def shutdown_tk_ui():
+    ui = _running_tk_ui()
+    if ui is not None:
+        ui.post(ui._quit)
+
+# --- Latency Tracing ---
+class TurnTrace:
+    """
+    Timestamps of one turn's milestones, from recording start to the end of playback.
+
+    mark(name) keeps the first time a milestone is reached, so stages can call
+    it unconditionally. request_id is sent to the transcription server as
+    X-Request-ID; the server's own spans (decode, VAD, generate, postprocess...)
+    come back in the response and are stored in server_timings.
+    """
+
+    def __init__(self):
+        self.request_id = uuid.uuid4().hex
+        self.marks = {}
+        self.server_timings = None
+        self.lock = threading.Lock()
+
+    def mark(self, name):
+        with self.lock:
+            self.marks.setdefault(name, time.perf_counter())
+
+    def to_record(self, turn_id, outcome):
+        """JSON-ready record; marks are milliseconds since key release (or since the first mark)."""
+        with self.lock:
+            marks = dict(self.marks)
+        origin = marks.get("key_release", min(marks.values(), default=0.0))
+        return {
+            "request_id": self.request_id,
+            "turn": turn_id,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "outcome": outcome,
+            "marks_ms": {name: round((t - origin) * 1000.0, 1) for name, t in sorted(marks.items(), key=lambda item: item[1])},
+            "server": self.server_timings,
+        }
+
+class LatencyLog:
+    """
+    Collects finished turns' traces: appends each as one JSON line to
+    LATENCY_TRACE_FILE (if set) and keeps them for the p50/p95 summary printed
+    at exit. latency_report.py produces the same summary from the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+        self.lock = threading.Lock()
+
+    def record(self, trace, turn_id, outcome):
+        record = trace.to_record(turn_id, outcome)
+        marks = record["marks_ms"]
+        if outcome == "ok":
+            print("耗时 (距松开空格): " + ", ".join(f"{name} {value:.0f} ms" for name, value in marks.items() if name != "record_start"))
+        with self.lock:
+            self.records.append(record)
+            if not self.path:
+                return
             try:
-                if root and root.winfo_exists():
-                    root.destroy() # Destroy root to exit mainloop
-            except tk.TclError:
-                pass # Ignore if already destroyed
-
-        popup_window.protocol("WM_DELETE_WINDOW", on_close)
-
-        print("DEBUG: Starting LLM Response Tkinter mainloop in background thread.")
-        root.mainloop() # Blocks until root is destroyed
-        print("DEBUG: LLM Response Tkinter mainloop finished.")
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"警告: 无法写入延迟记录 '{self.path}': {e}", file=sys.stderr)
+
+    def print_summary(self):
+        with self.lock:
+            records = [record for record in self.records if record["outcome"] == "ok"]
+        if not records:
+            return
+        print(f"本次运行延迟统计 ({len(records)} 轮, 客户端时间点以松开空格为 0):")
+        print(format_summary(summarize_records(records)))
+
+latency_log = LatencyLog(LATENCY_TRACE_FILE)
+
+# --- Turn Pipeline ---
+class TurnCancelled(Exception):
+    """Raised inside a pipeline stage when its turn has been superseded (barge-in)."""
+
+class Turn:
+    """
+    One utterance travelling through the pipeline: recorded audio in, spoken reply out.
+
+    Stages fill in transcript / llm_response / speaker as they go. A stage that
+    fails sets error_message instead, and the turn skips straight to the TTS
+    stage, which speaks the error. cancel() can be called from any thread.
+    """
+    _ids = itertools.count(1)
+
+    def __init__(self, ring, start_frame, end_frame, upload_session=None, error_message=None, trace=None):
+        self.id = next(self._ids)
+        self.trace = trace or TurnTrace()
+        self.ring = ring
+        self.start_frame = start_frame
+        self.end_frame = end_frame
+        self.upload_session = upload_session
+        self.error_message = error_message
+        self.transcript = None
+        self.llm_response = None
+        self.speaker = None # SentenceSpeaker speaking this turn's reply
+        self.popup_shown = False
+        self.cancel_event = threading.Event()
+        self.frames_released = False
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        if self.cancelled:
+            raise TurnCancelled()
+
+    def release_frames(self):
+        with recording_lock:
+            if not self.frames_released:
+                self.frames_released = True
+                pinned = self.upload_session.pinned_frame if self.upload_session is not None else self.start_frame
+                _release_persistent_frames(self.ring, pinned)
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.upload_session is not None:
+            self.upload_session.cancel()
+        if self.speaker is not None:
+            self.speaker.stop()
+
+class TurnPipeline:
+    """
+    ASR, LLM and TTS workers connected by bounded queues.
+
+    Each stage runs on its own thread, so a turn's reply can be spoken while
+    the next recording is already being transcribed. With BARGE_IN, pressing
+    space cancels every turn still in flight: playback stops at once,
+    unfinished LLM streams are abandoned and their results are discarded.
+    """
+    QUEUE_SIZE = 2
+
+    def __init__(self):
+        self.asr_queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.llm_queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.tts_queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.active_turns = set()
+        self.lock = threading.Lock()
+        stages = (
+            ("asr", self.asr_queue, _asr_stage, self.llm_queue, False),
+            ("llm", self.llm_queue, _llm_stage, self.tts_queue, False),
+            ("tts", self.tts_queue, _tts_stage, None, True),
+        )
+        for name, in_queue, stage, out_queue, handles_errors in stages:
+            threading.Thread(target=self._worker, args=(in_queue, stage, out_queue, handles_errors), name=f"turn-{name}", daemon=True).start()
+
+    def submit(self, turn):
+        """Queues a new turn without blocking; returns False (and drops the turn) if the pipeline is full."""
+        with self.lock:
+            self.active_turns.add(turn)
+        # A turn with an error up front (nothing recorded) only needs the TTS stage.
+        try:
+            (self.tts_queue if turn.error_message else self.asr_queue).put_nowait(turn)
+        except queue.Full:
+            print("系统繁忙: 仍在处理之前的录音，本次录音已丢弃。", file=sys.stderr)
+            turn.cancel()
+            self._finish(turn)
+            return False
+        return True
+
+    def cancel_all(self):
+        """Cancels every turn in flight (barge-in). Returns how many were cancelled."""
+        with self.lock:
+            turns = list(self.active_turns)
+        for turn in turns:
+            turn.cancel()
+        close_status_popup()
+        return len(turns)
+
+    def busy(self):
+        with self.lock:
+            return bool(self.active_turns)
+
+    def _worker(self, in_queue, stage, out_queue, handles_errors):
+        while True:
+            turn = in_queue.get()
+            if turn.cancelled:
+                self._finish(turn)
+                continue
+            if turn.error_message is None or handles_errors:
+                try:
+                    stage(turn)
+                except TurnCancelled:
+                    print(f"DEBUG: 第 {turn.id} 轮已被打断，丢弃其结果。")
+                    self._finish(turn)
+                    continue
+                except Exception as e:
+                    print(f"处理/回复未知错误: {e}", file=sys.stderr)
+                    traceback.print_exc(file=sys.stderr)
+                    turn.error_message = turn.error_message or MSG_UNEXPECTED_ERROR
+            if out_queue is not None and not turn.cancelled:
+                out_queue.put(turn)
+            else:
+                self._finish(turn)
+
+    def _finish(self, turn):
+        turn.release_frames()
+        if turn.upload_session is not None and turn.cancelled:
+            turn.upload_session.cancel()
+        with self.lock:
+            self.active_turns.discard(turn)
+        outcome = "cancelled" if turn.cancelled else ("error" if turn.error_message else "ok")
+        latency_log.record(turn.trace, turn.id, outcome)
+        if not turn.cancelled:
+            print("-" * 20)
+            print("按住空格开始新的录音。")
 
-    except Exception as e:
-        print(f"Error in LLM Response Tkinter thread: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        q.put(None) # Signal error
+turn_pipeline = None # Created in __main__
 
-def show_response_popup_tk(text_to_display, title="LLM Response"):
-    """Starts the tkinter pop-up for LLM response in a thread."""
-    print("DEBUG: Requesting LLM Response Tkinter pop-up window creation...")
-    q = queue.Queue()
-    thread = threading.Thread(target=_create_and_run_tk_window, args=(text_to_display, q, title), daemon=True)
-    thread.start()
-    try:
-        popup_window = q.get(timeout=5.0)
-        if popup_window:
-            print("DEBUG: Received LLM Response Tkinter window object.")
-            return popup_window
-        else:
-            print("Error: LLM Response Tkinter thread signaled error.", file=sys.stderr)
-            return None
-    except queue.Empty:
-        print("Error: Timed out waiting for LLM Response popup.", file=sys.stderr)
-        return None
-    except Exception as e:
-        print(f"Error retrieving LLM Response popup: {e}", file=sys.stderr)
-        return None
-
-# --- Stop Recording, Save, Transcribe, Query LLM, Show/Speak Response ---
+# --- Stop Recording (Capture Stage) ---
 def stop_recording_and_save():
-    """Stops recording, saves audio, transcribes, gets LLM response, shows/speaks it."""
-    global is_recording, audio_data, stream, SHOW_LLM_RESPONSE_POPUP, POPUP_AUTO_CLOSE, ENABLE_TTS
+    """Stops recording and hands the utterance to the turn pipeline; returns without waiting for the reply."""
+    global is_recording, recording_ring, stream, upload_session, current_trace
     local_stream = None
-    local_audio_data = None
+    local_ring = None
+    local_upload_session = None
+    local_trace = None
+    start_frame, end_frame = 0, None
     should_process = False
-    llm_popup_window = None # For the final LLM response popup
 
     with recording_lock:
         if is_recording:
             print("DEBUG: Stopping recording process...")
             is_recording, should_process = False, True
-            local_stream, local_audio_data = stream, audio_data
-            stream, audio_data = None, None
+            local_stream, local_ring, local_upload_session, local_trace = stream, recording_ring, upload_session, current_trace
+            if local_trace is not None:
+                local_trace.mark("key_release")
+            start_frame = recording_start_frame
+            if persistent_stream is not None:
+                end_frame = recording_ring.frames_written # The stream keeps running; cut at release
+            else:
+                recording_ring = None
+            stream, upload_session, current_trace = None, None, None
         else:
             print("DEBUG: stop_recording_and_save called, but not currently recording.")
             return
@@ -400,146 +1374,225 @@ def stop_recording_and_save():
         except Exception as e:
             print(f"停止/关闭音频流时出错: {e}", file=sys.stderr)
 
-    if not local_audio_data or len(local_audio_data) == 0:
+    if end_frame is None and local_ring is not None:
+        end_frame = local_ring.frames_written # Stream is closed, nothing more will arrive
+
+    if local_ring is None or end_frame <= start_frame:
         print("没有录制到有效音频数据。")
-        error_message = "I didn't capture any audio."
-        if ENABLE_TTS:
-            speak_text(error_message)
-        else:
-            print(f"DEBUG: TTS Disabled. Info: {error_message}")
-        print("-" * 20)
-        print("按住空格开始新的录音。按 Ctrl+C 退出。")
+        if local_upload_session is not None:
+            local_upload_session.cancel()
+        turn_pipeline.submit(Turn(local_ring, start_frame, start_frame, error_message=MSG_NO_AUDIO, trace=local_trace))
         return
 
-    filename = None
-    server_relative_path = None
-    try:
-        os.makedirs(AUDIO_SAVE_DIR, exist_ok=True)
-        if not local_audio_data:
-            raise ValueError("Internal error: local_audio_data None after check")
-        recording = np.concatenate(local_audio_data, axis=0)
-        if recording.size == 0:
-            raise ValueError("录音数据合并后为空")
-
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        filename_base = f"{FILENAME_BASE}_{timestamp}.wav"
-        full_save_path = os.path.join(AUDIO_SAVE_DIR, filename_base)
-        sf.write(full_save_path, recording, SAMPLERATE)
-        print(f"录音已保存到: {full_save_path}")
-        server_relative_path = filename_base
-
-        transcribed_text = transcribe_audio_by_path(server_relative_path)
-
-        if transcribed_text:
-            print("*" * 100)
-            print(f"\n转录结果: {transcribed_text}")
-
-            display_status_popup("正在生成中...")
-            llm_response = None
-            try:
-                 llm_response = get_llm_response_langchain(transcribed_text)
-            finally:
-                 close_status_popup() # Close "Generating" popup
+    turn_pipeline.submit(Turn(local_ring, start_frame, end_frame, local_upload_session, trace=local_trace))
 
-            if llm_response:
-                print(f"\nLLM 回复: {llm_response}")
-                try:
-                    if SHOW_LLM_RESPONSE_POPUP:
-                        llm_popup_window = show_response_popup_tk(llm_response)
-                        if not llm_popup_window:
-                            print("警告: 无法创建LLM回复弹窗。", file=sys.stderr)
-
-                    if ENABLE_TTS:
-                        speak_text(llm_response)
-                    else:
-                        print("DEBUG: TTS reading disabled.")
-
-                    if llm_popup_window and POPUP_AUTO_CLOSE and ENABLE_TTS:
-                        print("DEBUG: Auto-closing LLM response popup...")
-                        try:
-                            llm_popup_window.destroy()
-                            print("DEBUG: LLM response popup destroyed via auto-close.")
-                        except tk.TclError as e_tk:
-                             print(f"DEBUG: Info auto-closing LLM popup (likely closed): {e_tk}", file=sys.stderr)
-                        except Exception as e_close:
-                            print(f"Error auto-closing LLM popup: {e_close}", file=sys.stderr)
-                            traceback.print_exc(file=sys.stderr)
-                    elif llm_popup_window:
-                         if not POPUP_AUTO_CLOSE:
-                             print("DEBUG: Auto-close disabled for LLM popup.")
-                         elif not ENABLE_TTS:
-                             print("DEBUG: TTS disabled, LLM popup requires manual close.")
-
-                except Exception as e_popup_tts:
-                     print(f"Error during LLM popup/TTS phase: {e_popup_tts}", file=sys.stderr)
-                     traceback.print_exc(file=sys.stderr)
-
-            else:
-                print("\n未能获取 LLM 回复。")
-                error_message = "Sorry, no LLM response."
-                if ENABLE_TTS:
-                    speak_text(error_message)
-                else:
-                    print(f"DEBUG: TTS Disabled. Error: {error_message}")
+# --- Pipeline Stages: Transcribe, Query LLM, Show/Speak Response ---
+def _asr_stage(turn):
+    """Finishes the streaming upload, or writes the WAV and posts its path, and stores the transcript."""
+    try:
+        if turn.upload_session is not None:
+            # Audio has already been streamed to the server while recording; just close the body.
+            recorded_frames = turn.end_frame - turn.start_frame
+            print(f"等待流式转录结果 (录音时长 {recorded_frames / get_capture_format()[0]:.1f} 秒)...")
+            transcribed_text = turn.upload_session.finish(turn.end_frame)
+            turn.release_frames()
+            if turn.upload_session.no_speech:
+                print(f"未检测到语音 (少于 {CLIENT_VAD_MIN_SPEECH_MS:g} 毫秒)，未发送转录请求。")
+                turn.trace.mark("vad_rejected")
+                turn.error_message = MSG_NO_SPEECH
+                return
         else:
-            print("\n未能转录音频。")
-            error_message = "Sorry, couldn't transcribe."
-            if ENABLE_TTS:
-                speak_text(error_message)
-            else:
-                print(f"DEBUG: TTS Disabled. Error: {error_message}")
-
+            os.makedirs(AUDIO_SAVE_DIR, exist_ok=True)
+            # A closed stream's frames can be used in place; the persistent ring keeps rolling, so copy.
+            recording = turn.ring.read(turn.start_frame, turn.end_frame, copy=persistent_stream is not None)
+            turn.release_frames()
+            if recording.size == 0:
+                raise ValueError("录音数据合并后为空")
+            recording = AsrPcmConverter(*get_capture_format()).convert(recording, last=True)
+            if client_vad is not None:
+                bounds = client_vad.trim(recording)
+                if bounds is None:
+                    print(f"未检测到语音 (少于 {CLIENT_VAD_MIN_SPEECH_MS:g} 毫秒)，未发送转录请求。")
+                    turn.trace.mark("vad_rejected")
+                    turn.error_message = MSG_NO_SPEECH
+                    return
+                start, end = bounds
+                if end - start < len(recording):
+                    print(f"已裁剪静音: {len(recording) / ASR_SAMPLERATE:.1f} 秒 -> {(end - start) / ASR_SAMPLERATE:.1f} 秒")
+                    recording = recording[start:end]
+
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            filename_base = f"{FILENAME_BASE}_{timestamp}.wav"
+            full_save_path = os.path.join(AUDIO_SAVE_DIR, filename_base)
+            sf.write(full_save_path, recording, ASR_SAMPLERATE, subtype='PCM_16')
+            turn.trace.mark("wav_written")
+            print(f"录音已保存到: {full_save_path}")
+
+            transcribed_text = transcribe_audio_by_path(filename_base, turn.trace)
+        turn.trace.mark("asr_response")
     except ValueError as ve:
         print(f"处理音频出错: {ve}", file=sys.stderr)
-        error_message = "Audio processing error."
+        turn.error_message = MSG_AUDIO_ERROR
+        return
+    turn.check()
+    if not transcribed_text:
+        print("\n未能转录音频。")
+        turn.error_message = MSG_NO_TRANSCRIPTION
+        return
+    turn.transcript = transcribed_text
+    print("*" * 100)
+    print(f"\n转录结果: {transcribed_text}")
+
+def _llm_stage(turn):
+    """Gets the reply (from the cache or the LLM) and, in streaming mode, starts speaking it sentence by sentence."""
+    cache_context, query_embedding, llm_response = conversation_context(turn.transcript), None, None
+    if llm_response_cache is not None:
+        llm_response, query_embedding = llm_response_cache.get(turn.transcript, cache_context)
+    splitter = None
+    if llm_response is not None:
+        # Asked before: answer at once, without the "Generating" phase.
+        print("LLM 回复命中缓存。")
+        turn.trace.mark("llm_cache_hit")
+        if conversation_memory is not None:
+            conversation_memory.add_turn(turn.transcript, llm_response)
+    elif STREAM_LLM_RESPONSE:
+        # Speak each sentence as soon as it is complete instead of waiting for the whole reply.
+        splitter = SentenceSplitter()
+        if ENABLE_TTS and get_tts_backend():
+            turn.speaker = SentenceSpeaker(on_sentence_start=highlight_spoken_sentence if SHOW_LLM_RESPONSE_POPUP else None, trace=turn.trace)
+            if turn.cancelled: # Superseded while waiting for the previous reply's playback
+                turn.speaker.stop()
+        first_token = [True]
+
+        def on_token(text):
+            turn.check() # Abandons the stream on barge-in
+            if first_token[0]:
+                first_token[0] = False
+                turn.trace.mark("first_token")
+                close_status_popup() # Close "Generating" popup at the first token
+                print("\nLLM 回复 (流式): ", end="")
+                if SHOW_LLM_RESPONSE_POPUP:
+                    turn.popup_shown = show_response_popup_tk("") # Filled in as tokens arrive
+            print(text, end="", flush=True)
+            if turn.popup_shown:
+                append_response_popup(text)
+            if turn.speaker is not None:
+                for sentence in splitter.feed(text):
+                    turn.speaker.say(sentence)
+
+    if llm_response is None:
+        display_status_popup("正在生成中...")
+        try:
+            llm_response = get_llm_response_langchain(turn.transcript, on_token=on_token if STREAM_LLM_RESPONSE else None,
+                                                      cache_context=cache_context, query_embedding=query_embedding)
+            if llm_response:
+                turn.trace.mark("first_token") # Non-streaming: the whole reply arrives at once
+                turn.trace.mark("last_token")
+        finally:
+            close_status_popup() # Close "Generating" popup
+            if turn.speaker is not None:
+                if not turn.cancelled:
+                    turn.speaker.say(splitter.flush())
+                turn.speaker.finish()
+    turn.check()
+
+    if not llm_response:
+        print("\n未能获取 LLM 回复。")
+        turn.error_message = MSG_NO_LLM_RESPONSE
+        return
+    turn.llm_response = llm_response
+    print(f"\nLLM 回复: {llm_response}")
+    if SHOW_LLM_RESPONSE_POPUP and not turn.popup_shown:
+        turn.popup_shown = show_response_popup_tk(llm_response)
+        if not turn.popup_shown:
+            print("警告: 无法创建LLM回复弹窗。", file=sys.stderr)
+
+def _tts_stage(turn):
+    """Speaks the reply (or the turn's error message), then auto-closes the response popup."""
+    if turn.error_message:
+        if turn.speaker is not None:
+            turn.speaker.wait() # Let any partial reply finish before the error message
         if ENABLE_TTS:
-            speak_text(error_message)
+            turn.speaker = start_speaking(turn.error_message, trace=turn.trace)
+            if turn.speaker is not None:
+                if turn.cancelled:
+                    turn.speaker.stop()
+                turn.speaker.wait()
         else:
-            print(f"DEBUG: TTS Disabled. Error: {error_message}")
-    except Exception as e:
-        print(f"处理/回复未知错误: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        error_message = "Unexpected error."
-        if ENABLE_TTS:
-            speak_text(error_message)
+            print(f"DEBUG: TTS Disabled. Error: {turn.error_message}")
+        return
+
+    try:
+        if turn.speaker is not None:
+            turn.speaker.wait() # Sentences have been playing since the first one was complete
+        elif ENABLE_TTS:
+            turn.speaker = SentenceSpeaker(highlight_spoken_sentence if turn.popup_shown else None, trace=turn.trace)
+            if turn.cancelled:
+                turn.speaker.stop()
+            splitter = SentenceSplitter()
+            for sentence in splitter.feed(turn.llm_response):
+                turn.speaker.say(sentence)
+            turn.speaker.say(splitter.flush())
+            turn.speaker.finish()
+            turn.speaker.wait()
         else:
-            print(f"DEBUG: TTS Disabled. Error: {error_message}")
-    finally:
-        print("-" * 20)
-        try:
-             llm_popup_open = llm_popup_window and llm_popup_window.winfo_exists()
-             if llm_popup_open:
-                  was_auto_close_intended = POPUP_AUTO_CLOSE and ENABLE_TTS
-                  if not was_auto_close_intended:
-                       if not ENABLE_TTS:
-                           print("LLM回复弹窗仍然打开，可手动关闭或开始下一轮对话。")
-                       else:
-                           print("LLM回复弹窗仍然打开，需手动关闭。")
-        except Exception as e_final_check:
-             print(f"DEBUG: Error checking LLM popup status: {e_final_check}", file=sys.stderr)
-        print("按住空格开始新的录音。")
-
-
-# --- Transcription Function ---
-def transcribe_audio_by_path(audio_path_relative_to_server_dir):
-    print(f"请求 SenseVoice 转录: {audio_path_relative_to_server_dir} -> {SENSEVOICE_API_URL}")
-    if not SENSEVOICE_API_URL:
-        print("错误: SENSEVOICE_API_URL 未配置。", file=sys.stderr)
-        return None
-    payload = json.dumps({"audio_path": audio_path_relative_to_server_dir})
-    headers = {'Content-Type': 'application/json'}
+            print("DEBUG: TTS reading disabled.")
+        turn.check()
+
+        if turn.popup_shown and POPUP_AUTO_CLOSE and ENABLE_TTS:
+            print("DEBUG: Auto-closing LLM response popup...")
+            close_response_popup()
+        elif turn.popup_shown:
+            if not POPUP_AUTO_CLOSE:
+                print("DEBUG: Auto-close disabled for LLM popup.")
+                print("LLM回复弹窗仍然打开，需手动关闭。")
+            elif not ENABLE_TTS:
+                print("DEBUG: TTS disabled, LLM popup requires manual close.")
+                print("LLM回复弹窗仍然打开，可手动关闭或开始下一轮对话。")
+    except TurnCancelled:
+        raise
+    except Exception as e_popup_tts:
+        print(f"Error during LLM popup/TTS phase: {e_popup_tts}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+
+
+# --- Transcription Functions ---
+def get_asr_session():
+    """Returns the shared requests.Session, so every utterance reuses a kept-alive connection to the server."""
+    global asr_session
+    with http_client_lock:
+        if asr_session is None:
+            asr_session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+            asr_session.mount("http://", adapter)
+            asr_session.mount("https://", adapter)
+        return asr_session
+
+def _post_transcription_request(url, description, trace=None, **post_kwargs):
+    """
+    POSTs to a SenseVoice endpoint and returns the 'transcription' field, or None on any failure.
+
+    With a TurnTrace, its request_id is sent as X-Request-ID and the server's
+    per-stage timings are stored on the trace.
+    """
     try:
-        response = requests.post(SENSEVOICE_API_URL, headers=headers, data=payload, timeout=180)
+        if trace is not None:
+            post_kwargs['headers'] = dict(post_kwargs.get('headers') or {}, **{'X-Request-ID': trace.request_id})
+        response = get_asr_session().post(url, timeout=180, **post_kwargs)
         response.raise_for_status()
         result = response.json()
+        if trace is not None:
+            trace.server_timings = result.get('timings')
         if 'transcription' in result:
-            print(f"转录成功: {audio_path_relative_to_server_dir}")
+            for partial in result.get('partials') or []:
+                print(f"  分段转录 [{partial['start_ms'] / 1000:.1f}s - {partial['end_ms'] / 1000:.1f}s]: {partial['text']}")
+            print(f"转录成功: {description}")
             return result['transcription']
         else:
             print(f"错误: API 响应缺少 'transcription': {response.text}", file=sys.stderr)
             return None
     except requests.exceptions.ConnectionError:
-        print(f"错误: 无法连接到 API ({SENSEVOICE_API_URL}).", file=sys.stderr)
+        print(f"错误: 无法连接到 API ({url}).", file=sys.stderr)
         return None
     except requests.exceptions.Timeout:
         print("错误: API 请求超时。", file=sys.stderr)
@@ -555,28 +1608,422 @@ def transcribe_audio_by_path(audio_path_relative_to_server_dir):
         traceback.print_exc(file=sys.stderr)
         return None
 
+def transcribe_audio_by_path(audio_path_relative_to_server_dir, trace=None):
+    print(f"请求 SenseVoice 转录: {audio_path_relative_to_server_dir} -> {SENSEVOICE_API_URL}")
+    if not SENSEVOICE_API_URL:
+        print("错误: SENSEVOICE_API_URL 未配置。", file=sys.stderr)
+        return None
+    # sample_rate tells the server the file is already at the model's rate, so it can skip resampling
+    payload = json.dumps({"audio_path": audio_path_relative_to_server_dir, "sample_rate": ASR_SAMPLERATE})
+    headers = {'Content-Type': 'application/json'}
+    return _post_transcription_request(SENSEVOICE_API_URL, audio_path_relative_to_server_dir, trace, headers=headers, data=payload)
+
+class StreamingUploadSession:
+    """
+    Streams raw PCM blocks to SENSEVOICE_STREAM_API_URL while the space bar is held.
+
+    A background thread polls the recording's AudioRingBuffer, converts new frames
+    to mono ASR_SAMPLERATE int16 and sends them as a chunked HTTP body, so the
+    server receives the audio as it is recorded and no WAV file has to be written.
+    finish() ends the body and returns the transcription.
+
+    With CLIENT_VAD the audio passes through a SpeechGate and the request is
+    only opened once speech has started; if the recording ends first, nothing
+    is sent at all and `no_speech` is set.
+    """
+
+    def __init__(self, ring, converter, start_frame=0, trace=None):
+        self.ring = ring
+        self.converter = converter
+        self.trace = trace
+        self.sent_frames = start_frame
+        self.pinned_frame = start_frame # Last read position this session set on the ring
+        self.end_frame = None
+        self.finished = threading.Event()
+        self.cancelled = False
+        self.result = None
+        self.gate = SpeechGate(client_vad) if client_vad is not None else None
+        self.no_speech = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def _iter_pcm(self):
+        """Yields converted (and gated) PCM blocks as they are recorded, until finish() or cancel()."""
+        while not self.cancelled:
+            done = self.finished.wait(UPLOAD_POLL_INTERVAL)
+            end = self.ring.frames_written
+            if self.end_frame is not None:
+                end = min(end, self.end_frame)
+            if end > self.sent_frames:
+                pcm = self.converter.convert(self.ring.read(self.sent_frames, end), last=done)
+                self.sent_frames = end
+                with recording_lock:
+                    # Leave the position alone once a newer press has pinned its pre-roll.
+                    if self.ring.read_position == self.pinned_frame:
+                        self.ring.set_read_position(end)
+                        self.pinned_frame = end
+            elif done:
+                pcm = self.converter.convert(self.ring.read(end, end), last=True)
+            else:
+                continue
+            if self.gate is not None:
+                pcm = self.gate.feed(pcm, last=done)
+            if pcm.size:
+                yield pcm
+            if done:
+                return
+
+    def _run(self):
+        blocks = self._iter_pcm()
+        if self.gate is not None:
+            first = next(blocks, None) # Blocks until speech starts or the recording ends
+            if first is None:
+                if not self.cancelled:
+                    self.no_speech = True
+                return
+            blocks = itertools.chain([first], blocks)
+        print(f"请求 SenseVoice 流式转录 -> {SENSEVOICE_STREAM_API_URL}")
+        headers = {
+            'Content-Type': 'application/octet-stream',
+            'X-Sample-Rate': str(ASR_SAMPLERATE),
+            'X-Channels': '1',
+            'X-Sample-Format': 'int16',
+        }
+        result = _post_transcription_request(SENSEVOICE_STREAM_API_URL, "流式上传", self.trace, headers=headers, data=(pcm.tobytes() for pcm in blocks))
+        if not self.cancelled:
+            self.result = result
+
+    def finish(self, end_frame=None, timeout=180):
+        """Closes the upload body at `end_frame` (default: whatever has been written) and waits for the transcription."""
+        self.end_frame = end_frame
+        self.finished.set()
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            print("错误: 等待流式转录结果超时。", file=sys.stderr)
+            return None
+        return self.result
+
+    def cancel(self):
+        """Stops the upload without waiting; any result is discarded."""
+        self.cancelled = True
+        self.finished.set()
+
+# --- Conversation Memory ---
+_CJK_CHAR = re.compile(r'[\u3000-\u30ff\u3400-\u9fff\uac00-\ud7af\uff00-\uffef]')
+
+def estimate_tokens(text):
+    """Rough token count without a tokenizer download: ~1 token per CJK character, ~4 other characters per token."""
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4 + 4 # +4 per-message overhead
+
+class ConversationMemory:
+    """
+    Prior turns of the dialogue, sent with each request within a token budget.
+
+    The message list always starts with the same SystemMessage, so
+    OpenAI-compatible backends can reuse their prompt cache. When the history
+    exceeds the budget, the oldest turns are dropped in one go down to
+    TRIM_TARGET of the budget rather than one turn per request. That keeps the
+    prefix unchanged for several turns instead of shifting it every time. With
+    summarize=True the dropped turns are condensed into a running summary by
+    the LLM in the background.
+    """
+    TRIM_TARGET = 0.6
+    SUMMARY_PROMPT = "请用简洁的中文总结以下对话的要点（保留人名、事实和未完成的问题），不超过150字："
+
+    def __init__(self, system_prompt, token_budget, summarize=False):
+        self.system_prompt = system_prompt
+        self.token_budget = token_budget
+        self.summarize = summarize
+        self.turns = [] # [(user_text, assistant_text, tokens)]
+        self.summary = ""
+        self.lock = threading.Lock()
+
+    def build_messages(self, prompt_text):
+        with self.lock:
+            messages = [SystemMessage(content=self.system_prompt)]
+            if self.summary:
+                messages.append(SystemMessage(content=f"之前对话的摘要：{self.summary}"))
+            for user_text, assistant_text, _ in self.turns:
+                messages.append(HumanMessage(content=user_text))
+                messages.append(AIMessage(content=assistant_text))
+        messages.append(HumanMessage(content=prompt_text))
+        return messages
+
+    def add_turn(self, user_text, assistant_text):
+        tokens = estimate_tokens(user_text) + estimate_tokens(assistant_text)
+        with self.lock:
+            self.turns.append((user_text, assistant_text, tokens))
+            fixed = estimate_tokens(self.system_prompt) + (estimate_tokens(self.summary) if self.summary else 0)
+            total = fixed + sum(turn[2] for turn in self.turns)
+            if total <= self.token_budget:
+                return
+            dropped = []
+            while self.turns and total > self.token_budget * self.TRIM_TARGET:
+                turn = self.turns.pop(0)
+                total -= turn[2]
+                dropped.append(turn)
+        print(f"信息: 对话历史超出 {self.token_budget} tokens 预算，移除最早的 {len(dropped)} 轮。")
+        if self.summarize and dropped:
+            threading.Thread(target=self._summarize_dropped, args=(dropped,), daemon=True).start()
+
+    def _summarize_dropped(self, dropped):
+        chat = get_llm_client()
+        if chat is None:
+            return
+        transcript = "\n".join(f"用户: {user}\n助手: {assistant}" for user, assistant, _ in dropped)
+        if self.summary:
+            transcript = f"已有摘要: {self.summary}\n{transcript}"
+        try:
+            response = chat.invoke([HumanMessage(content=f"{self.SUMMARY_PROMPT}\n{transcript}")])
+            if response and response.content:
+                with self.lock:
+                    self.summary = response.content.strip()
+                print("信息: 对话摘要已更新。")
+        except Exception as e:
+            print(f"警告: 生成对话摘要失败: {e}", file=sys.stderr)
+
+    def history_digest(self, last_turns):
+        """Hash of the last `last_turns` turns (or of the summary before the first one), "" while the history is empty."""
+        with self.lock:
+            recent = self.turns[-last_turns:] if last_turns > 0 else []
+            if not recent and not self.summary:
+                return ""
+            payload = "\x00".join([f"{user}\x01{assistant}" for user, assistant, _ in recent] or [self.summary])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def clear(self):
+        with self.lock:
+            self.turns, self.summary = [], ""
+
+conversation_memory = ConversationMemory(SYSTEM_PROMPT, CONVERSATION_TOKEN_BUDGET, CONVERSATION_SUMMARIZE) if CONVERSATION_MEMORY else None
+
+# --- LLM Response Cache ---
+class ResponseCache:
+    """
+    Replies to questions asked before, answered without calling the LLM.
+
+    The exact tier is keyed on the normalized transcript (NFKC, lower case, no
+    punctuation or whitespace, but decimal points between digits are kept) plus
+    the system prompt, model name and a context digest. A standalone question
+    has an empty context, so it hits no matter what was said before. A
+    follow-up (see is_follow_up(): "why?", "继续", "what about tomorrow?") is
+    keyed on the last FOLLOW_UP_CONTEXT_TURNS turns and only matches a reply
+    given right after the same exchange. Entries expire after ttl_s and the
+    least recently used ones are evicted past max_entries. With semantic=True,
+    a miss also embeds the transcript via the pooled OpenAI client and searches
+    a local NumPy index of earlier questions with the same context. It returns
+    a reply whose cosine similarity reaches `similarity`.
+    """
+    FOLLOW_UP_CONTEXT_TURNS = 2
+    STANDALONE_MIN_CHARS = 6 # Shorter questions ("why?", "继续", "几点了") are treated as follow-ups
+    FOLLOW_UP = re.compile(
+        r"它|这个|那个|这些|那些|这样|那样|他们|他|她|为什么|继续|然后|接着|还有|刚才|上面|之前|再说|呢"
+        r"|\b(?:it|its|this|that|these|those|he|she|him|her|they|them|why|again|continue|more|what about|how about|and then)\b"
+    )
+
+    def __init__(self, ttl_s, max_entries, semantic=False, embedding_model=None, similarity=0.95):
+        self.ttl_s = ttl_s
+        self.max_entries = max(1, max_entries)
+        self.semantic = semantic
+        self.embedding_model = embedding_model
+        self.similarity = similarity
+        self.entries = OrderedDict() # key -> (reply, stored_at, embedding or None, history digest)
+        self.lock = threading.Lock()
+        self.hits = self.semantic_hits = self.misses = 0
+
+    @staticmethod
+    def normalize(text):
+        text = unicodedata.normalize("NFKC", text).lower()
+        kept = []
+        for i, c in enumerate(text):
+            if c.isspace():
+                continue
+            if unicodedata.category(c).startswith("P"):
+                # "3.5" and "35" are different questions
+                if not (c == "." and 0 < i < len(text) - 1 and text[i - 1].isdigit() and text[i + 1].isdigit()):
+                    continue
+            kept.append(c)
+        return "".join(kept)
+
+    @classmethod
+    def is_follow_up(cls, text):
+        """True if `text` probably refers to earlier turns (short, or with a pronoun or follow-up phrase)."""
+        return len(cls.normalize(text)) < cls.STANDALONE_MIN_CHARS or bool(cls.FOLLOW_UP.search(unicodedata.normalize("NFKC", text).lower()))
+
+    def _key(self, text, context):
+        payload = "\x00".join((self.normalize(text), SYSTEM_PROMPT, OPENAI_MODEL_NAME or "", context))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _embed(self, text):
+        chat = get_llm_client()
+        if chat is None:
+            return None
+        try:
+            data = chat.root_client.embeddings.create(model=self.embedding_model, input=[self.normalize(text) or text]).data
+            vector = np.asarray(data[0].embedding, dtype=np.float32)
+            return vector / (np.linalg.norm(vector) or 1.0)
+        except Exception as e:
+            print(f"警告: 计算问题向量失败，跳过语义缓存: {e}", file=sys.stderr)
+            return None
+
+    def _expire_locked(self):
+        cutoff = time.time() - self.ttl_s
+        for key in [key for key, entry in self.entries.items() if entry[1] < cutoff]:
+            del self.entries[key]
+
+    def get(self, text, context=""):
+        """
+        Looks up `text` asked after the history with digest `context`.
+
+        Returns (reply or None, query embedding or None). On a miss, pass the
+        embedding back to put() so the transcript is not embedded twice.
+        """
+        key = self._key(text, context)
+        with self.lock:
+            self._expire_locked()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0], None
+        query = None
+        if self.semantic:
+            query = self._embed(text)
+            if query is not None:
+                with self.lock:
+                    candidates = [(k, entry) for k, entry in self.entries.items() if entry[2] is not None and entry[3] == context]
+                    if candidates:
+                        scores = np.stack([entry[2] for _, entry in candidates]) @ query
+                        best = int(np.argmax(scores))
+                        if scores[best] >= self.similarity:
+                            self.entries.move_to_end(candidates[best][0])
+                            self.semantic_hits += 1
+                            print(f"信息: 语义缓存命中 (相似度 {scores[best]:.3f})。")
+                            return candidates[best][1][0], query
+        with self.lock:
+            self.misses += 1
+        return None, query
+
+    def put(self, text, reply, context="", embedding=None):
+        key = self._key(text, context)
+        if self.semantic and embedding is None:
+            embedding = self._embed(text)
+        with self.lock:
+            self.entries[key] = (reply, time.time(), embedding, context)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+llm_response_cache = ResponseCache(LLM_CACHE_TTL_S, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_SEMANTIC, LLM_CACHE_EMBEDDING_MODEL, LLM_CACHE_SIMILARITY) if LLM_CACHE else None
+
+def conversation_context(prompt_text):
+    """Cache context of `prompt_text`: "" for standalone questions (or without memory), else a digest of the recent turns."""
+    if conversation_memory is None or not ResponseCache.is_follow_up(prompt_text):
+        return ""
+    return conversation_memory.history_digest(ResponseCache.FOLLOW_UP_CONTEXT_TURNS)
+
+def _record_llm_reply(prompt_text, reply, cache_context=None, query_embedding=None):
+    """
+    Adds a finished turn to the conversation memory and the response cache.
+
+    `cache_context` is the question's conversation_context() (taken now if
+    None, before the turn is added); `query_embedding` is the vector
+    returned by the cache lookup, if any.
+    """
+    if cache_context is None:
+        cache_context = conversation_context(prompt_text)
+    if conversation_memory is not None:
+        conversation_memory.add_turn(prompt_text, reply)
+    if llm_response_cache is not None:
+        llm_response_cache.put(prompt_text, reply, cache_context, query_embedding)
+
 # --- LLM Interaction ---
-def get_llm_response_langchain(prompt_text):
-    print(f"向 LLM 发送请求 (模型: {OPENAI_MODEL_NAME})...")
+def get_llm_client():
+    """
+    Returns the process-wide ChatOpenAI client, creating it on first use.
+
+    The client owns one httpx connection pool with keep-alive, so consecutive
+    turns reuse the same TLS connection instead of handshaking every time.
+    Returns None if the API key or model name is missing.
+    """
+    global llm_client
+    load_llm_modules()
     if not OPENAI_API_KEY:
         print("错误: OPENAI_API_KEY 未配置。", file=sys.stderr)
         return None
     if not OPENAI_MODEL_NAME:
         print("错误: OPENAI_MODEL_NAME 未配置。", file=sys.stderr)
         return None
+    with http_client_lock:
+        if llm_client is None:
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=4, max_keepalive_connections=2, keepalive_expiry=LLM_KEEPALIVE_EXPIRY),
+                timeout=httpx.Timeout(120.0, connect=10.0),
+            )
+            openai_kwargs = {"openai_api_key": OPENAI_API_KEY, "model": OPENAI_MODEL_NAME, "temperature": 0.7, "http_client": http_client}
+            if OPENAI_BASE_URL:
+                openai_kwargs["base_url"] = OPENAI_BASE_URL
+            llm_client = ChatOpenAI(**openai_kwargs)
+        return llm_client
+
+def warm_up_llm_client():
+    """Builds the LLM client and opens its connection ahead of the first turn. Errors are only logged."""
+    start = time.perf_counter()
+    chat = get_llm_client()
+    if chat is None:
+        return
+    try:
+        # Any cheap authenticated request establishes the pooled TLS connection; no tokens are generated.
+        chat.root_client.models.list()
+        print(f"信息: LLM 连接预热完成 ({(time.perf_counter() - start) * 1000:.0f} ms)。")
+    except Exception as e:
+        print(f"信息: LLM 预热请求未成功 ({type(e).__name__}: {e})，首次对话时将重新连接。")
+
+def get_llm_response_langchain(prompt_text, on_token=None, cache_context=None, query_embedding=None):
+    """
+    Sends the transcribed text to the LLM and returns the stripped reply (None on failure).
+
+    If `on_token` is given, the reply is streamed and `on_token(text)` is called
+    with every content chunk as it arrives, so speech and display can start
+    before the completion is finished. `cache_context` and `query_embedding`
+    come from the response cache lookup and are passed on to its put().
+    """
+    print(f"向 LLM 发送请求 (模型: {OPENAI_MODEL_NAME}{', 流式' if on_token else ''})...")
+    load_llm_modules() # The except clauses below need the exception classes
     try:
-        openai_kwargs = {"openai_api_key": OPENAI_API_KEY, "model": OPENAI_MODEL_NAME, "temperature": 0.7}
-        if OPENAI_BASE_URL:
-            openai_kwargs["base_url"] = OPENAI_BASE_URL
-        chat = ChatOpenAI(**openai_kwargs)
-        messages = [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=prompt_text)]
+        chat = get_llm_client()
+        if chat is None:
+            return None
+        if conversation_memory is not None:
+            messages = conversation_memory.build_messages(prompt_text)
+        else:
+            messages = [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=prompt_text)]
+        if on_token is not None:
+            parts = []
+            for chunk in chat.stream(messages):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    on_token(chunk.content)
+            content = "".join(parts)
+            if content.strip():
+                print("LLM 流式回复接收完毕。")
+                _record_llm_reply(prompt_text, content.strip(), cache_context, query_embedding)
+                return content.strip()
+            print("错误: LLM 流式响应为空。", file=sys.stderr)
+            return None
         response = chat.invoke(messages)
         if response and hasattr(response, 'content') and response.content:
             print("LLM 回复接收成功。")
+            _record_llm_reply(prompt_text, response.content.strip(), cache_context, query_embedding)
             return response.content.strip()
         else:
             print(f"错误: LLM 响应无效: {response}", file=sys.stderr)
             return None
+    except TurnCancelled:
+        print("\nLLM 流式回复已中止 (被打断)。")
+        raise
     except AuthenticationError as e:
         print(f"OpenAI 认证失败: {e}", file=sys.stderr)
         return None
@@ -591,98 +2038,261 @@ def get_llm_response_langchain(prompt_text):
         traceback.print_exc(file=sys.stderr)
         return None
 
-# --- Text-to-Speech Function ---
-def speak_text(text_to_speak):
-    global tts_finished_event, tts_engine, ENABLE_TTS
+class SentenceSplitter:
+    """
+    Cuts a streamed reply into sentences as soon as their end punctuation arrives.
+
+    Chinese/full-width terminators and newlines end a sentence immediately; an
+    ASCII '.', '!' or '?' only does so when followed by whitespace, so "3.14"
+    or "e.g." inside a token stream is not split early.
+    """
+    SENTENCE_END = re.compile(r'[。！？；…\n]+|[.!?;]+(?=\s)')
+    MIN_CHARS = 4 # Shorter fragments ("1." list markers, "好。") are merged into the next sentence
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        """Adds streamed text and returns the sentences completed by it."""
+        self.buffer += text
+        sentences = []
+        start = 0
+        for match in self.SENTENCE_END.finditer(self.buffer):
+            candidate = self.buffer[start:match.end()]
+            if len(candidate.strip()) >= self.MIN_CHARS:
+                sentences.append(candidate.strip())
+                start = match.end()
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Returns whatever is left once the stream has ended."""
+        rest, self.buffer = self.buffer.strip(), ""
+        return rest
+
+# --- Text-to-Speech Functions ---
+class PcmPlayer:
+    """Writes PCM chunks to one sd.OutputStream, reopening it only if the sample rate changes."""
+    WRITE_BLOCK_S = 0.05 # Granularity at which a stop request can cut playback off
+
+    def __init__(self):
+        self.stream = None
+        self.samplerate = None
+
+    def write(self, samples, samplerate, stop_event=None):
+        if self.stream is None or samplerate != self.samplerate:
+            self.close()
+            self.stream = sd.OutputStream(samplerate=samplerate, channels=1, dtype='float32')
+            self.stream.start()
+            self.samplerate = samplerate
+        samples = np.ascontiguousarray(samples, dtype=np.float32).reshape(-1, 1)
+        block = max(1, int(samplerate * self.WRITE_BLOCK_S))
+        for start in range(0, len(samples), block):
+            if stop_event is not None and stop_event.is_set():
+                return
+            self.stream.write(samples[start:start + block])
+
+    def close(self, abort=False):
+        """Stops the stream after the queued audio has played out (abort=True discards it)."""
+        if self.stream is not None:
+            try:
+                if abort:
+                    self.stream.abort()
+                else:
+                    self.stream.stop()
+                self.stream.close()
+            except Exception as e:
+                print(f"Error closing TTS output stream: {e}", file=sys.stderr)
+            self.stream = None
+
+def _acquire_tts(stop_event):
+    """Waits until no other SentenceSpeaker is playing and marks TTS as busy. Returns False if stopped first."""
+    if not tts_lock.acquire(blocking=False):
+        print("DEBUG: 等待上一个 TTS 操作结束...")
+        while not tts_lock.acquire(timeout=0.05):
+            if stop_event.is_set():
+                return False
+    tts_finished_event.clear()
+    return True
+
+def _release_tts():
+    tts_finished_event.set()
+    tts_lock.release()
+
+def start_speaking(text_to_speak, on_sentence_start=None, trace=None):
+    """Queues all of `text_to_speak` on a new SentenceSpeaker and returns it, or None if there is nothing to speak."""
     if not ENABLE_TTS:
         print("DEBUG: speak_text called but TTS is disabled.")
-        return
+        return None
     if not text_to_speak:
         print("TTS: 无文本提供。")
-        return
-    if not tts_engine:
+        return None
+    if not get_tts_backend():
         print("TTS: 引擎未初始化。")
-        return
-
-    current_thread_id = threading.get_ident()
-    print(f"DEBUG: speak_text - Preparing [Thread: {current_thread_id}]")
-    temp_audio_file = None
-
-    if not tts_finished_event.wait(timeout=10.0):
-        print("警告: 等待上一个 TTS 操作超时。", file=sys.stderr)
-        tts_finished_event.set()
-
-    tts_finished_event.clear()
-    print(f"DEBUG: speak_text - Cleared event [Thread: {current_thread_id}]")
-
-    try:
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmpfile:
-            temp_audio_file = tmpfile.name
-
-        print(f"DEBUG: Saving TTS to: {temp_audio_file} [Thread: {current_thread_id}]")
-        tts_engine.save_to_file(text_to_speak, temp_audio_file)
-
-        print(f"DEBUG: Before runAndWait (save) [Thread: {current_thread_id}]")
-        tts_engine.runAndWait()
-        print(f"DEBUG: After runAndWait (save) [Thread: {current_thread_id}]")
-
-        if not os.path.exists(temp_audio_file) or os.path.getsize(temp_audio_file) == 0:
-            raise IOError(f"TTS engine failed to save audio to {temp_audio_file}")
+        return None
 
-        print(f"TTS: 正在播放... [Thread: {current_thread_id}]")
+    print(f"DEBUG: speak_text - Preparing [Thread: {threading.get_ident()}]")
+    speaker = SentenceSpeaker(on_sentence_start, trace)
+    splitter = SentenceSplitter()
+    for sentence in splitter.feed(text_to_speak):
+        speaker.say(sentence)
+    speaker.say(splitter.flush())
+    speaker.finish()
+    return speaker
+
+def speak_text(text_to_speak, on_sentence_start=None, trace=None):
+    """Speaks text sentence by sentence (see SentenceSpeaker) and blocks until playback has ended."""
+    speaker = start_speaking(text_to_speak, on_sentence_start, trace)
+    if speaker is not None:
+        speaker.wait()
+
+class SentenceSpeaker:
+    """
+    Speaks text sentence by sentence with synthesis and playback overlapped.
+
+    say() queues a sentence for the synthesis thread, which pulls PCM chunks from
+    tts_backend and hands them to a playback thread that writes them to a single
+    sd.OutputStream. Sentence 1 therefore plays while sentence 2 is still being
+    generated by the LLM or synthesized, and streaming backends start playing
+    before a sentence is fully synthesized. The playback thread takes tts_lock
+    (and TTS counts as busy, tts_finished_event cleared) before its first chunk
+    and holds it until playback has ended, so two speakers never play over each
+    other, while a new reply can already be generated and synthesized.
+
+    If given, on_sentence_start(sentence) is called from the playback thread
+    when a sentence starts playing, and on_sentence_start(None) when playback ends.
+    A TurnTrace gets first_audio and playback_end marks.
+    stop() (barge-in) drops everything still queued and cuts playback off.
+    """
+    SENTENCE_START = object() # Marker queued ahead of each sentence's audio
+
+    def __init__(self, on_sentence_start=None, trace=None):
+        self.on_sentence_start = on_sentence_start
+        self.trace = trace
+        self.stopped = threading.Event()
+        self.sentences = queue.Queue()
+        self.audio = queue.Queue(maxsize=8) # Bounded look-ahead of synthesized chunks
+        self.synth_thread = threading.Thread(target=self._synthesize_loop, daemon=True)
+        self.play_thread = threading.Thread(target=self._play_loop, daemon=True)
+        self.synth_thread.start()
+        self.play_thread.start()
+
+    def say(self, sentence):
+        if sentence:
+            self.sentences.put(sentence)
+
+    def finish(self):
+        """Signals that no more sentences will be queued."""
+        self.sentences.put(None)
+
+    def stop(self):
+        """Stops speaking now; queued and unplayed audio is discarded."""
+        self.stopped.set()
+        self.sentences.put(None)
+
+    def wait(self):
+        """Blocks until every queued sentence has been played."""
+        self.synth_thread.join()
+        self.play_thread.join()
+
+    def _synthesize_loop(self):
+        backend = get_tts_backend()
         try:
-            audio_data_tts, file_samplerate = sf.read(temp_audio_file, dtype='float32')
-            print(f"DEBUG: Playing {temp_audio_file} (Rate: {file_samplerate}) [Thread: {current_thread_id}]")
-            sd.play(audio_data_tts, file_samplerate, blocking=True)
-            sd.wait()
-            print(f"DEBUG: sd.play/wait finished [Thread: {current_thread_id}]")
-            print("TTS: 播放完毕。")
-        except sf.SoundFileError as e_sf:
-            print(f"Error reading TTS file {temp_audio_file}: {e_sf}", file=sys.stderr)
-            traceback.print_exc(file=sys.stderr)
+            while True:
+                sentence = self.sentences.get()
+                if sentence is None or self.stopped.is_set():
+                    break
+                print(f"TTS: 合成句子: {sentence}")
+                self.audio.put((self.SENTENCE_START, sentence))
+                try:
+                    for chunk in backend.synthesize(sentence):
+                        if self.stopped.is_set():
+                            break
+                        self.audio.put(chunk)
+                except Exception as e:
+                    print(f"Error during TTS synthesis: {e}", file=sys.stderr)
+                    traceback.print_exc(file=sys.stderr)
+        finally:
+            self.audio.put(None)
+
+    def _play_loop(self):
+        player = PcmPlayer()
+        holding_tts = False
+        try:
+            while True:
+                chunk = self.audio.get()
+                if chunk is None:
+                    break
+                if self.stopped.is_set():
+                    continue # Drain so the synthesis thread can finish
+                if not holding_tts:
+                    holding_tts = _acquire_tts(self.stopped) # Waits for the previous speaker to finish playing
+                    if not holding_tts:
+                        continue
+                if chunk[0] is self.SENTENCE_START:
+                    if self.on_sentence_start is not None:
+                        self.on_sentence_start(chunk[1])
+                    continue
+                if self.trace is not None:
+                    self.trace.mark("first_audio")
+                player.write(*chunk, stop_event=self.stopped)
         except sd.PortAudioError as e_sd:
             print(f"Error playing TTS audio via sounddevice: {e_sd}", file=sys.stderr)
             traceback.print_exc(file=sys.stderr)
+            while self.audio.get() is not None: # Drain so the synthesis thread can finish
+                pass
         except Exception as e_play:
             print(f"Unknown error during TTS playback: {e_play}", file=sys.stderr)
             traceback.print_exc(file=sys.stderr)
-
-    except Exception as e:
-        print(f"Error during TTS generation/setup [Thread: {current_thread_id}]: {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-    finally:
-        print(f"DEBUG: speak_text - finally [Thread: {current_thread_id}]")
-        if temp_audio_file and os.path.exists(temp_audio_file):
-            try:
-                print(f"DEBUG: Deleting temp TTS: {temp_audio_file}")
-                os.remove(temp_audio_file)
-            except Exception as e_del:
-                print(f"Warning: Failed delete temp TTS {temp_audio_file}: {e_del}", file=sys.stderr)
-        tts_finished_event.set()
-        print(f"DEBUG: speak_text - Exiting finally (event set)")
+            while self.audio.get() is not None:
+                pass
+        finally:
+            player.close(abort=self.stopped.is_set())
+            if self.stopped.is_set():
+                print("TTS: 播放已被打断。")
+            elif self.trace is not None:
+                self.trace.mark("playback_end")
+            if self.on_sentence_start is not None:
+                self.on_sentence_start(None)
+            print("TTS: 播放完毕。")
+            if holding_tts:
+                _release_tts()
 
 # --- Keyboard Handlers ---
 def handle_space_press(event):
-    global tts_finished_event, recording_start_timer, is_recording, ENABLE_TTS
-    if ENABLE_TTS and not tts_finished_event.is_set():
+    global tts_finished_event, recording_start_timer, is_recording, pending_start_frame, ENABLE_TTS
+    with recording_lock:
+        if is_recording or recording_start_timer is not None:
+            return # Key auto-repeat while held
+    if BARGE_IN and turn_pipeline is not None and turn_pipeline.busy():
+        cancelled = turn_pipeline.cancel_all()
+        print(f"打断当前回复 ({cancelled} 轮)，准备新的录音。")
+    elif ENABLE_TTS and not tts_finished_event.is_set():
         print("TTS 正在播放，请稍候...")
         return
     with recording_lock:
         if is_recording or recording_start_timer is not None:
             return
         print(f"空格按下，将在 {RECORD_START_DELAY} 秒后开始录音...")
+        if persistent_stream is not None and recording_ring is not None:
+            # Mark the start now so the hold delay and PREROLL_MS before the press are kept.
+            preroll_frames = get_capture_format()[0] * PREROLL_MS // 1000
+            pending_start_frame = max(0, recording_ring.frames_written - preroll_frames)
+            recording_ring.set_read_position(pending_start_frame)
         recording_start_timer = threading.Timer(RECORD_START_DELAY, _initiate_recording_after_delay)
         recording_start_timer.daemon = True
         recording_start_timer.start()
 
 def handle_space_release(event):
-    global recording_start_timer, is_recording
+    global recording_start_timer, is_recording, pending_start_frame
     should_stop_and_save = False
     with recording_lock:
         if recording_start_timer is not None:
             print("空格释放，取消录音启动。")
             recording_start_timer.cancel()
             recording_start_timer = None
+            _release_persistent_frames(recording_ring, pending_start_frame)
+            pending_start_frame = None
             print("-" * 20)
             print("按住空格录音。")
             return
@@ -690,39 +2300,130 @@ def handle_space_release(event):
             print("空格释放，停止录音...")
             should_stop_and_save = True
     if should_stop_and_save:
-        processing_thread = threading.Thread(target=stop_recording_and_save, daemon=True)
-        processing_thread.start()
+        # Closing the stream and queueing the turn stay off the keyboard hook thread.
+        threading.Thread(target=stop_recording_and_save, daemon=True).start()
+
+# --- Startup ---
+def preload_subsystems():
+    """Loads the UI, the LLM client and the TTS engine in the background once the hotkey is live."""
+    started = time.perf_counter()
+    ui = get_tk_ui()
+    if ui is None or not ui.ready.wait(timeout=5.0) or ui.failed:
+        print("警告: 无法启动界面线程，弹窗将不可用。", file=sys.stderr)
+    print(f"信息: 界面已加载 ({(time.perf_counter() - started) * 1000:.0f} ms)。")
+    started = time.perf_counter()
+    try:
+        load_llm_modules()
+        print(f"信息: LLM 模块已加载 ({(time.perf_counter() - started) * 1000:.0f} ms)。")
+    except ImportError as e:
+        print(f"错误: 无法导入 LLM 模块: {e}", file=sys.stderr)
+    if LLM_WARMUP:
+        warm_up_llm_client()
+    started = time.perf_counter()
+    backend = get_tts_backend()
+    if backend is not None:
+        print(f"信息: TTS 引擎已加载 ({(time.perf_counter() - started) * 1000:.0f} ms)。")
+    if isinstance(backend, TtsPhraseCache):
+        backend.prewarm(TTS_FIXED_PHRASES) # Error feedback then plays straight from memory
+
+def profile_startup_imports(top_n=15):
+    """
+    Prints an `-X importtime` summary of importing this module in a fresh
+    interpreter: the total and the top-level packages with the largest
+    cumulative import time. Lazily loaded subsystems report their own load
+    times from preload_subsystems().
+    """
+    module = os.path.splitext(os.path.basename(os.path.abspath(__file__)))[0]
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True,
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            cumulative_us = int(cumulative)
+        except ValueError:
+            continue # Header line
+        if name.startswith("   "):
+            continue # Nested import, already counted in its parent's cumulative time
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0) + cumulative_us
+    total_ms = sum(packages.values()) / 1000.0
+    print(f"启动导入耗时 (python -X importtime -c 'import {module}'): 共 {total_ms:.0f} ms")
+    for package, cumulative_us in sorted(packages.items(), key=lambda item: -item[1])[:top_n]:
+        print(f"  {package:<28}{cumulative_us / 1000.0:>8.1f} ms")
 
 # --- Main Program Entry Point ---
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="按住空格说话的语音助手。")
+    parser.add_argument("--profile-startup", action="store_true", help="打印启动导入耗时分析 (-X importtime 汇总)")
+    args = parser.parse_args()
+
+    # The hotkey goes live first; everything below it is reporting or background loading.
+    try:
+        os.makedirs(AUDIO_SAVE_DIR, exist_ok=True)
+    except OSError as e:
+        print(f"错误: 无法创建目录 '{AUDIO_SAVE_DIR}': {e}", file=sys.stderr)
+        sys.exit(1)
+
+    turn_pipeline = TurnPipeline()
+
+    try:
+        keyboard.unhook_all()
+        keyboard.on_press_key('space', handle_space_press, suppress=False)
+        keyboard.on_release_key('space', handle_space_release)
+        print(f"键盘监听器已注册 (启动后 {(time.perf_counter() - STARTUP_STARTED) * 1000:.0f} ms)。")
+    except ImportError as e:
+        print(f"\n错误：导入 keyboard 失败 - {e}。请运行 'pip install keyboard'。", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"\n错误：无法注册键盘监听器！请检查权限。 {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        sys.exit(1)
+
+    threading.Thread(target=preload_subsystems, name="preload", daemon=True).start()
+
     print("程序启动。")
     print("-" * 30)
-    print("依赖项: sounddevice, numpy, keyboard, soundfile, requests, python-dotenv, langchain, langchain-openai, openai, pyttsx3, tkinter")
+    print("依赖项: sounddevice, numpy, soxr, keyboard, soundfile, requests, python-dotenv, langchain, langchain-openai, openai, pyttsx3, tkinter")
     print("-" * 30)
     print("配置 (从 .env 加载):")
-    print(f"  - 采样率: {SAMPLERATE} Hz")
+    print(f"  - 采样率: {SAMPLERATE} Hz (设备不支持 {ASR_SAMPLERATE} Hz 时使用, 上传前重采样到 {ASR_SAMPLERATE} Hz int16)")
     print(f"  - 通道数: {CHANNELS}")
     device_print = f"'{DEVICE}'" if isinstance(DEVICE, str) else DEVICE
     print(f"  - 音频设备: {device_print if DEVICE is not None else '系统默认'}")
     print(f"  - 录音延迟: {RECORD_START_DELAY} 秒")
+    print(f"  - 常开音频流: {'启用 (预录 ' + str(PREROLL_MS) + ' 毫秒)' if PERSISTENT_INPUT_STREAM else '禁用'}")
     print(f"  - 保存目录: {os.path.abspath(AUDIO_SAVE_DIR)}")
     print(f"  - 文件名前缀: {FILENAME_BASE}")
     print(f"  - 显示LLM弹窗: {'启用' if SHOW_LLM_RESPONSE_POPUP else '禁用'}")
     print(f"  - 弹窗自动关闭 (TTS启用时): {'启用' if POPUP_AUTO_CLOSE else '禁用'}")
     print(f"  - 启用TTS阅读: {'是' if ENABLE_TTS else '否'}")
+    print(f"  - 流式LLM回复 (逐句朗读): {'启用' if STREAM_LLM_RESPONSE else '禁用'}")
+    print(f"  - 打断 (播放中按空格): {'启用' if BARGE_IN else '禁用'}")
     print(f"  - SenseVoice API: {SENSEVOICE_API_URL or '未配置'}")
+    print(f"  - 流式上传音频: {'启用 (' + SENSEVOICE_STREAM_API_URL + ')' if STREAMING_UPLOAD else '禁用'}")
+    print(f"  - 本地静音检测: {'启用 (阈值 ' + format(CLIENT_VAD_ENERGY_DB, 'g') + ' dBFS, 最短语音 ' + format(CLIENT_VAD_MIN_SPEECH_MS, 'g') + ' 毫秒)' if CLIENT_VAD else '禁用'}")
     print(f"  - OpenAI Key: {'已配置' if OPENAI_API_KEY else '未配置!'}")
     print(f"  - OpenAI Base URL: {OPENAI_BASE_URL or '默认 (OpenAI API)'}")
     print(f"  - OpenAI 模型: {OPENAI_MODEL_NAME}")
     print(f"  - 系统提示: '{SYSTEM_PROMPT[:50]}...'")
-    tts_status = '已初始化' if tts_engine else ('初始化失败/禁用' if ENABLE_TTS else '已禁用')
-    print(f"  - TTS 引擎状态: {tts_status}")
+    print(f"  - LLM 回复缓存: {'启用 (TTL ' + str(int(LLM_CACHE_TTL_S)) + ' 秒' + (', 语义匹配 ≥ ' + str(LLM_CACHE_SIMILARITY) if LLM_CACHE_SEMANTIC else '') + ')' if LLM_CACHE else '禁用'}")
+    print(f"  - 多轮对话记忆: {'启用 (预算 ' + str(CONVERSATION_TOKEN_BUDGET) + ' tokens' + (', 自动摘要' if CONVERSATION_SUMMARIZE else '') + ')' if CONVERSATION_MEMORY else '禁用'}")
+    print(f"  - TTS 引擎: {TTS_BACKEND + ' (后台加载)' if ENABLE_TTS else '已禁用'}")
+    print(f"  - TTS 语音缓存: {'启用 (上限 ' + str(TTS_CACHE_MAX_MB) + ' MB)' if TTS_CACHE else '禁用'}")
+    print(f"  - 延迟记录: {os.path.abspath(LATENCY_TRACE_FILE) if LATENCY_TRACE_FILE else '仅退出时打印统计'}")
     print("-" * 30)
     print("操作指南:")
     print(f"  - 按住 [空格键] {RECORD_START_DELAY} 秒开始录音。")
     print("  - 松开 [空格键] 停止录音、处理并获取回复。")
     print("  - 在执行程序的终端按 [Ctrl+C] 键退出程序。")
     print("  - 当弹窗出现且TTS禁用时，可直接开始下一轮对话。")
+    if BARGE_IN:
+        print("  - 朗读或生成回复期间按下 [空格键] 会立即打断并开始新的录音。")
     print("-" * 30)
     print("!! 重要提示:")
     print("  - 确保 `.env` 文件存在且包含所有需要的配置，特别是 OPENAI_API_KEY。")
@@ -730,12 +2431,6 @@ if __name__ == "__main__":
     print("  - 确保本地 API 服务 (若使用) 正在运行。")
     print("-" * 30)
 
-    try:
-        os.makedirs(AUDIO_SAVE_DIR, exist_ok=True)
-    except OSError as e:
-        print(f"错误: 无法创建目录 '{AUDIO_SAVE_DIR}': {e}", file=sys.stderr)
-        sys.exit(1)
-
     try:
         print("可用音频设备列表 (供 AUDIO_INPUT_DEVICE 参考):")
         print(sd.query_devices())
@@ -748,23 +2443,24 @@ if __name__ == "__main__":
         else:
             print("未找到系统默认输入设备。")
         print(f"当前使用设备: {device_print if DEVICE is not None else '系统默认'}")
+        capture_rate, capture_dtype = get_capture_format()
+        print(f"录音格式: {capture_rate} Hz {capture_dtype} -> 上传 {ASR_SAMPLERATE} Hz int16 单声道")
         print("-" * 30)
     except Exception as e:
         print(f"查询音频设备出错: {e}", file=sys.stderr)
         print("-" * 30)
 
-    try:
-        keyboard.unhook_all()
-        keyboard.on_press_key('space', handle_space_press, suppress=False)
-        keyboard.on_release_key('space', handle_space_release)
-        print("键盘监听器已注册。")
-    except ImportError as e:
-        print(f"\n错误：导入 keyboard 失败 - {e}。请运行 'pip install keyboard'。", file=sys.stderr)
-        sys.exit(1)
-    except Exception as e:
-        print(f"\n错误：无法注册键盘监听器！请检查权限。 {e}", file=sys.stderr)
-        traceback.print_exc(file=sys.stderr)
-        sys.exit(1)
+    if PERSISTENT_INPUT_STREAM:
+        try:
+            open_persistent_input_stream()
+        except Exception as e:
+            print(f"错误: 无法打开常开音频流，改为每次按键时打开: {e}", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            close_persistent_input_stream()
+
+    if args.profile_startup:
+        profile_startup_imports()
+        print("-" * 30)
 
     print(f"准备就绪。按住空格键开始录音。")
 
@@ -781,6 +2477,10 @@ if __name__ == "__main__":
         # --- Cleanup Actions ---
         print("DEBUG: 开始最终清理...")
         close_status_popup() # Close status popup if open
+        if turn_pipeline is not None:
+            turn_pipeline.cancel_all()
+        shutdown_tk_ui()
+        latency_log.print_summary()
 
         with recording_lock:
             if recording_start_timer is not None:
@@ -802,11 +2502,17 @@ if __name__ == "__main__":
         except Exception as e_unhook:
             print(f"移除监听出错: {e_unhook}", file=sys.stderr)
 
+        close_persistent_input_stream()
+
+        if asr_session is not None:
+            asr_session.close()
+
         final_check_stream = None
         with recording_lock:
             if is_recording and stream:
                 final_check_stream = stream
                 is_recording = False # Mark as stopped
+            _cancel_upload_session_locked()
 
         if final_check_stream:
             print("警告: 退出时录音流仍在运行。强制停止...", file=sys.stderr)
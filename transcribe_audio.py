@@ -1,31 +1,149 @@
 import os
 import traceback
 import sys
+import time
+import queue
+import threading
+import itertools
+import multiprocessing
+import hashlib
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
 from flask import Flask, request, jsonify # Flask core components
+from dotenv import load_dotenv
+import numpy as np
+import soundfile as sf
+import soxr
 import torch # Check CUDA availability
 
 # --- FunASR Imports ---
 from funasr import AutoModel
 from funasr.utils.postprocess_utils import rich_transcription_postprocess
+from funasr.utils.load_utils import load_audio_text_image_video
+
+# --- Load Environment Variables ---
+load_dotenv() # Server settings share the project's .env file with main.py
 
 # --- Configuration ---
 MODEL_IDENTIFIER = "models/SenseVoiceSmall" # Or your model path/name
-VAD_MODEL = "fsmn-vad"
+# A local copy of fsmn-vad is preferred over the hub identifier, which has to be resolved at every start.
+VAD_MODEL_DIRS = (
+    "models/fsmn-vad",
+    os.path.expanduser("~/.cache/modelscope/hub/iic/speech_fsmn_vad_zh-cn-16k-common-pytorch"),
+    os.path.expanduser("~/.cache/modelscope/hub/models/iic/speech_fsmn_vad_zh-cn-16k-common-pytorch"),
+)
+
+def _resolve_vad_model():
+    """ASR_VAD_MODEL if set, else the first local fsmn-vad copy found, else the hub identifier."""
+    configured = os.getenv("ASR_VAD_MODEL", "").strip()
+    if configured:
+        return configured
+    for path in VAD_MODEL_DIRS:
+        if os.path.isfile(os.path.join(path, "config.yaml")):
+            return path
+    return "fsmn-vad"
+
+VAD_MODEL = _resolve_vad_model()
 VAD_KWARGS = {"max_single_segment_time": 30000}
 DEVICE = "cuda:0" if torch.cuda.is_available() else "cpu"
 
+# --- Streaming Upload Settings ---
+STREAM_READ_CHUNK_BYTES = 32 * 1024 # How much of the request body to read per iteration
+STREAM_DEFAULT_SAMPLERATE = 16000
+STREAM_SAMPLE_FORMATS = {"float32": np.float32, "int16": np.int16}
+MODEL_SAMPLERATE = 16000 # frontend_conf.fs in models/SenseVoiceSmall/config.yaml
+INCREMENTAL_VAD = True # Run fsmn-vad on streamed audio as it arrives and transcribe closed segments early
+STREAM_VAD_CHUNK_MS = 200 # Audio fed to the streaming VAD per step
+
+# --- Micro-Batching Settings ---
+# Concurrent requests arriving within BATCH_MAX_WAIT_MS of each other are recognized together.
+def _env_number(name, default, cast=int):
+    try:
+        return cast(os.getenv(name, default))
+    except (ValueError, TypeError):
+        print(f"WARNING: Invalid {name} in environment, using default {default}", file=sys.stderr)
+        return default
+
+BATCH_MAX_SIZE = _env_number("ASR_BATCH_MAX_SIZE", 8) # Max requests per batch
+BATCH_MAX_WAIT_MS = _env_number("ASR_BATCH_MAX_WAIT_MS", 20, float) # How long the first request waits for company
+BATCH_MAX_AUDIO_S = 60 # Max seconds of audio per model forward pass (same budget as batch_size_s)
+
+# --- CPU Replica Settings ---
+# With ASR_REPLICAS > 0 (CPU only) the model runs in that many worker processes,
+# each pinned to its own share of the cores, instead of in this process.
+ASR_REPLICAS = max(0, _env_number("ASR_REPLICAS", 0))
+ASR_THREADS_PER_REPLICA = _env_number("ASR_THREADS_PER_REPLICA", 0) # 0 = cores / replicas
+REPLICA_START_TIMEOUT_S = 600
+
+# --- Transcription Cache Settings ---
+# Identical audio (replays, client retries, test harnesses) is answered from a
+# cache keyed by a hash of the decoded 16 kHz PCM plus the model and decoding parameters.
+ASR_CACHE = os.getenv("ASR_CACHE", "True").lower() == "true"
+ASR_CACHE_MAX_ENTRIES = _env_number("ASR_CACHE_MAX_ENTRIES", 512) # In-memory LRU tier
+ASR_CACHE_DIR = os.getenv("ASR_CACHE_DIR", "") # Optional on-disk tier; empty = memory only
+ASR_CACHE_DISK_MAX_MB = _env_number("ASR_CACHE_DISK_MAX_MB", 256, float)
+
+# --- Inference Backend Settings ---
+# torch:      the PyTorch checkpoint (model.pt) through AutoModel.
+# torch_int8: the same model with its Linear layers dynamically quantized to int8 (CPU only).
+# onnx:       the encoder exported to ONNX and run with onnxruntime via funasr_onnx (CPU only);
+#             the export is created next to model.pt on first use.
+ASR_BACKENDS = ("torch", "torch_int8", "onnx")
+ASR_BACKEND = os.getenv("ASR_BACKEND", "torch").lower()
+if ASR_BACKEND not in ASR_BACKENDS:
+    print(f"WARNING: Unknown ASR_BACKEND '{ASR_BACKEND}', expected one of {ASR_BACKENDS}. Using 'torch'.", file=sys.stderr)
+    ASR_BACKEND = "torch"
+ONNX_QUANTIZE = os.getenv("ASR_ONNX_QUANTIZE", "True").lower() == "true" # Use the int8 model_quant.onnx export
+
+# --- Startup Settings ---
+# Servers are restarted often, so startup avoids network lookups, maps the
+# checkpoint instead of reading it, and runs one warm-up pass before /ready
+# reports ready, so the first real request does not pay for lazy initialization.
+ASR_MMAP_WEIGHTS = os.getenv("ASR_MMAP_WEIGHTS", "True").lower() == "true"
+ASR_WARMUP_CLIP = os.getenv("ASR_WARMUP_CLIP", os.path.join(MODEL_IDENTIFIER, "example", "ko.mp3")).strip() # Empty: no warm-up
+AUTOMODEL_KWARGS = {"disable_update": True} # Skip FunASR's online version check
+
 # --- FunASR Model Loading Function ---
-def load_funasr_sensevoice_model():
-    """Loads the FunASR SenseVoiceSmall model. Called once on app startup."""
-    print(f"INFO: Loading FunASR AutoModel: {MODEL_IDENTIFIER}")
-    print(f"INFO: Using device: {DEVICE}")
+def load_funasr_sensevoice_model(backend=None):
+    """
+    Loads the FunASR SenseVoiceSmall model. Called once on app startup.
+
+    Args:
+        backend (str, optional): One of ASR_BACKENDS; defaults to ASR_BACKEND.
+    """
+    backend = backend or ASR_BACKEND
+    if backend != "torch" and DEVICE != "cpu":
+        print(f"WARNING: ASR_BACKEND '{backend}' is for CPU inference, using 'torch' on {DEVICE}.", file=sys.stderr)
+        backend = "torch"
+    print(f"INFO: Loading FunASR AutoModel: {MODEL_IDENTIFIER} (backend: {backend})")
+    print(f"INFO: Using device: {DEVICE}, VAD model: {VAD_MODEL}")
+    if VAD_MODEL == "fsmn-vad":
+        print(f"WARNING: VAD model is resolved through the model hub; copy it to {VAD_MODEL_DIRS[0]} or set ASR_VAD_MODEL.", file=sys.stderr)
     try:
-        model = AutoModel(
-            model=MODEL_IDENTIFIER,
-            vad_model=VAD_MODEL,
-            vad_kwargs=VAD_KWARGS,
-            device=DEVICE,
-        )
+        if backend == "onnx":
+            model = OnnxSenseVoiceModel(MODEL_IDENTIFIER, quantize=ONNX_QUANTIZE)
+        else:
+            model = None
+            checkpoint = os.path.join(MODEL_IDENTIFIER, "model.pt")
+            if ASR_MMAP_WEIGHTS and os.path.isfile(checkpoint):
+                # Build the network without weights, then map the checkpoint in.
+                model = AutoModel(model=MODEL_IDENTIFIER, init_param=None, vad_model=VAD_MODEL, vad_kwargs=VAD_KWARGS, device=DEVICE, **AUTOMODEL_KWARGS)
+                try:
+                    _load_weights_mmap(model.model, checkpoint)
+                except Exception as e:
+                    print(f"WARNING: Memory-mapped weight loading failed ({e}), loading normally.", file=sys.stderr)
+                    model = None
+            if model is None:
+                model = AutoModel(
+                    model=MODEL_IDENTIFIER,
+                    vad_model=VAD_MODEL,
+                    vad_kwargs=VAD_KWARGS,
+                    device=DEVICE,
+                    **AUTOMODEL_KWARGS,
+                )
+            if backend == "torch_int8":
+                model.model = torch.quantization.quantize_dynamic(model.model, {torch.nn.Linear}, dtype=torch.qint8)
+                print("INFO: Linear layers dynamically quantized to int8.")
         print(f"INFO: FunASR model '{MODEL_IDENTIFIER}' loaded successfully.")
         return model
     except Exception as e:
@@ -33,15 +151,674 @@ def load_funasr_sensevoice_model():
         traceback.print_exc()
         return None
 
-# --- FunASR Transcription Function ---
-def transcribe_with_funasr(model, audio_path):
+def _load_weights_mmap(network, checkpoint):
     """
-    Performs speech recognition using the loaded FunASR model.
+    Loads `checkpoint` into `network` with torch.load(mmap=True).
+
+    On CPU the parameters are assigned as views of the mapped file, so pages
+    are read on first use and shared between processes (replicas) through the
+    page cache, and the checkpoint is never copied. Raises if the checkpoint
+    does not cover every parameter, so the caller can fall back to FunASR's loader.
+    """
+    started = time.perf_counter()
+    state = torch.load(checkpoint, map_location="cpu", mmap=True, weights_only=False)
+    for wrapper in ("state_dict", "model_state_dict", "model"):
+        if isinstance(state, dict) and isinstance(state.get(wrapper), dict):
+            state = state[wrapper]
+    state = {key[len("module."):] if key.startswith("module.") else key: value for key, value in state.items()}
+    missing = [key for key in network.state_dict() if key not in state]
+    if missing:
+        raise KeyError(f"{len(missing)} parameter(s) missing from {checkpoint}, e.g. {missing[0]}")
+    on_cpu = all(p.device.type == "cpu" for p in network.parameters())
+    network.load_state_dict({key: state[key] for key in network.state_dict()}, strict=True, assign=on_cpu)
+    network.eval()
+    print(f"INFO: Mapped weights from {checkpoint} in {(time.perf_counter() - started) * 1000:.0f} ms.")
+
+class OnnxSenseVoiceModel:
+    """
+    Runs SenseVoiceSmall through onnxruntime behind the subset of the AutoModel interface used here.
+
+    run_transcription_batch() and StreamingTranscriptionSession call
+    inference() either with model=vad_model (segmentation, still done by the
+    PyTorch fsmn-vad, which is tiny) or without a model (recognition, done by
+    the ONNX export). Recognition results are returned as [{'text': ...}],
+    like AutoModel does.
+    """
+
+    def __init__(self, model_dir, quantize=True):
+        from funasr_onnx import SenseVoiceSmall as OnnxSenseVoiceSmall # Optional: pip install funasr-onnx
+        self.onnx_model = OnnxSenseVoiceSmall(model_dir, batch_size=1, quantize=quantize)
+        self.vad = AutoModel(model=VAD_MODEL, device="cpu", **VAD_KWARGS, **AUTOMODEL_KWARGS)
+        self.vad_model = self.vad.model
+        self.vad_kwargs = self.vad.kwargs
+        self.kwargs = {}
+        print(f"INFO: ONNX encoder loaded from '{model_dir}' ({'int8' if quantize else 'fp32'}).")
+
+    def inference(self, inputs, model=None, kwargs=None, **cfg):
+        if model is not None and model is self.vad_model:
+            return self.vad.inference(inputs, model=model, kwargs=kwargs, **cfg)
+        language = cfg.get("language", "auto")
+        textnorm = "withitn" if cfg.get("use_itn", True) else "woitn"
+        results = []
+        for waveform in (inputs if isinstance(inputs, list) else [inputs]):
+            # funasr_onnx only accepts paths or NumPy arrays; load_audio_text_image_video() returns tensors.
+            if isinstance(waveform, torch.Tensor):
+                waveform = waveform.cpu().numpy().astype(np.float32)
+            elif not isinstance(waveform, str):
+                waveform = np.asarray(waveform, dtype=np.float32)
+            texts = self.onnx_model(waveform, language=language, textnorm=textnorm)
+            results.append({"text": texts[0] if texts else ""})
+        return results
+
+# --- Batched Inference ---
+def _add_span(spans, name, started):
+    """Adds the milliseconds since `started` to spans[name] (spans may be None)."""
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + (time.perf_counter() - started) * 1000.0
+
+def run_transcription_batch(model, audio_inputs, samplerate, use_vad, spans=None):
+    """
+    Recognizes several inputs with as few model forward passes as possible.
+
+    Inputs that need segmentation are first split by the VAD model; the
+    resulting segments from *all* inputs are then sorted by length and fed to
+    SenseVoiceSmall in batches of up to BATCH_MAX_AUDIO_S seconds.
 
     Args:
         model: The loaded FunASR AutoModel object.
+        audio_inputs (list): Server-side file paths and/or 1-D float32 NumPy arrays.
+        samplerate (int): Sample rate of the array inputs (ignored for file paths).
+        use_vad (bool): Split inputs with the VAD model first. Pass False for
+                        inputs that are already single speech segments.
+        spans (dict, optional): Receives decode_ms, vad_ms and generate_ms for the whole batch.
+
+    Returns:
+        list[str]: Raw (not post-processed) text per input, in input order.
+    """
+    started = time.perf_counter()
+    waveforms = [load_audio_text_image_video(audio, fs=MODEL_SAMPLERATE, audio_fs=samplerate) for audio in audio_inputs]
+    _add_span(spans, "decode_ms", started)
+    segments, owners = [], []
+    if use_vad and getattr(model, "vad_model", None) is not None:
+        started = time.perf_counter()
+        vad_results = model.inference(waveforms, model=model.vad_model, kwargs=dict(model.vad_kwargs), disable_pbar=True)
+        _add_span(spans, "vad_ms", started)
+        for owner, (waveform, vad_result) in enumerate(zip(waveforms, vad_results)):
+            for start_ms, end_ms in vad_result.get("value", []):
+                segments.append(waveform[start_ms * MODEL_SAMPLERATE // 1000:end_ms * MODEL_SAMPLERATE // 1000])
+                owners.append(owner)
+    else:
+        segments, owners = waveforms, list(range(len(waveforms)))
+
+    segment_texts = [""] * len(segments)
+    order = sorted(range(len(segments)), key=lambda i: len(segments[i]))
+    batch, batch_samples = [], 0
+    for position, index in enumerate(order):
+        batch.append(index)
+        batch_samples += len(segments[index])
+        is_last = position == len(order) - 1
+        if is_last or batch_samples + len(segments[order[position + 1]]) > BATCH_MAX_AUDIO_S * MODEL_SAMPLERATE:
+            started = time.perf_counter()
+            results = model.inference(
+                [segments[i] for i in batch],
+                kwargs=dict(model.kwargs),
+                batch_size=len(batch),
+                language="auto",
+                use_itn=True,
+                fs=MODEL_SAMPLERATE,
+                disable_pbar=True,
+            )
+            _add_span(spans, "generate_ms", started)
+            if len(results) != len(batch):
+                raise RuntimeError(f"Model returned {len(results)} results for a batch of {len(batch)} segments")
+            for i, result in zip(batch, results):
+                segment_texts[i] = result.get("text", "")
+            batch, batch_samples = [], 0
+
+    texts = [""] * len(audio_inputs)
+    for owner, text in zip(owners, segment_texts):
+        texts[owner] += text
+    return texts
+
+class BatchingScheduler:
+    """
+    Serializes access to the model and groups concurrent requests into batches.
+
+    HTTP handler threads call submit() and block on the returned Future. A
+    single worker thread takes the first queued request, keeps collecting for
+    up to BATCH_MAX_WAIT_MS (or until BATCH_MAX_SIZE requests are waiting) and
+    runs the whole group through run_transcription_batch().
+
+    Every returned Future carries a `spans` dict. By the time the Future
+    resolves, it holds queue_wait_ms and batch_size plus the batch's decode,
+    VAD and generate timings.
+    """
+
+    def __init__(self, model, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self.requests = queue.Queue()
+        self.stats_lock = threading.Lock()
+        self.batch_size_histogram = Counter()
+        self.max_queue_depth = 0
+        self.total_requests = 0
+        self.total_queue_wait_s = 0.0
+        self.thread = threading.Thread(target=self._run, name="asr-batcher", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, audio_input, samplerate=MODEL_SAMPLERATE, use_vad=True):
+        """Queues one input; the Future resolves to its raw text or raises the model's exception."""
+        future = Future()
+        future.spans = {}
+        self.requests.put((audio_input, samplerate, use_vad, future, time.perf_counter()))
+        with self.stats_lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.requests.qsize())
+        return future
+
+    def _collect_batch(self):
+        batch = [self.requests.get()]
+        deadline = time.perf_counter() + self.max_wait_s
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            started = time.perf_counter()
+            with self.stats_lock:
+                self.batch_size_histogram[len(batch)] += 1
+                self.total_requests += len(batch)
+                self.total_queue_wait_s += sum(started - item[4] for item in batch)
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[1], item[2]), []).append(item)
+            for (samplerate, use_vad), items in groups.items():
+                self._run_group(items, samplerate, use_vad)
+
+    def _run_group(self, items, samplerate, use_vad):
+        started = time.perf_counter()
+        try:
+            spans = {}
+            texts = run_transcription_batch(self.model, [item[0] for item in items], samplerate, use_vad, spans)
+            for item, text in zip(items, texts):
+                item[3].spans.update(spans, queue_wait_ms=(started - item[4]) * 1000.0, batch_size=len(items))
+                item[3].set_result(text)
+        except Exception as e:
+            if len(items) > 1:
+                # Isolate the failing input so the rest of the batch still gets an answer.
+                print(f"WARNING: Batch of {len(items)} failed ({e}), retrying requests individually.", file=sys.stderr)
+                for item in items:
+                    self._run_group([item], samplerate, use_vad)
+            else:
+                items[0][3].set_exception(e)
+
+    def stats(self):
+        with self.stats_lock:
+            batches = sum(self.batch_size_histogram.values())
+            return {
+                "queue_depth": self.requests.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "batches": batches,
+                "requests": self.total_requests,
+                "mean_batch_size": (self.total_requests / batches) if batches else 0.0,
+                "mean_queue_wait_ms": (1000.0 * self.total_queue_wait_s / self.total_requests) if self.total_requests else 0.0,
+                "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_size_histogram.items())},
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_s * 1000.0,
+            }
+
+# --- Multi-Process CPU Replicas ---
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def _pin_to_cores(cores):
+    """Restricts the current process to `cores` (Linux natively, elsewhere via psutil if installed)."""
+    try:
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cores)
+        else:
+            import psutil
+            psutil.Process().cpu_affinity(list(cores))
+        return True
+    except ImportError:
+        print("WARNING: psutil not installed, replica is not pinned to its cores.", file=sys.stderr)
+    except Exception as e:
+        print(f"WARNING: Failed to pin replica to cores {list(cores)}: {e}", file=sys.stderr)
+    return False
+
+def _replica_main(index, cores, threads, request_queue, result_queue):
+    """
+    Entry point of one model replica process.
+
+    Pins itself to `cores`, limits torch to `threads` intra-op threads, loads
+    its own model and serves requests from `request_queue` through a local
+    BatchingScheduler, so requests that land on the same replica together are
+    still batched.
+    """
+    _pin_to_cores(cores)
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass # Already fixed by an earlier parallel op
+    model = load_funasr_sensevoice_model()
+    if model is None:
+        result_queue.put(("ready", index, False))
+        return
+    warm_up_model(model)
+    scheduler = BatchingScheduler(model).start()
+    result_queue.put(("ready", index, True))
+    print(f"INFO: Replica {index} (pid {os.getpid()}) serving on cores {list(cores)} with {threads} thread(s).")
+
+    def reply(request_id, future):
+        try:
+            result_queue.put(("result", index, request_id, True, future.result(), future.spans))
+        except Exception as e:
+            # Exceptions are not always picklable; send the message instead.
+            result_queue.put(("result", index, request_id, False, f"{type(e).__name__}: {e}", {}))
+
+    while True:
+        item = request_queue.get()
+        if item is None:
+            break
+        request_id, audio_input, samplerate, use_vad = item
+        future = scheduler.submit(audio_input, samplerate, use_vad)
+        future.add_done_callback(lambda f, request_id=request_id: reply(request_id, f))
+
+class ReplicaPool:
+    """
+    Runs N model replicas in separate processes and routes requests to the least-loaded one.
+
+    Has the same submit()/stats() interface as BatchingScheduler, so the
+    transcription functions and endpoints use it unchanged. The available cores
+    are split into N disjoint sets and each replica gets
+    torch.set_num_threads(len(its cores)). Replicas then do not compete for the
+    same cores through oversubscribed intra-op thread pools, and throughput
+    scales with the number of replicas.
+
+    A replica process that dies is taken out of rotation and the requests it
+    still had are failed, so callers never wait on it forever.
+    """
+    HEALTH_CHECK_S = 1.0 # How often the result collector checks that the replicas are alive
+
+    def __init__(self, replicas, threads_per_replica=0):
+        cores = _available_cores()
+        self.replicas = max(1, min(replicas, len(cores)))
+        share = len(cores) // self.replicas
+        self.core_sets = [cores[i * share:(i + 1) * share] for i in range(self.replicas)]
+        self.threads = threads_per_replica if threads_per_replica > 0 else max(1, share)
+        self.context = multiprocessing.get_context("spawn") # fork would copy torch's thread pools
+        self.result_queue = self.context.Queue()
+        self.request_queues = []
+        self.processes = []
+        self.ready = [False] * self.replicas
+        self.outstanding = [0] * self.replicas
+        self.completed = [0] * self.replicas
+        self.busy_s = [0.0] * self.replicas
+        self.pending = {} # request_id -> (future, replica index, submit time)
+        self.ids = itertools.count()
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Spawns the replicas and waits until they have loaded the model. Returns None if none did."""
+        for index in range(self.replicas):
+            request_queue = self.context.Queue()
+            process = self.context.Process(
+                target=_replica_main,
+                args=(index, self.core_sets[index], self.threads, request_queue, self.result_queue),
+                name=f"asr-replica-{index}",
+                daemon=True,
+            )
+            process.start()
+            self.request_queues.append(request_queue)
+            self.processes.append(process)
+        print(f"INFO: Started {self.replicas} model replica(s), {self.threads} thread(s) each, waiting for them to load...")
+
+        deadline = time.perf_counter() + REPLICA_START_TIMEOUT_S
+        reported = 0
+        while reported < self.replicas and time.perf_counter() < deadline:
+            try:
+                _, index, ok = self.result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    break # Every replica died before reporting
+                continue
+            self.ready[index] = ok
+            reported += 1
+        if not any(self.ready):
+            print("CRITICAL ERROR: No model replica could be started.", file=sys.stderr)
+            self.close()
+            return None
+        if not all(self.ready):
+            print(f"WARNING: Only {sum(self.ready)} of {self.replicas} replicas are serving.", file=sys.stderr)
+        threading.Thread(target=self._collect_results, name="asr-replica-results", daemon=True).start()
+        return self
+
+    def submit(self, audio_input, samplerate=MODEL_SAMPLERATE, use_vad=True):
+        """Queues one input on the least-loaded replica; the Future resolves to its raw text."""
+        future = Future()
+        future.spans = {}
+        with self.lock:
+            serving = [i for i in range(self.replicas) if self.ready[i]]
+            if not serving:
+                future.set_exception(RuntimeError("No model replicas available"))
+                return future
+            index = min(serving, key=lambda i: self.outstanding[i])
+            request_id = next(self.ids)
+            self.outstanding[index] += 1
+            self.pending[request_id] = (future, index, time.perf_counter())
+        self.request_queues[index].put((request_id, audio_input, samplerate, use_vad))
+        return future
+
+    def _collect_results(self):
+        while True:
+            try:
+                message = self.result_queue.get(timeout=self.HEALTH_CHECK_S)
+            except queue.Empty:
+                self._check_replicas()
+                continue
+            except (EOFError, OSError):
+                break
+            if message[0] == "ready":
+                # A slow replica that finished loading after start() gave up waiting.
+                with self.lock:
+                    self.ready[message[1]] = message[2]
+                continue
+            _, index, request_id, ok, payload, spans = message
+            with self.lock:
+                if request_id not in self.pending:
+                    continue # Already failed because the replica was found dead
+                future, _, submitted = self.pending.pop(request_id)
+                self.outstanding[index] -= 1
+                self.completed[index] += 1
+                self.busy_s[index] += time.perf_counter() - submitted
+            future.spans.update(spans, replica=index, replica_roundtrip_ms=(time.perf_counter() - submitted) * 1000.0)
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"Replica {index} failed: {payload}"))
+            self._check_replicas()
+
+    def _check_replicas(self):
+        """Takes dead replicas out of rotation and fails the requests they still owed."""
+        failed, died = [], False
+        with self.lock:
+            for index, process in enumerate(self.processes):
+                if not self.ready[index] or process.is_alive():
+                    continue
+                self.ready[index], died = False, True
+                print(f"ERROR: Model replica {index} (pid {process.pid}) exited with code {process.exitcode}.", file=sys.stderr)
+                for request_id, (future, owner, _) in list(self.pending.items()):
+                    if owner == index:
+                        del self.pending[request_id]
+                        failed.append((future, index))
+                self.outstanding[index] = 0
+            if died and not any(self.ready):
+                print("CRITICAL ERROR: No model replica is serving any more.", file=sys.stderr)
+        for future, index in failed:
+            future.set_exception(RuntimeError(f"Replica {index} died before answering"))
+
+    def stats(self):
+        with self.lock:
+            replicas = [
+                {
+                    "pid": process.pid,
+                    "ready": self.ready[index],
+                    "alive": process.is_alive(),
+                    "cores": self.core_sets[index],
+                    "threads": self.threads,
+                    "outstanding": self.outstanding[index],
+                    "completed": self.completed[index],
+                    "mean_latency_ms": (1000.0 * self.busy_s[index] / self.completed[index]) if self.completed[index] else 0.0,
+                }
+                for index, process in enumerate(self.processes)
+            ]
+        return {"mode": "replicas", "queue_depth": sum(r["outstanding"] for r in replicas), "replicas": replicas}
+
+    def close(self):
+        for request_queue in self.request_queues:
+            request_queue.put(None)
+        for process in self.processes:
+            process.join(timeout=5)
+
+class VadFrontend:
+    """
+    VAD-only stand-in for the AutoModel in the dispatching process of replica mode.
+
+    StreamingTranscriptionSession only needs inference(), vad_model and
+    vad_kwargs from the model; recognition itself goes to the ReplicaPool. With
+    vad_automodel=None streamed audio is transcribed in one pass at the end.
+    """
+
+    def __init__(self, vad_automodel):
+        self.vad_model = vad_automodel.model if vad_automodel is not None else None
+        self.vad_kwargs = vad_automodel.kwargs if vad_automodel is not None else {}
+        self.inference = vad_automodel.inference if vad_automodel is not None else None
+
+def load_vad_frontend():
+    """Loads just the VAD model for streaming segmentation in the dispatching process."""
+    try:
+        vad = AutoModel(model=VAD_MODEL, device=DEVICE, **VAD_KWARGS, **AUTOMODEL_KWARGS)
+        print(f"INFO: VAD model '{VAD_MODEL}' loaded for streaming segmentation.")
+        return VadFrontend(vad)
+    except Exception as e:
+        print(f"WARNING: Failed to load VAD model '{VAD_MODEL}', streamed audio will not be segmented: {e}", file=sys.stderr)
+        return VadFrontend(None)
+
+# --- Transcription Result Cache ---
+class TranscriptionCache:
+    """
+    Content-addressed store of raw transcripts with an LRU memory tier and an optional disk tier.
+
+    The disk tier keeps one small text file per key under `disk_dir`. A hit
+    refreshes the file's mtime, and the least recently used files are deleted
+    once the tier grows past `disk_max_bytes`.
+    """
+
+    def __init__(self, max_entries=ASR_CACHE_MAX_ENTRIES, disk_dir=ASR_CACHE_DIR, disk_max_bytes=ASR_CACHE_DISK_MAX_MB * 1024 * 1024):
+        self.max_entries = max(1, max_entries)
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = disk_max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.disk_bytes = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self.disk_bytes = sum(entry.stat().st_size for entry in os.scandir(self.disk_dir) if entry.is_file())
+
+    @staticmethod
+    def make_key(waveform, params):
+        """blake2b over the decoding parameters and the float32 PCM at MODEL_SAMPLERATE."""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(repr(params).encode("utf-8"))
+        digest.update(np.ascontiguousarray(waveform, dtype=np.float32).tobytes())
+        return digest.hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.txt")
+
+    def get(self, key):
+        """Returns the cached raw transcript or None."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                return self.entries[key]
+        if self.disk_dir:
+            path = self._disk_path(key)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+                os.utime(path) # Mark as recently used for eviction
+            except OSError:
+                pass
+            else:
+                self._remember(key, text)
+                with self.lock:
+                    self.counters["disk_hits"] += 1
+                return text
+        with self.lock:
+            self.counters["misses"] += 1
+        return None
+
+    def put(self, key, text):
+        """Stores a raw transcript; empty results are not cached, so a transient failure is retried next time."""
+        if not text:
+            return
+        self._remember(key, text)
+        with self.lock:
+            self.counters["stores"] += 1
+        if self.disk_dir:
+            try:
+                path = self._disk_path(key)
+                try:
+                    replaced_bytes = os.path.getsize(path)
+                except OSError:
+                    replaced_bytes = 0
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                with self.lock:
+                    self.disk_bytes += os.path.getsize(path) - replaced_bytes
+                self._evict_disk()
+            except OSError as e:
+                print(f"WARNING: Failed to write transcription cache entry: {e}", file=sys.stderr)
+
+    def _remember(self, key, text):
+        with self.lock:
+            self.entries[key] = text
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.counters["memory_evictions"] += 1
+
+    def _evict_disk(self):
+        with self.lock:
+            if self.disk_bytes <= self.disk_max_bytes:
+                return
+        files = sorted((entry for entry in os.scandir(self.disk_dir) if entry.is_file()), key=lambda entry: entry.stat().st_mtime)
+        for entry in files:
+            with self.lock:
+                if self.disk_bytes <= self.disk_max_bytes:
+                    break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            with self.lock:
+                self.disk_bytes -= size
+                self.counters["disk_evictions"] += 1
+
+    def stats(self):
+        with self.lock:
+            lookups = self.counters["memory_hits"] + self.counters["disk_hits"] + self.counters["misses"]
+            return {
+                "memory_entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "disk_dir": self.disk_dir,
+                "disk_bytes": self.disk_bytes,
+                "hit_rate": ((lookups - self.counters["misses"]) / lookups) if lookups else 0.0,
+                **{name: self.counters[name] for name in ("memory_hits", "disk_hits", "misses", "stores", "memory_evictions", "disk_evictions")},
+            }
+
+class CachingScheduler:
+    """
+    Answers submit() from a TranscriptionCache before handing the input to the wrapped scheduler.
+
+    File inputs are decoded here, on the request thread, so that the key
+    covers the audio content and not the path. A hit returns an already
+    completed Future; a successful miss is stored once its Future resolves.
+    """
+
+    def __init__(self, scheduler, cache):
+        self.scheduler = scheduler
+        self.cache = cache
+        self.params = (MODEL_IDENTIFIER, ASR_BACKEND, "auto", True) # model, backend, language, use_itn
+
+    def submit(self, audio_input, samplerate=MODEL_SAMPLERATE, use_vad=True):
+        started = time.perf_counter()
+        waveform = load_audio_text_image_video(audio_input, fs=MODEL_SAMPLERATE, audio_fs=samplerate)
+        waveform = waveform.numpy() if isinstance(waveform, torch.Tensor) else np.asarray(waveform, dtype=np.float32)
+        key = TranscriptionCache.make_key(waveform, self.params + (use_vad,))
+        cached = self.cache.get(key)
+        lookup_ms = (time.perf_counter() - started) * 1000.0
+        if cached is not None:
+            future = Future()
+            future.spans = {"cache_hit": True, "cache_lookup_ms": lookup_ms}
+            future.set_result(cached)
+            return future
+        future = self.scheduler.submit(waveform, MODEL_SAMPLERATE, use_vad)
+        future.spans.update(cache_hit=False, cache_lookup_ms=lookup_ms)
+        future.add_done_callback(lambda f: self.cache.put(key, f.result()) if f.exception() is None else None)
+        return future
+
+    def stats(self):
+        return self.scheduler.stats()
+
+# --- FunASR Transcription Functions ---
+def _generate_transcription(scheduler, audio_input, source_desc, samplerate=MODEL_SAMPLERATE, spans=None):
+    """
+    Recognizes a file path or an in-memory waveform via the scheduler and post-processes the text.
+
+    Args:
+        scheduler (BatchingScheduler | ReplicaPool): Scheduler that owns the loaded model.
+        audio_input: A server-side file path or a 1-D float32 NumPy array.
+        source_desc (str): Short description of the input, used in log messages.
+        samplerate (int): Sample rate of an array input.
+        spans (dict, optional): Receives the scheduler's timings plus postprocess_ms.
+
+    Returns:
+        str: The recognized text (potentially post-processed).
+        None: If transcription fails.
+    """
+    try:
+        future = scheduler.submit(audio_input, samplerate)
+        raw_text = future.result()
+        if spans is not None:
+            spans.update(future.spans)
+        if not raw_text:
+             print(f"WARNING: FunASR returned result but 'text' field is empty.", file=sys.stderr)
+             return None # Treat empty text as potential issue in this context
+
+        print(f"INFO: Raw transcription: '{raw_text}'")
+        started = time.perf_counter()
+        processed_text = rich_transcription_postprocess(raw_text)
+        _add_span(spans, "postprocess_ms", started)
+        print(f"INFO: Post-processed transcription: '{processed_text}'")
+        return processed_text
+
+    except Exception as e:
+        print(f"ERROR: Exception during FunASR transcription ({source_desc}): {e}", file=sys.stderr)
+        traceback.print_exc()
+        return None
+
+def transcribe_with_funasr(scheduler, audio_path, client_samplerate=None, spans=None):
+    """
+    Performs speech recognition using the loaded FunASR model.
+
+    Args:
+        scheduler (BatchingScheduler | ReplicaPool): Scheduler that owns the loaded model.
         audio_path (str): The absolute path to the audio file on the server
                           (constructed relative to CWD in this version).
+        client_samplerate (int, optional): Sample rate the client says the file was
+                          written at. When it equals MODEL_SAMPLERATE the WAV is decoded
+                          directly with soundfile and handed over as a waveform, which
+                          skips FunASR's generic loader and resampling step.
+        spans (dict, optional): Receives per-stage timings in milliseconds.
 
     Returns:
         str: The recognized text (potentially post-processed).
@@ -57,97 +834,370 @@ def transcribe_with_funasr(model, audio_path):
              print(f"ERROR: Path passed to transcription is not a file: {audio_path}", file=sys.stderr)
              return None
 
-        res = model.generate(
-            input=audio_path, # Use the server-side audio file path
-            cache={},
-            language="auto",
-            use_itn=True,
-            batch_size_s=60,
-            merge_vad=True,
-            merge_length_s=15,
-        )
+        if client_samplerate == MODEL_SAMPLERATE:
+            started = time.perf_counter()
+            samples, file_samplerate = sf.read(audio_path, dtype='float32', always_2d=True)
+            _add_span(spans, "read_wav_ms", started)
+            if file_samplerate == MODEL_SAMPLERATE:
+                return _generate_transcription(scheduler, samples.mean(axis=1), os.path.basename(audio_path), spans=spans)
+            print(f"WARNING: File tagged as {client_samplerate} Hz is actually {file_samplerate} Hz, resampling.", file=sys.stderr)
 
-        if not res or not isinstance(res, list) or len(res) == 0 or "text" not in res[0]:
-             print(f"ERROR: Unexpected or empty result format from model.generate: {res}", file=sys.stderr)
-             return None
-
-        raw_text = res[0].get("text", "")
-        if not raw_text:
-             print(f"WARNING: FunASR returned result but 'text' field is empty.", file=sys.stderr)
-             return None # Treat empty text as potential issue in this context
-
-        print(f"INFO: Raw transcription: '{raw_text}'")
-        processed_text = rich_transcription_postprocess(raw_text)
-        print(f"INFO: Post-processed transcription: '{processed_text}'")
-        return processed_text
+        return _generate_transcription(scheduler, audio_path, os.path.basename(audio_path), spans=spans)
 
     except Exception as e:
         print(f"ERROR: Exception during FunASR transcription ({os.path.basename(audio_path)}): {e}", file=sys.stderr)
         traceback.print_exc()
         return None
 
-# --- Flask Application Initialization ---
-app = Flask(__name__)
+def transcribe_pcm_with_funasr(scheduler, samples, samplerate, spans=None):
+    """
+    Performs speech recognition on an in-memory mono waveform.
 
-# --- Load FunASR Model (once on startup) ---
-print("INFO: Flask application starting, loading FunASR model...")
-FUNASR_MODEL = load_funasr_sensevoice_model()
+    Args:
+        scheduler (BatchingScheduler | ReplicaPool): Scheduler that owns the loaded model.
+        samples (np.ndarray): 1-D float32 waveform in the range [-1, 1].
+        samplerate (int): Sample rate of `samples`; it is resampled if it differs from the model's.
 
-if FUNASR_MODEL is None:
-    print("CRITICAL WARNING: Model loading failed, API will not be able to process requests.", file=sys.stderr)
+    Returns:
+        str: The recognized text (potentially post-processed).
+        None: If transcription fails.
+    """
+    duration_s = len(samples) / float(samplerate)
+    print(f"INFO: Transcribing {duration_s:.2f}s of streamed audio ({samplerate} Hz) with FunASR ...")
+    return _generate_transcription(scheduler, samples, "streamed audio", samplerate, spans)
 
+# --- Streamed PCM Decoding ---
+class PcmStreamDecoder:
+    """
+    Turns arbitrary byte chunks of raw interleaved PCM into float32 mono blocks.
 
-# --- API Endpoint Definition ---
-# WARNING: This endpoint relies on paths relative to the server's CWD, which is insecure.
-@app.route('/transcribe', methods=['POST'])
-def handle_transcription_by_relative_path_request():
+    Chunk boundaries need not align with frames; a partial frame is kept until
+    the rest of it arrives.
+
+    Args:
+        sample_format (str): Key of STREAM_SAMPLE_FORMATS ('float32' or 'int16').
+        channels (int): Number of interleaved channels; they are averaged down to mono.
     """
-    Handles POST requests containing a JSON payload with an 'audio_path' key.
-    The 'audio_path' value should be a relative path. The API will attempt
-    to resolve this path relative to its Current Working Directory (CWD).
 
-    *** WARNING: THIS IS AN INSECURE AND UNRELIABLE APPROACH. ***
-    Use the version with ALLOWED_AUDIO_BASE_DIR for production.
+    def __init__(self, sample_format, channels):
+        self.dtype = np.dtype(STREAM_SAMPLE_FORMATS[sample_format])
+        self.channels = channels
+        self.frame_bytes = self.dtype.itemsize * channels
+        self.pending = b""
+
+    def decode(self, data):
+        """Returns the whole frames completed by `data` as a 1-D float32 block, or None."""
+        self.pending += data
+        usable = len(self.pending) - (len(self.pending) % self.frame_bytes)
+        if usable == 0:
+            return None
+        block = np.frombuffer(self.pending[:usable], dtype=self.dtype)
+        self.pending = self.pending[usable:]
+        if self.dtype == np.int16:
+            block = block.astype(np.float32) / 32768.0
+        if self.channels > 1:
+            block = block.reshape(-1, self.channels).mean(axis=1)
+        return block.astype(np.float32, copy=False)
+
+    def close(self):
+        if self.pending:
+            print(f"WARNING: Discarding {len(self.pending)} trailing bytes that do not form a whole frame.", file=sys.stderr)
+        self.pending = b""
+
+def iter_pcm_stream(stream, sample_format, channels, chunk_bytes=STREAM_READ_CHUNK_BYTES):
     """
-    # 1. Check if model is loaded
-    if FUNASR_MODEL is None:
-         print("ERROR: Transcription request received, but model is not loaded.", file=sys.stderr)
-         return jsonify({"error": "Server model error, transcription service unavailable"}), 200
+    Reads raw interleaved PCM from a (possibly chunked) request body as it arrives.
 
-    # 2. Check if request body is JSON
-    if not request.is_json:
-        print("ERROR: Request content type is not application/json.", file=sys.stderr)
-        return jsonify({"error": "Request body must be JSON"}), 200
+    Args:
+        stream: File-like object (e.g. Flask's request.stream).
+        sample_format (str): Key of STREAM_SAMPLE_FORMATS ('float32' or 'int16').
+        channels (int): Number of interleaved channels; they are averaged down to mono.
+        chunk_bytes (int): Maximum number of bytes to read per iteration.
 
-    # 3. Get JSON data
-    data = request.get_json()
-    if not data:
-        print("ERROR: Received empty JSON payload.", file=sys.stderr)
-        return jsonify({"error": "Empty JSON payload received"}), 200
+    Yields:
+        np.ndarray: 1-D float32 mono blocks in the range [-1, 1].
+    """
+    decoder = PcmStreamDecoder(sample_format, channels)
+    while True:
+        data = stream.read(chunk_bytes)
+        if not data:
+            break
+        block = decoder.decode(data)
+        if block is not None:
+            yield block
+    decoder.close()
+
+def parse_stream_format(headers):
+    """
+    Reads the X-Sample-Rate / X-Channels / X-Sample-Format request headers.
+
+    Returns:
+        tuple: (samplerate, channels, sample_format, None) on success, or
+               (None, None, None, error_message) if the headers are invalid.
+    """
+    try:
+        samplerate = int(headers.get('X-Sample-Rate', STREAM_DEFAULT_SAMPLERATE))
+        channels = int(headers.get('X-Channels', 1))
+    except ValueError:
+        print("ERROR: Invalid X-Sample-Rate or X-Channels header.", file=sys.stderr)
+        return None, None, None, "X-Sample-Rate and X-Channels must be integers"
+    sample_format = headers.get('X-Sample-Format', 'float32').lower()
+    if samplerate <= 0 or channels <= 0:
+        print(f"ERROR: Invalid stream format: {samplerate} Hz, {channels} channel(s).", file=sys.stderr)
+        return None, None, None, "X-Sample-Rate and X-Channels must be positive"
+    if sample_format not in STREAM_SAMPLE_FORMATS:
+        print(f"ERROR: Unsupported X-Sample-Format: {sample_format}", file=sys.stderr)
+        return None, None, None, f"Unsupported X-Sample-Format, expected one of {list(STREAM_SAMPLE_FORMATS)}"
+    return samplerate, channels, sample_format, None
+
+# --- Incremental (Streaming) Transcription ---
+class StreamingTranscriptionSession:
+    """
+    Transcribes a streamed utterance segment by segment while it is still arriving.
+
+    Incoming audio is fed to the model's fsmn-vad in STREAM_VAD_CHUNK_MS steps
+    using FunASR's streaming VAD cache. Every time the VAD closes a speech
+    segment, that segment is transcribed immediately (without VAD), so when the
+    upload ends only the last segment still has to go through the model.
+
+    Segments are submitted to the BatchingScheduler without waiting, so reading
+    the request body continues while they are recognized (and they can share a
+    batch with other clients' requests).
+
+    If the model was loaded without a VAD model, the session simply buffers the
+    audio and transcribes it in one pass in finish().
+
+    Audio at another sample rate goes through one stateful soxr stream per
+    session, so block boundaries leave no discontinuities; finish() flushes it.
+    """
+
+    def __init__(self, model, scheduler, samplerate):
+        self.model = model
+        self.scheduler = scheduler
+        self.samplerate = samplerate
+        self.resampler = soxr.ResampleStream(samplerate, MODEL_SAMPLERATE, 1, dtype='float32') if samplerate != MODEL_SAMPLERATE else None
+        self.incremental = INCREMENTAL_VAD and getattr(model, "vad_model", None) is not None
+        self.chunk_samples = MODEL_SAMPLERATE * STREAM_VAD_CHUNK_MS // 1000
+        self.blocks = [] # All received audio at MODEL_SAMPLERATE
+        self.total_samples = 0
+        self.pending = np.zeros(0, dtype=np.float32) # Received audio not yet seen by the VAD
+        self.vad_cache = {}
+        self.open_segment_start_ms = None
+        self.segments = [] # [{'start_ms', 'end_ms', 'future'}] in order
+        self.spans = {} # Timings in ms: resample, vad, the segments' queue_wait/generate, tail, postprocess
+
+    def _audio(self):
+        if len(self.blocks) > 1:
+            self.blocks = [np.concatenate(self.blocks)]
+        return self.blocks[0] if self.blocks else np.zeros(0, dtype=np.float32)
+
+    def feed(self, samples, last=False):
+        """Adds a block of float32 mono samples at self.samplerate (last=True flushes the resampler)."""
+        if self.resampler is not None:
+            started = time.perf_counter()
+            samples = self.resampler.resample_chunk(np.ascontiguousarray(samples, dtype=np.float32), last=last)
+            _add_span(self.spans, "resample_ms", started)
+        if len(samples) == 0:
+            return
+        self.blocks.append(samples)
+        self.total_samples += len(samples)
+        if not self.incremental:
+            return
+        self.pending = np.concatenate([self.pending, samples])
+        # Keep at least one sample back so finish() always has a non-empty final chunk.
+        while len(self.pending) > self.chunk_samples:
+            chunk, self.pending = self.pending[:self.chunk_samples], self.pending[self.chunk_samples:]
+            self._run_vad(chunk, is_final=False)
+
+    def _run_vad(self, chunk, is_final):
+        started = time.perf_counter()
+        res = self.model.inference(
+            chunk,
+            model=self.model.vad_model,
+            kwargs=dict(self.model.vad_kwargs), # inference() updates kwargs in place; keep the model's copy clean
+            cache=self.vad_cache,
+            is_final=is_final,
+            chunk_size=STREAM_VAD_CHUNK_MS,
+            disable_pbar=True,
+        )
+        _add_span(self.spans, "vad_ms", started)
+        for start_ms, end_ms in (res[0].get("value", []) if res else []):
+            if start_ms >= 0 and end_ms >= 0:
+                self._transcribe_segment(start_ms, end_ms)
+            elif start_ms >= 0:
+                self.open_segment_start_ms = start_ms
+            elif end_ms >= 0 and self.open_segment_start_ms is not None:
+                self._transcribe_segment(self.open_segment_start_ms, end_ms)
+                self.open_segment_start_ms = None
+
+    def _transcribe_segment(self, start_ms, end_ms):
+        audio = self._audio()
+        segment = audio[start_ms * MODEL_SAMPLERATE // 1000:end_ms * MODEL_SAMPLERATE // 1000]
+        if len(segment) == 0:
+            return
+        future = self.scheduler.submit(segment, MODEL_SAMPLERATE, use_vad=False)
+        self.segments.append({"start_ms": start_ms, "end_ms": end_ms, "future": future})
+
+    def _collect_segment_texts(self):
+        for seg in self.segments:
+            if "raw_text" in seg:
+                continue
+            try:
+                seg["raw_text"] = seg["future"].result() or ""
+                for name in ("queue_wait_ms", "generate_ms"):
+                    self.spans[name] = self.spans.get(name, 0.0) + seg["future"].spans.get(name, 0.0)
+            except Exception as e:
+                print(f"ERROR: Exception transcribing segment {seg['start_ms']}-{seg['end_ms']}ms: {e}", file=sys.stderr)
+                seg["raw_text"] = ""
+            seg["text"] = rich_transcription_postprocess(seg["raw_text"]) if seg["raw_text"] else ""
+            print(f"INFO: Partial transcription [{seg['start_ms']}-{seg['end_ms']}ms]: '{seg['text']}'")
+
+    def finish(self):
+        """
+        Flushes the VAD, transcribes any segment still open and merges the results.
+
+        Returns:
+            str: The final post-processed transcript.
+            None: If no speech was recognized or transcription failed.
+        """
+        if self.resampler is not None:
+            self.feed(np.zeros(0, dtype=np.float32), last=True)
+        if self.total_samples == 0:
+            return None
+        if not self.incremental:
+            return transcribe_pcm_with_funasr(self.scheduler, self._audio(), MODEL_SAMPLERATE, self.spans)
+        started = time.perf_counter()
+        self._run_vad(self.pending, is_final=True)
+        self.pending = np.zeros(0, dtype=np.float32)
+        if self.open_segment_start_ms is not None:
+            self._transcribe_segment(self.open_segment_start_ms, self.total_samples * 1000 // MODEL_SAMPLERATE)
+            self.open_segment_start_ms = None
+        self._collect_segment_texts()
+        _add_span(self.spans, "tail_ms", started) # What is left to do once the upload has ended
+        raw_text = "".join(segment["raw_text"] for segment in self.segments)
+        if not raw_text:
+            print("WARNING: No speech recognized in streamed audio.", file=sys.stderr)
+            return None
+        started = time.perf_counter()
+        processed_text = rich_transcription_postprocess(raw_text)
+        _add_span(self.spans, "postprocess_ms", started)
+        print(f"INFO: Merged transcription of {len(self.segments)} segment(s): '{processed_text}'")
+        return processed_text
+
+    def partials(self):
+        """Per-segment hypotheses in the order they were produced (call after finish())."""
+        self._collect_segment_texts()
+        return [{"start_ms": seg["start_ms"], "end_ms": seg["end_ms"], "text": seg["text"]} for seg in self.segments]
+
+# --- Model Service Initialization ---
+# The model is loaded on first use rather than at import time, so every server
+# process (the Flask dev server, or each ASGI worker in transcribe_server_asgi.py)
+# loads exactly one copy of its own.
+FUNASR_MODEL = None
+TRANSCRIPTION_SCHEDULER = None
+TRANSCRIPTION_CACHE = None
+SERVICE_READY = threading.Event() # Set once the model is loaded and warmed up, see GET /ready
+STARTUP_TIMINGS = {} # load_s / warmup_s of this process, reported by GET /ready
+_service_init_lock = threading.Lock()
+_service_initialized = False
+
+def warm_up_model(model, clip=ASR_WARMUP_CLIP):
+    """
+    Runs ASR_WARMUP_CLIP through one model: once with VAD, then as a padded
+    batch of two, so kernel selection and VAD setup happen before real traffic.
+    """
+    if not clip:
+        return
+    if not os.path.isfile(clip):
+        print(f"WARNING: Warm-up clip '{clip}' not found, skipping warm-up.", file=sys.stderr)
+        return
+    started = time.perf_counter()
+    try:
+        run_transcription_batch(model, [clip], MODEL_SAMPLERATE, use_vad=True)
+        waveform = load_audio_text_image_video(clip, fs=MODEL_SAMPLERATE)
+        run_transcription_batch(model, [waveform, waveform[:len(waveform) // 2]], MODEL_SAMPLERATE, use_vad=False)
+        print(f"INFO: Process {os.getpid()} warmed up in {(time.perf_counter() - started) * 1000:.0f} ms.")
+    except Exception as e:
+        print(f"WARNING: Warm-up failed, the first request will be slower: {e}", file=sys.stderr)
+        traceback.print_exc()
+
+def warm_up_service(clip=ASR_WARMUP_CLIP):
+    """Sends the warm-up clip through the streaming path (VAD, scheduler, replicas) before the cache is attached."""
+    if not clip or not os.path.isfile(clip):
+        return
+    try:
+        waveform = load_audio_text_image_video(clip, fs=MODEL_SAMPLERATE)
+        waveform = waveform.numpy() if isinstance(waveform, torch.Tensor) else np.asarray(waveform, dtype=np.float32)
+        session = StreamingTranscriptionSession(FUNASR_MODEL, TRANSCRIPTION_SCHEDULER, MODEL_SAMPLERATE)
+        session.feed(waveform)
+        session.finish()
+    except Exception as e:
+        print(f"WARNING: Streaming warm-up failed: {e}", file=sys.stderr)
+
+def init_transcription_service():
+    """Loads the model and starts the BatchingScheduler once per process. Safe to call repeatedly."""
+    global FUNASR_MODEL, TRANSCRIPTION_SCHEDULER, TRANSCRIPTION_CACHE, _service_initialized
+    with _service_init_lock:
+        if _service_initialized:
+            return FUNASR_MODEL is not None
+        if ASR_REPLICAS > 0 and DEVICE != "cpu":
+            print(f"WARNING: ASR_REPLICAS is for CPU inference, ignoring it on {DEVICE}.", file=sys.stderr)
+        started = time.perf_counter()
+        if ASR_REPLICAS > 0 and DEVICE == "cpu":
+            TRANSCRIPTION_SCHEDULER = ReplicaPool(ASR_REPLICAS, ASR_THREADS_PER_REPLICA).start() # Replicas warm up before reporting ready
+            FUNASR_MODEL = load_vad_frontend() if TRANSCRIPTION_SCHEDULER is not None else None
+        else:
+            print(f"INFO: Process {os.getpid()} loading FunASR model...")
+            FUNASR_MODEL = load_funasr_sensevoice_model()
+            if FUNASR_MODEL is not None:
+                STARTUP_TIMINGS["load_s"] = round(time.perf_counter() - started, 3)
+                warm_up_model(FUNASR_MODEL)
+                TRANSCRIPTION_SCHEDULER = BatchingScheduler(FUNASR_MODEL).start()
+        if FUNASR_MODEL is None:
+            print("CRITICAL WARNING: Model loading failed, API will not be able to process requests.", file=sys.stderr)
+        else:
+            warm_up_service()
+            if ASR_CACHE:
+                TRANSCRIPTION_CACHE = TranscriptionCache()
+                TRANSCRIPTION_SCHEDULER = CachingScheduler(TRANSCRIPTION_SCHEDULER, TRANSCRIPTION_CACHE)
+            STARTUP_TIMINGS["ready_s"] = round(time.perf_counter() - started, 3)
+            SERVICE_READY.set()
+            print(f"INFO: Process {os.getpid()} ready after {STARTUP_TIMINGS['ready_s']:.1f} s.")
+        _service_initialized = True
+        return FUNASR_MODEL is not None
+
+def resolve_client_audio_path(data):
+    """
+    Validates a /transcribe JSON payload and resolves its 'audio_path' under CWD/audio/.
+
+    *** WARNING: THIS IS AN INSECURE AND UNRELIABLE APPROACH. ***
 
-    # 4. Check for 'audio_path' key in JSON
+    Returns:
+        tuple: (server_audio_path, None) on success, or (None, error_message).
+    """
+    # 1. Check for 'audio_path' key in JSON
     relative_path_from_client = data.get('audio_path')
     if not relative_path_from_client:
         print("ERROR: 'audio_path' key missing or empty in JSON payload.", file=sys.stderr)
-        return jsonify({"error": "Missing 'audio_path' in JSON request body"}), 200
+        return None, "Missing 'audio_path' in JSON request body"
 
     if not isinstance(relative_path_from_client, str):
          print(f"ERROR: 'audio_path' value is not a string: {type(relative_path_from_client)}", file=sys.stderr)
-         return jsonify({"error": "'audio_path' value must be a string"}), 200
+         return None, "'audio_path' value must be a string"
 
-    # --- 5. Path Construction and Basic Validation (INSECURE METHOD) ---
+    # --- 2. Path Construction and Basic Validation (INSECURE METHOD) ---
     server_audio_path = None
     try:
         # Check 1: Disallow absolute paths provided by client
         if os.path.isabs(relative_path_from_client):
             print(f"SECURITY REJECT: Absolute path provided by client: {relative_path_from_client}", file=sys.stderr)
-            return jsonify({"error": "Absolute paths are not allowed"}), 200
+            return None, "Absolute paths are not allowed"
 
         # Check 2: Disallow paths containing '..' to prevent basic traversal
         # WARNING: This might not catch all traversal tricks depending on OS/environment.
         if ".." in relative_path_from_client.split(os.path.sep):
             print(f"SECURITY REJECT: Path contains '..': {relative_path_from_client}", file=sys.stderr)
-            return jsonify({"error": "Directory traversal ('..') is not allowed"}), 200
+            return None, "Directory traversal ('..') is not allowed"
 
         # Construct path relative to the Current Working Directory
         # *** WARNING: CWD can be unpredictable and depends on how the server is run! ***
@@ -162,31 +1212,89 @@ def handle_transcription_by_relative_path_request():
     except Exception as e:
         print(f"ERROR: Error during path processing for '{relative_path_from_client}': {e}", file=sys.stderr)
         traceback.print_exc()
-        return jsonify({"error": "Internal error during path processing"}), 200
+        return None, "Internal error during path processing"
 
 
-    # 6. Check if the constructed file path exists and is a file
+    # 3. Check if the constructed file path exists and is a file
     if not server_audio_path:
          # Should not happen if code above runs correctly, but as a safeguard
          print(f"ERROR: Server audio path was not constructed.", file=sys.stderr)
-         return jsonify({"error": "Internal error processing path"}), 200
+         return None, "Internal error processing path"
 
     if not os.path.exists(server_audio_path):
         print(f"ERROR: Resolved audio file does not exist on server: {server_audio_path}", file=sys.stderr)
-        return jsonify({"error": f"Audio file not found on server at resolved path based on: {relative_path_from_client}"}), 200 # Not Found
+        return None, f"Audio file not found on server at resolved path based on: {relative_path_from_client}"
 
     if not os.path.isfile(server_audio_path):
         print(f"ERROR: Resolved path is not a file: {server_audio_path}", file=sys.stderr)
-        return jsonify({"error": f"Resolved path is not a file based on: {relative_path_from_client}"}), 200 # Bad Request
+        return None, f"Resolved path is not a file based on: {relative_path_from_client}"
+
+    return server_audio_path, None
+
+def finish_request_timings(request_id, spans, started):
+    """Completes a request's span dict with total_ms and the client's X-Request-ID, and logs it."""
+    timings = {name: round(value, 2) if isinstance(value, float) else value for name, value in spans.items()}
+    timings["total_ms"] = round((time.perf_counter() - started) * 1000.0, 2)
+    if request_id:
+        timings["request_id"] = request_id
+    print(f"INFO: Timings [{request_id or '-'}]: {timings}")
+    return timings
+
+# --- Flask Application Initialization ---
+app = Flask(__name__)
+
+@app.before_request
+def ensure_transcription_service():
+    # Covers launchers such as `flask run` that never execute __main__ below.
+    # Other requests wait here while the model loads; /ready answers at once.
+    if request.path != '/ready':
+        init_transcription_service()
+
+
+# --- API Endpoint Definition ---
+# WARNING: This endpoint relies on paths relative to the server's CWD, which is insecure.
+@app.route('/transcribe', methods=['POST'])
+def handle_transcription_by_relative_path_request():
+    """
+    Handles POST requests containing a JSON payload with an 'audio_path' key.
+    The 'audio_path' value should be a relative path. The API will attempt
+    to resolve this path relative to its Current Working Directory (CWD).
+    An optional 'sample_rate' key tags the file's rate; files already at
+    MODEL_SAMPLERATE are decoded directly without resampling.
+
+    *** WARNING: THIS IS AN INSECURE AND UNRELIABLE APPROACH. ***
+    Use the version with ALLOWED_AUDIO_BASE_DIR for production.
+    """
+    # 1. Check if model is loaded
+    if FUNASR_MODEL is None:
+         print("ERROR: Transcription request received, but model is not loaded.", file=sys.stderr)
+         return jsonify({"error": "Server model error, transcription service unavailable"}), 200
+
+    # 2. Check if request body is JSON
+    if not request.is_json:
+        print("ERROR: Request content type is not application/json.", file=sys.stderr)
+        return jsonify({"error": "Request body must be JSON"}), 200
+
+    # 3. Get JSON data
+    data = request.get_json()
+    if not data:
+        print("ERROR: Received empty JSON payload.", file=sys.stderr)
+        return jsonify({"error": "Empty JSON payload received"}), 200
 
+    # 4. Resolve the client path (INSECURE METHOD, see resolve_client_audio_path)
+    server_audio_path, error_message = resolve_client_audio_path(data)
+    if error_message:
+        return jsonify({"error": error_message}), 200
 
-    # --- 7. Perform Transcription ---
+    # --- 5. Perform Transcription ---
     try:
-        transcription_result = transcribe_with_funasr(FUNASR_MODEL, server_audio_path)
+        spans, started = {}, time.perf_counter()
+        transcription_result = transcribe_with_funasr(TRANSCRIPTION_SCHEDULER, server_audio_path, data.get('sample_rate'), spans)
+        timings = finish_request_timings(request.headers.get('X-Request-ID'), spans, started)
 
         if transcription_result is not None:
             print("INFO: Transcription successful.")
-            return jsonify({"transcription": transcription_result}), 200 # OK
+            return jsonify({"transcription": transcription_result, "timings": timings}), 200 # OK
         else:
             print("ERROR: Transcription failed (FunASR function returned None).", file=sys.stderr)
             return jsonify({"error": "Speech transcription processing failed on server"}), 200 # Internal Server Error
@@ -198,17 +1306,109 @@ def handle_transcription_by_relative_path_request():
         return jsonify({"error": "Internal server error during transcription"}), 200
 
 
-# --- Main Entry Point ---
-if __name__ == '__main__':
-    print("Starting FunASR Speech Recognition API (Relative Path Mode)...")
-    print("\n *** WARNING: Running in insecure mode. Paths are resolved relative to CWD. ***")
-    print(" *** This is NOT recommended for production environments. ***\n")
+# --- Streaming Upload Endpoint ---
+@app.route('/transcribe_stream', methods=['POST'])
+def handle_transcription_stream_request():
+    """
+    Handles POST requests whose body is raw PCM audio, typically sent with
+    chunked transfer encoding while the client is still recording.
+
+    The audio format is described by request headers:
+        X-Sample-Rate:   Sample rate in Hz (default 16000).
+        X-Channels:      Number of interleaved channels (default 1).
+        X-Sample-Format: 'float32' (default) or 'int16', little-endian.
+
+    Blocks are decoded and fed to a StreamingTranscriptionSession as they
+    arrive, so nothing is written to disk and speech segments that have already
+    ended are transcribed before the upload finishes. The response contains the
+    merged 'transcription' plus the per-segment 'partials'.
+    """
+    # 1. Check if model is loaded
+    if FUNASR_MODEL is None:
+         print("ERROR: Streaming transcription request received, but model is not loaded.", file=sys.stderr)
+         return jsonify({"error": "Server model error, transcription service unavailable"}), 200
+
+    # 2. Parse audio format headers
+    samplerate, channels, sample_format, error_message = parse_stream_format(request.headers)
+    if error_message:
+        return jsonify({"error": error_message}), 200
+
+    # 3. Feed the body to the session as it arrives
+    session = StreamingTranscriptionSession(FUNASR_MODEL, TRANSCRIPTION_SCHEDULER, samplerate)
+    started = time.perf_counter()
+    try:
+        for block in iter_pcm_stream(request.stream, sample_format, channels):
+            session.feed(block)
+    except Exception as e:
+        print(f"ERROR: Failed while reading streamed audio: {e}", file=sys.stderr)
+        traceback.print_exc()
+        return jsonify({"error": "Failed to read streamed audio"}), 200
+
+    if session.total_samples == 0:
+        print("ERROR: Streaming request contained no audio frames.", file=sys.stderr)
+        return jsonify({"error": "No audio received"}), 200
+
+    # 4. Finish Transcription (only the trailing segment is usually left at this point)
+    try:
+        transcription_result = session.finish()
+        timings = finish_request_timings(request.headers.get('X-Request-ID'), session.spans, started)
+
+        if transcription_result is not None:
+            print("INFO: Streaming transcription successful.")
+            return jsonify({"transcription": transcription_result, "partials": session.partials(), "timings": timings}), 200
+        else:
+            print("ERROR: Streaming transcription failed (no text produced).", file=sys.stderr)
+            return jsonify({"error": "Speech transcription processing failed on server"}), 200
+
+    except Exception as e:
+        print(f"ERROR: Unexpected exception calling streaming transcription function: {e}", file=sys.stderr)
+        traceback.print_exc()
+        return jsonify({"error": "Internal server error during transcription"}), 200
+
+
+# --- Scheduler Statistics Endpoint ---
+@app.route('/stats', methods=['GET'])
+def handle_stats_request():
+    """Returns micro-batching metrics (queue depth, batch-size histogram) and cache hit/miss counters."""
+    if TRANSCRIPTION_SCHEDULER is None:
+        return jsonify({"error": "Server model error, transcription service unavailable"}), 200
+    return jsonify({
+        "scheduler": TRANSCRIPTION_SCHEDULER.stats(),
+        "cache": TRANSCRIPTION_CACHE.stats() if TRANSCRIPTION_CACHE is not None else None,
+    }), 200
+
+
+@app.route('/ready', methods=['GET'])
+def handle_ready_request():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before (or if loading failed)."""
+    if SERVICE_READY.is_set():
+        return jsonify({"ready": True, "startup": STARTUP_TIMINGS}), 200
+    return jsonify({"ready": False, "loading": not _service_initialized}), 503
+
+def _start_service():
+    init_transcription_service()
     if FUNASR_MODEL is None:
          print("\n *** WARNING: Model loading failed. Requests will fail. ***\n", file=sys.stderr)
     else:
         print(f"Model: {MODEL_IDENTIFIER}, Device: {DEVICE}")
+        print(f"Micro-batching: max batch size {BATCH_MAX_SIZE}, max wait {BATCH_MAX_WAIT_MS} ms (metrics at GET /stats)")
+        scheduler = getattr(TRANSCRIPTION_SCHEDULER, "scheduler", TRANSCRIPTION_SCHEDULER)
+        if isinstance(scheduler, ReplicaPool):
+            print(f"CPU replicas: {scheduler.replicas} process(es) x {scheduler.threads} thread(s)")
+        if TRANSCRIPTION_CACHE is not None:
+            print(f"Transcription cache: {TRANSCRIPTION_CACHE.max_entries} entries in memory" + (f", disk tier at {TRANSCRIPTION_CACHE.disk_dir}" if TRANSCRIPTION_CACHE.disk_dir else ""))
         print(f"Current Working Directory at startup: {os.getcwd()}") # Log CWD at startup
 
+# --- Main Entry Point ---
+if __name__ == '__main__':
+    print("Starting FunASR Speech Recognition API (Relative Path Mode)...")
+    print("\n *** WARNING: Running in insecure mode. Paths are resolved relative to CWD. ***")
+    print(" *** This is NOT recommended for production environments. ***")
+    print(" *** For concurrent clients run: python transcribe_server_asgi.py ***\n")
+    # Load in the background so the port opens at once and GET /ready can report progress.
+    threading.Thread(target=_start_service, name="asr-startup", daemon=True).start()
+
     # Run Flask server
     # Use debug=False for production/security
-    app.run(host='0.0.0.0', port=8001, debug=False)
\ No newline at end of file
+    # threaded=True lets concurrent requests reach the BatchingScheduler together
+    app.run(host='0.0.0.0', port=8001, debug=False, threaded=True)
\ No newline at end of file
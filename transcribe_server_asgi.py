@@ -0,0 +1,199 @@
+import os
+import sys
+import time
+import asyncio
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+# Importing the module does not load the model; each worker calls
+# init_transcription_service() from its own lifespan handler.
+import transcribe_audio as asr
+
+# --- Serving Configuration ---
+# Production serving mode for the transcription API: an ASGI app run by uvicorn.
+# Request bodies are read on the event loop, so a slow uploader holds a coroutine
+# and not a thread. Decoding, VAD and model calls run in a bounded thread pool
+# that feeds the BatchingScheduler.
+SERVER_HOST = os.getenv("ASR_SERVER_HOST", "0.0.0.0")
+SERVER_PORT = asr._env_number("ASR_SERVER_PORT", 8001)
+SERVER_WORKERS = max(1, asr._env_number("ASR_SERVER_WORKERS", 1)) # Processes, each with its own model copy
+EXECUTOR_THREADS = max(1, asr._env_number("ASR_EXECUTOR_THREADS", asr.BATCH_MAX_SIZE)) # Enough to fill one batch
+MAX_INFLIGHT = max(1, asr._env_number("ASR_MAX_INFLIGHT", 32)) # Admitted requests per worker
+ADMISSION_TIMEOUT_S = asr._env_number("ASR_ADMISSION_TIMEOUT_S", 30.0, float) # Wait for a slot before answering "busy"
+
+EXECUTOR = None
+INFLIGHT = None
+SERVICE_STARTED = None # Future of init_transcription_service() running in the executor
+inflight_count = 0 # Only touched on the event loop
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    Creates this worker's bounded executor and starts loading (and warming up)
+    the model in it. The worker accepts connections right away: GET /ready
+    answers 503 until the model is ready, and transcription requests wait for it.
+    """
+    global EXECUTOR, INFLIGHT, SERVICE_STARTED
+    EXECUTOR = ThreadPoolExecutor(max_workers=EXECUTOR_THREADS, thread_name_prefix="asr-exec")
+    INFLIGHT = asyncio.Semaphore(MAX_INFLIGHT)
+    SERVICE_STARTED = asyncio.get_running_loop().run_in_executor(EXECUTOR, asr.init_transcription_service)
+    SERVICE_STARTED.add_done_callback(_report_service_started)
+    try:
+        yield
+    finally:
+        EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+def _report_service_started(future):
+    if not future.cancelled() and future.exception() is None and future.result():
+        print(f"INFO: Worker {os.getpid()} ready: {EXECUTOR_THREADS} executor threads, {MAX_INFLIGHT} max in-flight requests.")
+    else:
+        print(f"CRITICAL WARNING: Worker {os.getpid()} has no model, requests will fail.", file=sys.stderr)
+
+def _run_blocking(func, *args):
+    return asyncio.get_running_loop().run_in_executor(EXECUTOR, func, *args)
+
+async def _admit():
+    """Waits up to ADMISSION_TIMEOUT_S for an in-flight slot; returns False if the worker stays saturated."""
+    global inflight_count
+    try:
+        await asyncio.wait_for(INFLIGHT.acquire(), ADMISSION_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        print(f"WARNING: Rejecting request, {MAX_INFLIGHT} requests already in flight.", file=sys.stderr)
+        return False
+    inflight_count += 1
+    return True
+
+def _release():
+    global inflight_count
+    inflight_count -= 1
+    INFLIGHT.release()
+
+# --- API Endpoints (same contract as the Flask routes in transcribe_audio.py) ---
+async def handle_transcription_by_relative_path_request(request):
+    """POST /transcribe with a JSON body {'audio_path': ..., 'sample_rate': ...}."""
+    await asyncio.shield(SERVICE_STARTED) # Requests that arrive during startup wait for the model
+    if asr.FUNASR_MODEL is None:
+        print("ERROR: Transcription request received, but model is not loaded.", file=sys.stderr)
+        return JSONResponse({"error": "Server model error, transcription service unavailable"})
+    try:
+        data = await request.json()
+    except ValueError:
+        print("ERROR: Request body is not valid JSON.", file=sys.stderr)
+        return JSONResponse({"error": "Request body must be JSON"})
+    if not data or not isinstance(data, dict):
+        print("ERROR: Received empty JSON payload.", file=sys.stderr)
+        return JSONResponse({"error": "Empty JSON payload received"})
+
+    if not await _admit():
+        return JSONResponse({"error": "Server busy, try again later"})
+    try:
+        server_audio_path, error_message = await _run_blocking(asr.resolve_client_audio_path, data)
+        if error_message:
+            return JSONResponse({"error": error_message})
+        spans, started = {}, time.perf_counter()
+        transcription_result = await _run_blocking(
+            asr.transcribe_with_funasr, asr.TRANSCRIPTION_SCHEDULER, server_audio_path, data.get('sample_rate'), spans)
+        timings = asr.finish_request_timings(request.headers.get('X-Request-ID'), spans, started)
+        if transcription_result is not None:
+            print("INFO: Transcription successful.")
+            return JSONResponse({"transcription": transcription_result, "timings": timings})
+        print("ERROR: Transcription failed (FunASR function returned None).", file=sys.stderr)
+        return JSONResponse({"error": "Speech transcription processing failed on server"})
+    except Exception as e:
+        print(f"ERROR: Unexpected exception calling transcription function: {e}", file=sys.stderr)
+        traceback.print_exc()
+        return JSONResponse({"error": "Internal server error during transcription"})
+    finally:
+        _release()
+
+async def handle_transcription_stream_request(request):
+    """POST /transcribe_stream with a raw (chunked) PCM body described by X-Sample-* headers."""
+    await asyncio.shield(SERVICE_STARTED)
+    if asr.FUNASR_MODEL is None:
+        print("ERROR: Streaming transcription request received, but model is not loaded.", file=sys.stderr)
+        return JSONResponse({"error": "Server model error, transcription service unavailable"})
+    samplerate, channels, sample_format, error_message = asr.parse_stream_format(request.headers)
+    if error_message:
+        return JSONResponse({"error": error_message})
+
+    if not await _admit():
+        return JSONResponse({"error": "Server busy, try again later"})
+    try:
+        session = asr.StreamingTranscriptionSession(asr.FUNASR_MODEL, asr.TRANSCRIPTION_SCHEDULER, samplerate)
+        decoder = asr.PcmStreamDecoder(sample_format, channels)
+        started = time.perf_counter()
+        try:
+            async for data in request.stream():
+                block = decoder.decode(data)
+                if block is not None:
+                    # Feeds of one session stay sequential; only the VAD step leaves the event loop.
+                    await _run_blocking(session.feed, block)
+            decoder.close()
+        except Exception as e:
+            print(f"ERROR: Failed while reading streamed audio: {e}", file=sys.stderr)
+            traceback.print_exc()
+            return JSONResponse({"error": "Failed to read streamed audio"})
+
+        if session.total_samples == 0:
+            print("ERROR: Streaming request contained no audio frames.", file=sys.stderr)
+            return JSONResponse({"error": "No audio received"})
+
+        transcription_result = await _run_blocking(session.finish)
+        timings = asr.finish_request_timings(request.headers.get('X-Request-ID'), session.spans, started)
+        if transcription_result is not None:
+            print("INFO: Streaming transcription successful.")
+            partials = await _run_blocking(session.partials)
+            return JSONResponse({"transcription": transcription_result, "partials": partials, "timings": timings})
+        print("ERROR: Streaming transcription failed (no text produced).", file=sys.stderr)
+        return JSONResponse({"error": "Speech transcription processing failed on server"})
+    except Exception as e:
+        print(f"ERROR: Unexpected exception calling streaming transcription function: {e}", file=sys.stderr)
+        traceback.print_exc()
+        return JSONResponse({"error": "Internal server error during transcription"})
+    finally:
+        _release()
+
+async def handle_stats_request(request):
+    """GET /stats: scheduler metrics of the worker that served this request, plus its admission state."""
+    if asr.TRANSCRIPTION_SCHEDULER is None:
+        return JSONResponse({"error": "Server model error, transcription service unavailable"})
+    return JSONResponse({
+        "worker_pid": os.getpid(),
+        "inflight": inflight_count,
+        "max_inflight": MAX_INFLIGHT,
+        "scheduler": asr.TRANSCRIPTION_SCHEDULER.stats(),
+        "cache": asr.TRANSCRIPTION_CACHE.stats() if asr.TRANSCRIPTION_CACHE is not None else None,
+    })
+
+async def handle_ready_request(request):
+    """GET /ready: 200 once this worker's model is loaded and warmed up, 503 before (or if loading failed)."""
+    if asr.SERVICE_READY.is_set():
+        return JSONResponse({"ready": True, "worker_pid": os.getpid(), "startup": asr.STARTUP_TIMINGS})
+    return JSONResponse({"ready": False, "worker_pid": os.getpid(), "loading": not SERVICE_STARTED.done()}, status_code=503)
+
+app = Starlette(
+    routes=[
+        Route('/transcribe', handle_transcription_by_relative_path_request, methods=['POST']),
+        Route('/transcribe_stream', handle_transcription_stream_request, methods=['POST']),
+        Route('/stats', handle_stats_request, methods=['GET']),
+        Route('/ready', handle_ready_request, methods=['GET']),
+    ],
+    lifespan=lifespan,
+)
+
+# --- Main Entry Point ---
+if __name__ == '__main__':
+    print("Starting FunASR Speech Recognition API (ASGI serving mode)...")
+    print(f"Model: {asr.MODEL_IDENTIFIER}, Device: {asr.DEVICE}")
+    print(f"Workers: {SERVER_WORKERS} process(es), each loading its own model copy")
+    print(f"Per worker: {EXECUTOR_THREADS} executor threads, {MAX_INFLIGHT} max in-flight requests")
+    print(f"Micro-batching: max batch size {asr.BATCH_MAX_SIZE}, max wait {asr.BATCH_MAX_WAIT_MS} ms (metrics at GET /stats)")
+    print(f"Current Working Directory at startup: {os.getcwd()}")
+    # An import string is required for workers > 1; every worker imports this module and runs lifespan().
+    uvicorn.run("transcribe_server_asgi:app", host=SERVER_HOST, port=SERVER_PORT, workers=SERVER_WORKERS)